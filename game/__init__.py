@@ -16,3 +16,6 @@ from .main import Hisha
 from .main import Gyokushou
 from .main import Match
 from .main import MoveNotFound
+from .main import InvalidSfen
+from .bitboard import Position
+from .bitboard import BitboardMatch
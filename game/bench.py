@@ -0,0 +1,63 @@
+import argparse
+import sys
+from typing import List, Optional, Tuple
+
+from .bitboard import Position
+from .perft import STARTPOS, formatResult
+from .search import search, SearchResult
+from .transposition import TranspositionTable
+
+#searches a set of positions to a fixed depth and counts the nodes, to see how much
+#a change to the search saves (fewer nodes for the same depth) and how fast it runs
+#
+#   python -m game.bench [--depth 3] [--compare] [sfen ...]
+#
+#--compare searches every position a second time without move ordering first,
+#and prints how many times more nodes that took
+
+#positions from games that the search played against itself, as serializeBoardState writes them
+BENCH_POSITIONS: List[Tuple[str, str]] = [
+    ("startpos", STARTPOS),
+    ("opening", "l3g1knl/1b1sgsr2/ppnpppp1p/2p4p1/7N1/8P/PPPPPPPP1/3SGRS2/LN2GKB1L b - 20"),
+    ("middlegame", "l3g1k2/1b1sgs1r1/ppnp1pp1l/2p4Np/4p4/3P2P1P/PPP1PPSP1/2bSGR3/LN2GK2L b Pn 40"),
+    ("drops", "l3g1k2/1b1sgs3/ppnp1p2l/2p3r1p/4p1PP1/P2P4P/1PP1PP1+nR/4G4/L1S1GK2L b PBp2ns 60"),
+]
+
+def benchPosition(sfen: str, depth: int, ordering: bool = True) -> SearchResult:
+    #a fresh table every time, so that the positions don't help each other
+    return search(Position.fromSfen(sfen), max_ms=10 ** 9, max_nodes=10 ** 12, max_depth=depth,
+        tt=TranspositionTable(), ordering=ordering)
+
+def runBench(positions: List[Tuple[str, str]], depth: int, compare: bool) -> Tuple[int, int]:
+    totalNodes = 0
+    totalUnordered = 0
+    totalMs = 0.0
+    for name, sfen in positions:
+        result = benchPosition(sfen, depth)
+        totalNodes += result.nodes
+        totalMs += result.elapsedMs
+        line = f'{name} depth:{result.depth} move:{result.moveString()} {formatResult(result.nodes, result.elapsedMs / 1000)}'
+        if compare:
+            unordered = benchPosition(sfen, depth, ordering=False)
+            totalUnordered += unordered.nodes
+            line += f' unordered:{unordered.nodes} saved:{unordered.nodes / max(result.nodes, 1):.2f}x'
+        print(line)
+    summary = f'total {formatResult(totalNodes, totalMs / 1000)}'
+    if compare:
+        summary += f' unordered:{totalUnordered} saved:{totalUnordered / max(totalNodes, 1):.2f}x'
+    print(summary)
+    return totalNodes, totalUnordered
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m game.bench", description="search positions to a fixed depth and count the nodes")
+    parser.add_argument("sfen", nargs="*", help="positions to search instead of the bench set")
+    parser.add_argument("--depth", type=int, default=3, help="the depth to search every position to")
+    parser.add_argument("--compare", action="store_true", help="also search without move ordering and compare the node counts")
+    args = parser.parse_args(argv)
+
+    positions = [(f'position{i + 1}', sfen) for i, sfen in enumerate(args.sfen)] or BENCH_POSITIONS
+    runBench(positions, args.depth, args.compare)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
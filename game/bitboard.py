@@ -0,0 +1,925 @@
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from .main import Player, Koma, Masu, Banmen, Hand, Move, Match, MoveNotFound, InvalidSfen, splitSfen, KOMA_TYPES
+from .main import MOVE_DROP, MOVE_TO_SHIFT, MOVE_PROMOTE_FLAG, MOVE_CODE_SHIFT, MOVE_SQUARE_MASK
+from .main import KOMA_CLASSES, HAND_ORDER, serializeHandCounts
+from .zobrist import MAX_HAND_COUNT
+from .zobrist import PIECE_KEYS, HAND_KEYS, SIDE_KEY, handKey
+
+#an alternative position core for the Match
+#instead of a 9x9 grid of Masu objects, the occupancy of each side and piece type
+#is packed into a python int, one bit per square
+#
+#squares are indexed file major so that they line up with Banmen.grid[x][y]
+#   sq = x * 9 + y
+#which means that walking along a rank adds 9 to the index and walking along a file adds 1
+
+SENTE = 0
+GOTE = 1
+
+#piece types, a promoted piece is its base type + PROMOTED
+EMPTY = 0
+PAWN = 1
+LANCE = 2
+KNIGHT = 3
+SILVER = 4
+GOLD = 5
+BISHOP = 6
+ROOK = 7
+KING = 8
+PROMOTED = 8
+PRO_PAWN = PAWN + PROMOTED
+PRO_LANCE = LANCE + PROMOTED
+PRO_KNIGHT = KNIGHT + PROMOTED
+PRO_SILVER = SILVER + PROMOTED
+HORSE = BISHOP + PROMOTED
+DRAGON = ROOK + PROMOTED
+
+#the board stores piece codes, the piece type in the low 4 bits and the side above it
+#so sente's pieces are 1-15 and gote's pieces are 17-31
+SIDE_SHIFT = 4
+TYPE_MASK = 15
+
+#moves are packed into an int, the layout is described with MOVE_DROP in main.py
+#   from square | to square << TO_SHIFT | PROMOTE_FLAG | moving piece code << CODE_SHIFT
+#a drop's from square is DROP + the piece type, DROP itself is square 80 so drops are > DROP
+DROP = MOVE_DROP
+TO_SHIFT = MOVE_TO_SHIFT
+PROMOTE_FLAG = MOVE_PROMOTE_FLAG
+CODE_SHIFT = MOVE_CODE_SHIFT
+SQUARE_MASK = MOVE_SQUARE_MASK
+#lists of moves are kept in this array type, the moves need 20 bits
+MOVE_ARRAY_TYPE = "I"
+
+ALL_SQUARES = (1 << 81) - 1
+
+#KOMA_TYPES maps each Koma class to the piece types above, and KOMA_CLASSES maps them back
+
+PIECE_LETTERS = {
+    PAWN: "p", LANCE: "l", KNIGHT: "n", SILVER: "s", GOLD: "g",
+    BISHOP: "b", ROOK: "r", KING: "k",
+}
+LETTER_TYPES = {letter: pieceType for pieceType, letter in PIECE_LETTERS.items()}
+
+#HAND_ORDER is PAWN, GOLD, KNIGHT, SILVER, BISHOP, ROOK, LANCE, the same order that Hand serializes in
+
+def makeCode(pieceType: int, side: int) -> int:
+    return pieceType | (side << SIDE_SHIFT)
+
+def squareOf(x: int, y: int) -> int:
+    return x * 9 + y
+
+def baseType(pieceType: int) -> int:
+    return pieceType - PROMOTED if pieceType > KING else pieceType
+
+def encodeCode(code: int) -> str:
+    pieceType = code & TYPE_MASK
+    letter = PIECE_LETTERS[baseType(pieceType)]
+    if pieceType > KING:
+        letter = "+" + letter
+    return letter.upper() if code >> SIDE_SHIFT == SENTE else letter
+
+#piece letters as Koma.encode writes them, indexed by piece code
+CODE_LETTERS = [""] * 32
+for _side in (SENTE, GOTE):
+    for _pieceType in range(PAWN, DRAGON + 1):
+        if _pieceType == PROMOTED + GOLD:
+            continue
+        CODE_LETTERS[makeCode(_pieceType, _side)] = encodeCode(makeCode(_pieceType, _side))
+
+SQUARE_NAMES = [f'{sq // 9}{sq % 9}' for sq in range(81)]
+SQUARE_INDEX = {name: sq for sq, name in enumerate(SQUARE_NAMES)}
+
+def squares(bb: int):
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+#attack tables
+#step deltas are written from sente's point of view, gote's are the same deltas flipped
+GOLD_DELTAS = ((1, -1), (0, -1), (-1, -1), (1, 0), (-1, 0), (0, 1))
+ORTHOGONAL_DELTAS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+DIAGONAL_DELTAS = ((1, -1), (1, 1), (-1, -1), (-1, 1))
+STEP_DELTAS = {
+    PAWN: ((0, -1),),
+    KNIGHT: ((1, -2), (-1, -2)),
+    SILVER: ((1, -1), (0, -1), (-1, -1), (1, 1), (-1, 1)),
+    GOLD: GOLD_DELTAS,
+    KING: ORTHOGONAL_DELTAS + DIAGONAL_DELTAS,
+    PRO_PAWN: GOLD_DELTAS,
+    PRO_LANCE: GOLD_DELTAS,
+    PRO_KNIGHT: GOLD_DELTAS,
+    PRO_SILVER: GOLD_DELTAS,
+    #the promoted sliders gain the king moves that their slides don't cover
+    HORSE: ORTHOGONAL_DELTAS,
+    DRAGON: DIAGONAL_DELTAS,
+}
+
+def buildStepAttacks() -> List[List[List[int]]]:
+    #stepAttacks[side][pieceType][sq]
+    stepAttacks = [[[0] * 81 for _ in range(16)] for _ in (SENTE, GOTE)]
+    for pieceType, deltas in STEP_DELTAS.items():
+        for sq in range(81):
+            x, y = divmod(sq, 9)
+            for side, flip in ((SENTE, 1), (GOTE, -1)):
+                bb = 0
+                for dx, dy in deltas:
+                    tX = x + dx * flip
+                    tY = y + dy * flip
+                    if -1 < tX < 9 and -1 < tY < 9:
+                        bb |= 1 << squareOf(tX, tY)
+                stepAttacks[side][pieceType][sq] = bb
+    return stepAttacks
+
+STEP_ATTACKS = buildStepAttacks()
+
+DIRECTIONS = ORTHOGONAL_DELTAS + DIAGONAL_DELTAS
+#how much the square index changes per step in each direction
+DIRECTION_STEPS = [dx * 9 + dy for dx, dy in DIRECTIONS]
+ORTHOGONAL_DIRECTIONS = (0, 1, 2, 3)
+DIAGONAL_DIRECTIONS = (4, 5, 6, 7)
+#the direction a lance slides in for each side, (0, -1) for sente and (0, 1) for gote
+LANCE_DIRECTIONS = (1, 0)
+
+def buildRays() -> List[List[int]]:
+    #rays[direction][sq] is every square from sq to the edge of the board, sq excluded
+    rays = [[0] * 81 for _ in DIRECTIONS]
+    for direction, (dx, dy) in enumerate(DIRECTIONS):
+        for sq in range(81):
+            x, y = divmod(sq, 9)
+            bb = 0
+            tX = x + dx
+            tY = y + dy
+            while -1 < tX < 9 and -1 < tY < 9:
+                bb |= 1 << squareOf(tX, tY)
+                tX += dx
+                tY += dy
+            rays[direction][sq] = bb
+    return rays
+
+RAYS = buildRays()
+#every square that is on a line with sq, used to find the pieces that could be pinned to the king
+ALIGNED = [0] * 81
+for _sq in range(81):
+    for _direction in range(len(DIRECTIONS)):
+        ALIGNED[_sq] |= RAYS[_direction][_sq]
+
+def rayAttacks(sq: int, direction: int, occupied: int) -> int:
+    ray = RAYS[direction][sq]
+    blockers = ray & occupied
+    if blockers:
+        #the ray runs towards higher indexes when the step is positive, so the nearest
+        #blocker is the lowest bit, otherwise it is the highest bit
+        if DIRECTION_STEPS[direction] > 0:
+            blocker = (blockers & -blockers).bit_length() - 1
+        else:
+            blocker = blockers.bit_length() - 1
+        ray ^= RAYS[direction][blocker]
+    return ray
+
+def attacksFrom(code: int, sq: int, occupied: int) -> int:
+    side = code >> SIDE_SHIFT
+    pieceType = code & TYPE_MASK
+    attacks = STEP_ATTACKS[side][pieceType][sq]
+    if pieceType == LANCE:
+        attacks |= rayAttacks(sq, LANCE_DIRECTIONS[side], occupied)
+    elif pieceType == BISHOP or pieceType == HORSE:
+        for direction in DIAGONAL_DIRECTIONS:
+            attacks |= rayAttacks(sq, direction, occupied)
+    elif pieceType == ROOK or pieceType == DRAGON:
+        for direction in ORTHOGONAL_DIRECTIONS:
+            attacks |= rayAttacks(sq, direction, occupied)
+    return attacks
+
+def rankMask(*ranks: int) -> int:
+    bb = 0
+    for x in range(9):
+        for y in ranks:
+            bb |= 1 << squareOf(x, y)
+    return bb
+
+FILE_MASKS = [((1 << 9) - 1) << (x * 9) for x in range(9)]
+PROMOTION_ZONE = (rankMask(0, 1, 2), rankMask(6, 7, 8))
+#a pawn or lance that reaches these squares must promote
+LAST_RANK = (rankMask(0), rankMask(8))
+#a knight that reaches these squares must promote
+LAST_TWO_RANKS = (rankMask(0, 1), rankMask(7, 8))
+
+#squares that a piece from the hand can be placed on, before looking at what is on the board
+#these follow the piece rules in main.py
+DROP_MASKS = [[ALL_SQUARES] * 8 for _ in (SENTE, GOTE)]
+DROP_MASKS[SENTE][PAWN] = DROP_MASKS[SENTE][LANCE] = ALL_SQUARES & ~rankMask(0)
+DROP_MASKS[GOTE][PAWN] = DROP_MASKS[GOTE][LANCE] = ALL_SQUARES & ~rankMask(8)
+DROP_MASKS[SENTE][KNIGHT] = ALL_SQUARES & ~rankMask(0, 1)
+DROP_MASKS[GOTE][KNIGHT] = ALL_SQUARES & ~rankMask(7, 8)
+
+#the wire string of every move that a piece could make on an empty board, keyed by the packed move
+#the strings are the same as Move.serialize, so nothing has to be formatted per turn
+def buildMoveStrings() -> Dict[int, str]:
+    strings: Dict[int, str] = {}
+    for side in (SENTE, GOTE):
+        zone = PROMOTION_ZONE[side]
+        for pieceType in range(PAWN, DRAGON + 1):
+            if pieceType == PROMOTED + GOLD:
+                continue
+            code = makeCode(pieceType, side)
+            promotes = pieceType < KING and pieceType != GOLD
+            for frm in range(81):
+                src = SQUARE_NAMES[frm] + CODE_LETTERS[code] + " "
+                for to in squares(attacksFrom(code, frm, 0)):
+                    move = frm | to << TO_SHIFT | code << CODE_SHIFT
+                    strings[move] = src + SQUARE_NAMES[to] + CODE_LETTERS[code]
+                    if promotes and (zone >> frm & 1 or zone >> to & 1):
+                        strings[move | PROMOTE_FLAG] = src + SQUARE_NAMES[to] + CODE_LETTERS[code | PROMOTED]
+        for pieceType in HAND_ORDER:
+            code = makeCode(pieceType, side)
+            for to in range(81):
+                strings[DROP + pieceType | to << TO_SHIFT | code << CODE_SHIFT] = SQUARE_NAMES[to] + CODE_LETTERS[code]
+    return strings
+
+MOVE_STRINGS = buildMoveStrings()
+#and back again, for the moves sent by the client
+MOVE_CODES: Dict[str, int] = {string: move for move, string in MOVE_STRINGS.items()}
+
+def moveToString(move: int) -> str:
+    return MOVE_STRINGS[move]
+
+def moveFromString(string_move: str) -> Optional[int]:
+    return MOVE_CODES.get(string_move)
+
+def komaFromCode(code: int) -> Koma:
+    pieceType = code & TYPE_MASK
+    koma = KOMA_CLASSES[baseType(pieceType)](code >> SIDE_SHIFT == SENTE)
+    if pieceType > KING:
+        koma.Promote()
+    return koma
+
+def codeFromKoma(koma: Koma) -> int:
+    pieceType = KOMA_TYPES[type(koma)]
+    if koma.isPromoted():
+        pieceType += PROMOTED
+    return makeCode(pieceType, SENTE if koma.isSente() else GOTE)
+
+class Position:
+    #board[sq] holds a piece code, or EMPTY
+    board: List[int]
+    #pieces[side][pieceType] is the bitboard of that side's pieces of that type
+    pieces: List[List[int]]
+    #occupied[side] is the bitboard of every square that side has a piece on
+    occupied: List[int]
+    #hand[side][pieceType] is the number of pieces of the unpromoted type that side holds
+    hand: List[List[int]]
+    kingSquare: List[int]
+    sideToMove: int
+    #zobrist keys of the board and of the hands, putPiece and removePiece keep boardKey
+    #up to date and makeMove keeps handKey up to date
+    boardKey: int
+    handKey: int
+
+    def __init__(self) -> None:
+        self.board = [EMPTY] * 81
+        self.pieces = [[0] * 16, [0] * 16]
+        self.occupied = [0, 0]
+        self.hand = [[0] * 8, [0] * 8]
+        self.kingSquare = [-1, -1]
+        self.sideToMove = SENTE
+        self.boardKey = 0
+        self.handKey = 0
+
+    @classmethod
+    def fromBanmen(cls, banmen: Banmen, hand: Hand, senteToMove: bool) -> "Position":
+        position = cls()
+        position.loadBanmen(banmen)
+        position.loadHand(hand)
+        position.sideToMove = SENTE if senteToMove else GOTE
+        return position
+
+    #reads the board, side to move and hands, the move number is ignored
+    #the board is read the same way that serializeBoardState writes it
+    @classmethod
+    def fromSfen(cls, sfen: str) -> "Position":
+        board, isSente, handSfen, _ = splitSfen(sfen)
+        ranks = board.split("/")
+        if len(ranks) != 9:
+            raise InvalidSfen(f'sfen board needs 9 ranks:"{sfen}"')
+
+        position = cls()
+        for y, rank in enumerate(ranks):
+            x = 0
+            promoted = False
+            for letter in rank:
+                if letter.isdigit():
+                    x += int(letter)
+                    continue
+                if letter == "+":
+                    promoted = True
+                    continue
+                pieceType = LETTER_TYPES.get(letter.lower())
+                if pieceType is None or x > 8 or (promoted and (pieceType == GOLD or pieceType == KING)):
+                    raise InvalidSfen(f'bad rank "{rank}" in sfen:"{sfen}"')
+                if promoted:
+                    pieceType += PROMOTED
+                    promoted = False
+                position.putPiece(makeCode(pieceType, SENTE if letter.isupper() else GOTE), squareOf(x, y))
+                x += 1
+            if x != 9 or promoted:
+                raise InvalidSfen(f'rank "{rank}" does not have 9 squares in sfen:"{sfen}"')
+
+        position.sideToMove = SENTE if isSente else GOTE
+        if handSfen != "-":
+            count = 0
+            for letter in handSfen:
+                if letter.isdigit():
+                    count = count * 10 + int(letter)
+                    continue
+                pieceType = LETTER_TYPES.get(letter.lower())
+                if pieceType is None or pieceType == KING:
+                    raise InvalidSfen(f'bad hand "{handSfen}" in sfen:"{sfen}"')
+                side = SENTE if letter.isupper() else GOTE
+                position.hand[side][pieceType] += max(count, 1)
+                if position.hand[side][pieceType] > MAX_HAND_COUNT:
+                    raise InvalidSfen(f'too many held pieces in sfen:"{sfen}"')
+                count = 0
+            position.handKey = handKey(position.hand)
+        return position
+
+    @classmethod
+    def fromMatch(cls, match: Match) -> "Position":
+        if isinstance(match, BitboardMatch):
+            match.syncTurn()
+            return match.position.copy()
+        return cls.fromBanmen(match.grid, match.hand, match.current_turn.isSente())
+
+    def copy(self) -> "Position":
+        position = Position()
+        position.board = self.board[:]
+        position.pieces = [self.pieces[SENTE][:], self.pieces[GOTE][:]]
+        position.occupied = self.occupied[:]
+        position.hand = [self.hand[SENTE][:], self.hand[GOTE][:]]
+        position.kingSquare = self.kingSquare[:]
+        position.sideToMove = self.sideToMove
+        position.boardKey = self.boardKey
+        position.handKey = self.handKey
+        return position
+
+    def clearBoard(self):
+        self.board = [EMPTY] * 81
+        self.pieces = [[0] * 16, [0] * 16]
+        self.occupied = [0, 0]
+        self.kingSquare = [-1, -1]
+        self.boardKey = 0
+
+    def loadBanmen(self, banmen: Banmen):
+        self.clearBoard()
+        for x in range(0, 9):
+            for y in range(0, 9):
+                koma = banmen.grid[x][y].getKoma()
+                if koma is not None:
+                    self.putPiece(codeFromKoma(koma), squareOf(x, y))
+
+    #Hand.counts is laid out the same way as Position.hand
+    def loadHand(self, hand: Hand):
+        self.hand = [hand.counts[SENTE][:], hand.counts[GOTE][:]]
+        self.handKey = handKey(self.hand)
+
+    def toBanmen(self) -> Banmen:
+        banmen = Banmen()
+        banmen.clearPieces()
+        for sq in squares(self.occupied[SENTE] | self.occupied[GOTE]):
+            x, y = divmod(sq, 9)
+            banmen.grid[x][y].setKoma(komaFromCode(self.board[sq]))
+        return banmen
+
+    def toHand(self) -> Hand:
+        hand = Hand()
+        hand.counts = [self.hand[SENTE][:], self.hand[GOTE][:]]
+        return hand
+
+    def putPiece(self, code: int, sq: int):
+        side = code >> SIDE_SHIFT
+        pieceType = code & TYPE_MASK
+        bit = 1 << sq
+        self.board[sq] = code
+        self.pieces[side][pieceType] |= bit
+        self.occupied[side] |= bit
+        self.boardKey ^= PIECE_KEYS[code][sq]
+        if pieceType == KING:
+            self.kingSquare[side] = sq
+
+    def removePiece(self, sq: int) -> int:
+        code = self.board[sq]
+        side = code >> SIDE_SHIFT
+        bit = 1 << sq
+        self.board[sq] = EMPTY
+        self.pieces[side][code & TYPE_MASK] ^= bit
+        self.occupied[side] ^= bit
+        self.boardKey ^= PIECE_KEYS[code][sq]
+        return code
+
+    #a 64 bit key for the position, the same key that Match.positionKey gives
+    def positionKey(self) -> int:
+        if self.sideToMove == SENTE:
+            return self.boardKey ^ self.handKey
+        return self.boardKey ^ self.handKey ^ SIDE_KEY
+
+    def isAttacked(self, sq: int, bySide: int, occupied: Optional[int] = None) -> bool:
+        if occupied is None:
+            occupied = self.occupied[SENTE] | self.occupied[GOTE]
+        pieces = self.pieces[bySide]
+        #a piece on s attacks sq exactly when the same piece of the other side on sq would attack s
+        #so the step attacks are looked up from the target square with the defender's tables
+        steps = STEP_ATTACKS[bySide ^ 1]
+        if steps[PAWN][sq] & pieces[PAWN]:
+            return True
+        if steps[KNIGHT][sq] & pieces[KNIGHT]:
+            return True
+        if steps[SILVER][sq] & pieces[SILVER]:
+            return True
+        golds = pieces[GOLD] | pieces[PRO_PAWN] | pieces[PRO_LANCE] | pieces[PRO_KNIGHT] | pieces[PRO_SILVER]
+        if steps[GOLD][sq] & golds:
+            return True
+        if steps[KING][sq] & (pieces[KING] | pieces[HORSE] | pieces[DRAGON]):
+            return True
+        if pieces[LANCE] and rayAttacks(sq, LANCE_DIRECTIONS[bySide ^ 1], occupied) & pieces[LANCE]:
+            return True
+        rooks = pieces[ROOK] | pieces[DRAGON]
+        if rooks:
+            for direction in ORTHOGONAL_DIRECTIONS:
+                if rayAttacks(sq, direction, occupied) & rooks:
+                    return True
+        bishops = pieces[BISHOP] | pieces[HORSE]
+        if bishops:
+            for direction in DIAGONAL_DIRECTIONS:
+                if rayAttacks(sq, direction, occupied) & bishops:
+                    return True
+        return False
+
+    def inCheck(self, side: Optional[int] = None) -> bool:
+        if side is None:
+            side = self.sideToMove
+        kingSquare = self.kingSquare[side]
+        if kingSquare < 0:
+            return False
+        return self.isAttacked(kingSquare, side ^ 1)
+
+    #capturesOnly leaves out the moves to empty squares and the drops, for the quiescence search
+    #origins is a bitboard of the squares whose pieces are moved, and dropTypes the pieces that are dropped
+    def generatePseudoLegalMoves(self, capturesOnly: bool = False, origins: int = ALL_SQUARES,
+            dropTypes: Tuple[int, ...] = HAND_ORDER) -> List[int]:
+        side = self.sideToMove
+        own = self.occupied[side]
+        occupied = own | self.occupied[side ^ 1]
+        allowed = self.occupied[side ^ 1] if capturesOnly else ~own
+        zone = PROMOTION_ZONE[side]
+        lastRank = LAST_RANK[side]
+        lastTwoRanks = LAST_TWO_RANKS[side]
+        moves: List[int] = []
+        append = moves.append
+
+        for frm in squares(own & origins):
+            code = self.board[frm]
+            pieceType = code & TYPE_MASK
+            targets = attacksFrom(code, frm, occupied) & allowed
+            if not targets:
+                continue
+            origin = frm | code << CODE_SHIFT
+            if pieceType == PAWN or pieceType == LANCE:
+                for to in squares(targets):
+                    move = origin | (to << TO_SHIFT)
+                    if zone >> to & 1:
+                        append(move | PROMOTE_FLAG)
+                    if not lastRank >> to & 1:
+                        append(move)
+            elif pieceType == KNIGHT:
+                for to in squares(targets):
+                    move = origin | (to << TO_SHIFT)
+                    if zone >> to & 1:
+                        append(move | PROMOTE_FLAG)
+                    if not lastTwoRanks >> to & 1:
+                        append(move)
+            elif pieceType == SILVER or pieceType == BISHOP or pieceType == ROOK:
+                fromZone = zone >> frm & 1
+                for to in squares(targets):
+                    move = origin | (to << TO_SHIFT)
+                    if fromZone or zone >> to & 1:
+                        append(move | PROMOTE_FLAG)
+                    append(move)
+            else:
+                for to in squares(targets):
+                    append(origin | (to << TO_SHIFT))
+
+        if capturesOnly:
+            return moves
+        empty = ALL_SQUARES & ~occupied
+        hand = self.hand[side]
+        for pieceType in dropTypes:
+            if not hand[pieceType]:
+                continue
+            targets = empty & DROP_MASKS[side][pieceType]
+            if pieceType == PAWN:
+                pawns = self.pieces[side][PAWN]
+                for x in range(9):
+                    if pawns & FILE_MASKS[x]:
+                        targets &= ~FILE_MASKS[x]
+            drop = DROP + pieceType | makeCode(pieceType, side) << CODE_SHIFT
+            for to in squares(targets):
+                append(drop | (to << TO_SHIFT))
+        return moves
+
+    def generateMoves(self, capturesOnly: bool = False, origins: int = ALL_SQUARES,
+            dropTypes: Tuple[int, ...] = HAND_ORDER) -> array:
+        side = self.sideToMove
+        kingSquare = self.kingSquare[side]
+        moves = self.generatePseudoLegalMoves(capturesOnly, origins, dropTypes)
+        if kingSquare < 0:
+            return moves
+
+        inCheck = self.isAttacked(kingSquare, side ^ 1)
+        #outside of check, only the king and the pieces that are lined up with
+        #the king can put the king in danger by moving
+        aligned = ALIGNED[kingSquare]
+        #a fuhyou dropped on this square checks the enemy king, and is not allowed if it mates
+        enemyKing = self.kingSquare[side ^ 1]
+        pawnCheckDrop = DROP + PAWN | (enemyKing + (1 if side == SENTE else -1)) << TO_SHIFT | makeCode(PAWN, side) << CODE_SHIFT
+        legal: List[int] = []
+        for move in moves:
+            frm = move & SQUARE_MASK
+            if frm > DROP:
+                if inCheck and not self.isLegal(move):
+                    continue
+                if move == pawnCheckDrop and enemyKing >= 0 and self.isPawnDropMate(move):
+                    continue
+            elif frm == kingSquare:
+                if not self.kingMoveIsSafe(move):
+                    continue
+            elif (inCheck or aligned >> frm & 1) and not self.isLegal(move):
+                continue
+            legal.append(move)
+        return array(MOVE_ARRAY_TYPE, legal)
+
+    #the legal moves of the piece on sq, for a client that asks about one piece at a time
+    def generateMovesFrom(self, sq: int) -> array:
+        return self.generateMoves(origins=1 << sq, dropTypes=())
+
+    #the legal drops of one type of piece from the hand
+    def generateDrops(self, pieceType: int) -> array:
+        return self.generateMoves(origins=0, dropTypes=(pieceType,))
+
+    #whether the side to move has any legal move, it stops at the first one instead of
+    #checking all of them, to find out if the game is over
+    def hasLegalMoves(self) -> bool:
+        return any(self.isLegalMove(move) for move in self.generatePseudoLegalMoves())
+
+    #whether a move, such as one sent by a client, is legal, checked on its own
+    #without generating the other moves, it follows the same rules as generateMoves
+    def isLegalMove(self, move: int) -> bool:
+        side = self.sideToMove
+        frm = move & SQUARE_MASK
+        to = (move >> TO_SHIFT) & SQUARE_MASK
+        code = move >> CODE_SHIFT
+        if to > 80 or code >> SIDE_SHIFT != side:
+            return False
+        if frm > DROP:
+            pieceType = frm - DROP
+            if pieceType not in HAND_ORDER or code != makeCode(pieceType, side) or move & PROMOTE_FLAG:
+                return False
+            if not self.hand[side][pieceType] or self.board[to] != EMPTY or not DROP_MASKS[side][pieceType] >> to & 1:
+                return False
+            if pieceType == PAWN and self.pieces[side][PAWN] & FILE_MASKS[to // 9]:
+                return False
+        else:
+            if self.board[frm] != code:
+                return False
+            occupied = self.occupied[SENTE] | self.occupied[GOTE]
+            if not (attacksFrom(code, frm, occupied) & ~self.occupied[side]) >> to & 1:
+                return False
+            pieceType = code & TYPE_MASK
+            zone = PROMOTION_ZONE[side]
+            if move & PROMOTE_FLAG:
+                #fuhyou, kyousha and keima promote on the way into the zone, the others on the way out too
+                if pieceType == PAWN or pieceType == LANCE or pieceType == KNIGHT:
+                    if not zone >> to & 1:
+                        return False
+                elif pieceType == SILVER or pieceType == BISHOP or pieceType == ROOK:
+                    if not (zone >> frm & 1 or zone >> to & 1):
+                        return False
+                else:
+                    return False
+            elif (pieceType == PAWN or pieceType == LANCE) and LAST_RANK[side] >> to & 1:
+                return False
+            elif pieceType == KNIGHT and LAST_TWO_RANKS[side] >> to & 1:
+                return False
+
+        kingSquare = self.kingSquare[side]
+        if kingSquare < 0:
+            return True
+        if frm == kingSquare:
+            return self.kingMoveIsSafe(move)
+        if not self.isLegal(move):
+            return False
+        if frm == DROP + PAWN:
+            enemyKing = self.kingSquare[side ^ 1]
+            if enemyKing >= 0 and to == enemyKing + (1 if side == SENTE else -1) and self.isPawnDropMate(move):
+                return False
+        return True
+
+    #the legal moves that put the enemy king in check, for the mate solver
+    def generateChecks(self) -> array:
+        side = self.sideToMove
+        enemyKing = self.kingSquare[side ^ 1]
+        if enemyKing < 0:
+            return array(MOVE_ARRAY_TYPE)
+        kingBit = 1 << enemyKing
+        #a piece that moves off of a line through the king can uncover a check from behind it
+        aligned = ALIGNED[enemyKing]
+        occupied = self.occupied[SENTE] | self.occupied[GOTE]
+        checks: List[int] = []
+        for move in self.generateMoves():
+            frm = move & SQUARE_MASK
+            to = (move >> TO_SHIFT) & SQUARE_MASK
+            code = move >> CODE_SHIFT
+            if frm > DROP:
+                if attacksFrom(code, to, occupied) & kingBit:
+                    checks.append(move)
+                continue
+            if aligned >> frm & 1:
+                undo = self.makeMove(move)
+                if self.inCheck(side ^ 1):
+                    checks.append(move)
+                self.unmakeMove(undo)
+                continue
+            landed = code | PROMOTED if move & PROMOTE_FLAG else code
+            if attacksFrom(landed, to, occupied ^ (1 << frm) | (1 << to)) & kingBit:
+                checks.append(move)
+        return array(MOVE_ARRAY_TYPE, checks)
+
+    def kingMoveIsSafe(self, move: int) -> bool:
+        side = self.sideToMove
+        frm = move & SQUARE_MASK
+        to = (move >> TO_SHIFT) & SQUARE_MASK
+        #the king is taken off of the board so that sliders can attack the squares behind it
+        occupied = (self.occupied[SENTE] | self.occupied[GOTE]) & ~(1 << frm)
+        captured = self.board[to]
+        if captured == EMPTY:
+            return not self.isAttacked(to, side ^ 1, occupied)
+        #the captured piece can't defend the square it was standing on
+        self.removePiece(to)
+        safe = not self.isAttacked(to, side ^ 1, occupied)
+        self.putPiece(captured, to)
+        return safe
+
+    #uchifuzume, the opponent has no answer to the check from the dropped fuhyou
+    #a fuhyou check can't be blocked, so the replies looked at here never reach this check again
+    def isPawnDropMate(self, move: int) -> bool:
+        undo = self.makeMove(move)
+        mate = len(self.generateMoves()) == 0
+        self.unmakeMove(undo)
+        return mate
+
+    def isLegal(self, move: int) -> bool:
+        side = self.sideToMove
+        undo = self.makeMove(move)
+        legal = not self.inCheck(side)
+        self.unmakeMove(undo)
+        return legal
+
+    def makeMove(self, move: int) -> Tuple[int, int, int]:
+        side = self.sideToMove
+        frm = move & SQUARE_MASK
+        to = (move >> TO_SHIFT) & SQUARE_MASK
+        if frm > DROP:
+            pieceType = frm - DROP
+            count = self.hand[side][pieceType]
+            self.hand[side][pieceType] = count - 1
+            self.handKey ^= HAND_KEYS[side][pieceType][count] ^ HAND_KEYS[side][pieceType][count - 1]
+            code = makeCode(pieceType, side)
+            self.putPiece(code, to)
+            captured = EMPTY
+        else:
+            code = self.removePiece(frm)
+            captured = self.board[to]
+            if captured != EMPTY:
+                self.removePiece(to)
+                #& 7 strips the promotion, promoted pieces go back to the hand as their base type
+                pieceType = captured & 7
+                count = self.hand[side][pieceType]
+                self.hand[side][pieceType] = count + 1
+                self.handKey ^= HAND_KEYS[side][pieceType][count] ^ HAND_KEYS[side][pieceType][count + 1]
+            self.putPiece(code | PROMOTED if move & PROMOTE_FLAG else code, to)
+        self.sideToMove = side ^ 1
+        return (move, code, captured)
+
+    def unmakeMove(self, undo: Tuple[int, int, int]):
+        move, code, captured = undo
+        side = self.sideToMove ^ 1
+        frm = move & SQUARE_MASK
+        to = (move >> TO_SHIFT) & SQUARE_MASK
+        self.removePiece(to)
+        if frm > DROP:
+            pieceType = frm - DROP
+            count = self.hand[side][pieceType]
+            self.hand[side][pieceType] = count + 1
+            self.handKey ^= HAND_KEYS[side][pieceType][count] ^ HAND_KEYS[side][pieceType][count + 1]
+        else:
+            self.putPiece(code, frm)
+            if captured != EMPTY:
+                pieceType = captured & 7
+                count = self.hand[side][pieceType]
+                self.hand[side][pieceType] = count - 1
+                self.handKey ^= HAND_KEYS[side][pieceType][count] ^ HAND_KEYS[side][pieceType][count - 1]
+                self.putPiece(captured, to)
+        self.sideToMove = side
+
+    def moveToString(self, move: int) -> str:
+        return MOVE_STRINGS[move]
+
+    def toMove(self, move: int) -> Move:
+        frm = move & SQUARE_MASK
+        to = (move >> TO_SHIFT) & SQUARE_MASK
+        code = move >> CODE_SHIFT
+        landed = code | PROMOTED if move & PROMOTE_FLAG else code
+        srcSquare = None
+        if frm <= DROP:
+            srcSquare = Masu(frm // 9, frm % 9, komaFromCode(code))
+        return Move(srcSquare, Masu(to // 9, to % 9, komaFromCode(landed)))
+
+    def serialize(self) -> str:
+        #same output as Match.serializeBoardState
+        board = self.board
+        ranks = []
+        for y in range(0, 9):
+            rank = ""
+            emptyMasu = 0
+            for x in range(0, 9):
+                code = board[x * 9 + y]
+                if code == EMPTY:
+                    emptyMasu += 1
+                    continue
+                if emptyMasu > 0:
+                    rank += str(emptyMasu)
+                    emptyMasu = 0
+                rank += CODE_LETTERS[code]
+            if emptyMasu > 0:
+                rank += str(emptyMasu)
+            ranks.append(rank)
+        sfen = "/".join(ranks)
+        sfen += " b " if self.sideToMove == SENTE else " w "
+        return sfen + serializeHandCounts(self.hand)
+
+class BitboardMatch(Match):
+    """
+    a Match that keeps its position in a bitboard Position instead of a Banmen
+    it keeps the same getMoves/doTurn/serializeBoardState contract as Match,
+    grid and hand are built from the position when they are read, so editing
+    them in place does nothing, assign them back to change the position
+    """
+    position: Position
+    #the packed form of current_legal_moves
+    current_legal_codes: array
+    #the legal moves of the position that were asked for one origin at a time, by their
+    #origin, a square or DROP + the piece type, until the next turn
+    origin_moves: Dict[int, List[str]]
+
+    def __init__(self, p1: Player, p2: Player):
+        self.position = Position()
+        super().__init__(p1, p2)
+        self.current_legal_codes = array(MOVE_ARRAY_TYPE)
+        self.origin_moves = {}
+
+    @property
+    def grid(self) -> Banmen:
+        return self.position.toBanmen()
+
+    @grid.setter
+    def grid(self, banmen: Banmen):
+        self.position.loadBanmen(banmen)
+        self.origin_moves = {}
+
+    @property
+    def hand(self) -> Hand:
+        return self.position.toHand()
+
+    @hand.setter
+    def hand(self, hand: Hand):
+        self.position.loadHand(hand)
+        self.origin_moves = {}
+
+    #current_turn can be assigned directly, so the position's side to move
+    #follows it instead of the other way around
+    def syncTurn(self):
+        self.position.sideToMove = SENTE if self.current_turn.isSente() else GOTE
+
+    def getMoves(self) -> List[Move]:
+        self.syncTurn()
+        position = self.position
+        codes = position.generateMoves()
+        self.current_legal_codes = codes
+        self.current_legal_moves = [position.toMove(code) for code in codes]
+        return self.current_legal_moves
+
+    #the legal moves of one origin as strings, from the legal codes when getMoves was called
+    #and otherwise generated for that origin alone
+    def getMovesFrom(self, origin: int) -> List[str]:
+        moves = self.origin_moves.get(origin)
+        if moves is not None:
+            return moves
+        if len(self.current_legal_codes):
+            codes = [code for code in self.current_legal_codes if code & SQUARE_MASK == origin]
+        else:
+            self.syncTurn()
+            if origin > DROP:
+                codes = self.position.generateDrops(origin - DROP)
+            else:
+                codes = self.position.generateMovesFrom(origin)
+        moves = [MOVE_STRINGS[code] for code in codes]
+        self.origin_moves[origin] = moves
+        return moves
+
+    #the moves of the piece on a square, named the way the move strings name it, "76"
+    def getMovesForSquare(self, square: str) -> List[str]:
+        sq = SQUARE_INDEX.get(square)
+        if sq is None:
+            return []
+        return self.getMovesFrom(sq)
+
+    #the drops of a piece from the hand of the player to move, by its letter in either case
+    def getDropsForPiece(self, letter: str) -> List[str]:
+        pieceType = LETTER_TYPES.get(letter.lower())
+        if pieceType is None or pieceType == KING:
+            return []
+        return self.getMovesFrom(DROP + pieceType)
+
+    #whether the player to move has a move, without generating all of them
+    def hasMoves(self) -> bool:
+        if len(self.current_legal_codes):
+            return True
+        self.syncTurn()
+        return self.position.hasLegalMoves()
+
+    def doTurn(self, string_move: str):
+        #the string is decoded by table, and then only has to be found among the legal codes,
+        #or checked on its own when getMoves wasn't called for this turn
+        code = MOVE_CODES.get(string_move)
+        if code is None:
+            raise MoveNotFound("The move that was sent is not valid.")
+        if not code in self.current_legal_codes:
+            self.syncTurn()
+            if len(self.current_legal_codes) or not self.position.isLegalMove(code):
+                raise MoveNotFound("The move that was sent is not valid.")
+        self.doTurnCode(code)
+
+    def doTurnMove(self, move: Move):
+        for index, legalMove in enumerate(self.current_legal_moves):
+            if legalMove is move:
+                self.doTurnCode(self.current_legal_codes[index])
+                return
+        raise MoveNotFound("The move that was sent is not valid.")
+
+    def doTurnCode(self, code: int):
+        self.syncTurn()
+        self.position.makeMove(code)
+        self.current_legal_codes = array(MOVE_ARRAY_TYPE)
+        self.current_legal_moves = []
+        self.origin_moves = {}
+        self.changeTurn()
+        self.move_number += 1
+
+    #Match's versions play the move on grid and hand, which are only snapshots here,
+    #so the move is played on the position and its undo record is the position's
+    def makeMove(self, move: Move) -> Tuple[int, int, int]:
+        self.syncTurn()
+        undo = self.position.makeMove(move.encode())
+        self.changeTurn()
+        self.move_number += 1
+        return undo
+
+    def unmakeMove(self, undo: Tuple[int, int, int]):
+        self.position.unmakeMove(undo)
+        self.changeTurn()
+        self.move_number -= 1
+
+    def serializeMoves(self, moves: List[Move]) -> List[str]:
+        if moves is self.current_legal_moves:
+            return [MOVE_STRINGS[code] for code in self.current_legal_codes]
+        return super().serializeMoves(moves)
+
+    def positionKey(self) -> int:
+        self.syncTurn()
+        return self.position.positionKey()
+
+    #unlike Match's version this doesn't return the board, grid would have to build a
+    #Banmen from the position just to hand it back, and nothing reads it
+    def deserializeBoardState(self, sfen: str) -> None:
+        _, isSente, _, moveNumber = splitSfen(sfen)
+        self.position = Position.fromSfen(sfen)
+        self.setSenteToMove(isSente)
+        self.move_number = moveNumber
+        self.current_legal_codes = array(MOVE_ARRAY_TYPE)
+        self.current_legal_moves = []
+        self.origin_moves = {}
+
+    def serializeBoardState(self) -> str:
+        self.syncTurn()
+        return self.position.serialize()
@@ -0,0 +1,321 @@
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .main import Match
+from .bitboard import Position, DROP, TO_SHIFT, SQUARE_MASK, PROMOTE_FLAG, TYPE_MASK, KING, EMPTY
+from .bitboard import PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, MOVE_STRINGS, squareOf
+
+#an opening book, the moves that were played in a set of game records from the positions
+#that they reached, counted by how often each was played
+#
+#the book file is a header and then fixed width records sorted by position key
+#   key (8 bytes) | packed move (4 bytes) | weight (4 bytes), little endian
+#so it can be mmap'd and binary searched in place, and every process that opens the
+#same file shares its pages
+#
+#   python -m game.book build book.bin records.usi games/*.kif games/*.csa [--max-plies 20]
+#   python -m game.book probe book.bin [sfen]
+
+BOOK_MAGIC = b"MSBOOK\x00\x01"
+#magic, record size, record count
+HEADER_FORMAT = "<8sII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = "<QII"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+KEY_FORMAT = "<Q"
+
+DEFAULT_MAX_PLIES = 20
+
+#the position that a new Match starts from, every game record is played from here
+BOOK_STARTPOS = "lnsgkgsnl/1b5r1/ppppppppp/9/9/9/PPPPPPPPP/1R5B1/LNSGKGSNL b - 1"
+
+class InvalidBook(Exception):
+    pass
+
+class OpeningBook:
+    """
+    a book file opened read only with mmap, lookups binary search the records
+    without reading the rest of the file
+    """
+    path: str
+    count: int
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as bookFile:
+            #mmap can't map an empty file, so the size is checked before it is mapped
+            if os.fstat(bookFile.fileno()).st_size < HEADER_SIZE:
+                raise InvalidBook(f'{path} is too short to be a book')
+            self.data = mmap.mmap(bookFile.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, recordSize, count = struct.unpack_from(HEADER_FORMAT, self.data, 0)
+        if magic != BOOK_MAGIC or recordSize != RECORD_SIZE or len(self.data) != HEADER_SIZE + count * RECORD_SIZE:
+            self.data.close()
+            raise InvalidBook(f'{path} is not a book file')
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        self.data.close()
+
+    def keyAt(self, index: int) -> int:
+        return struct.unpack_from(KEY_FORMAT, self.data, HEADER_SIZE + index * RECORD_SIZE)[0]
+
+    #(packed move, weight) of every book move from the position with this key
+    def lookup(self, key: int) -> List[Tuple[int, int]]:
+        #the first record with the key, the records of one position are next to each other
+        low = 0
+        high = self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.keyAt(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        for index in range(low, self.count):
+            recordKey, move, weight = struct.unpack_from(RECORD_FORMAT, self.data, HEADER_SIZE + index * RECORD_SIZE)
+            if recordKey != key:
+                break
+            moves.append((move, weight))
+        return moves
+
+    #a book move for the match picked at random by weight, or None when the position isn't in the book
+    def chooseMove(self, match: Match, rng: random.Random = random) -> Optional[str]:
+        position = Position.fromMatch(match)
+        moves = self.lookup(position.positionKey())
+        if not moves:
+            return None
+        #a key could in theory collide, so only moves that are legal here are played
+        legal = set(position.generateMoves())
+        moves = [(move, weight) for move, weight in moves if move in legal]
+        if not moves:
+            return None
+        move = rng.choices([move for move, _ in moves], weights=[weight for _, weight in moves])[0]
+        return MOVE_STRINGS[move]
+
+#the legal move from frm to to, drops have frm = DROP + the piece type
+def findMove(position: Position, frm: int, to: int, promote: bool) -> Optional[int]:
+    for move in position.generateMoves():
+        if move & SQUARE_MASK == frm and (move >> TO_SHIFT) & SQUARE_MASK == to \
+                and bool(move & PROMOTE_FLAG) == promote:
+            return move
+    return None
+
+#game records number files 1-9 and ranks 1-9 from sente's side, a Banmen has x = file - 1
+#and y = rank - 1
+def recordSquare(file: int, rank: int) -> int:
+    return squareOf(file - 1, rank - 1)
+
+#each parser reads one move of a record in the position that it is played from
+#and returns it packed, the last move is passed in for kif's "同" (same square)
+MoveParser = Callable[[Position, str, Optional[int]], Optional[int]]
+
+USI_PIECES = {"P": PAWN, "L": LANCE, "N": KNIGHT, "S": SILVER, "G": GOLD, "B": BISHOP, "R": ROOK}
+
+#7g7f, 8h2b+, P*5e
+def parseUsiMove(position: Position, text: str, lastMove: Optional[int]) -> Optional[int]:
+    if len(text) == 4 and text[1] == "*":
+        pieceType = USI_PIECES.get(text[0])
+        if pieceType is None or not text[2].isdigit():
+            return None
+        return findMove(position, DROP + pieceType, recordSquare(int(text[2]), ord(text[3]) - ord("a") + 1), False)
+    if len(text) not in (4, 5) or not text[0].isdigit() or not text[2].isdigit():
+        return None
+    frm = recordSquare(int(text[0]), ord(text[1]) - ord("a") + 1)
+    to = recordSquare(int(text[2]), ord(text[3]) - ord("a") + 1)
+    return findMove(position, frm, to, text[4:] == "+")
+
+CSA_PIECES = {"FU": PAWN, "KY": LANCE, "KE": KNIGHT, "GI": SILVER, "KI": GOLD, "KA": BISHOP, "HI": ROOK}
+CSA_PROMOTED = {"TO", "NY", "NK", "NG", "UM", "RY"}
+
+#+7776FU, the piece is the one that stands on the to square after the move
+def parseCsaMove(position: Position, text: str, lastMove: Optional[int]) -> Optional[int]:
+    match = re.fullmatch(r"[+-](\d)(\d)(\d)(\d)([A-Z]{2})", text)
+    if match is None:
+        return None
+    fromFile, fromRank, toFile, toRank = (int(digit) for digit in match.group(1, 2, 3, 4))
+    piece = match.group(5)
+    to = recordSquare(toFile, toRank)
+    if fromFile == 0:
+        pieceType = CSA_PIECES.get(piece)
+        return None if pieceType is None else findMove(position, DROP + pieceType, to, False)
+    frm = recordSquare(fromFile, fromRank)
+    code = position.board[frm]
+    #the piece only promoted on this move if it wasn't already promoted before it
+    promote = code != EMPTY and code & TYPE_MASK <= KING and piece in CSA_PROMOTED
+    return findMove(position, frm, to, promote)
+
+KIF_FILES = "１２３４５６７８９"
+KIF_RANKS = "一二三四五六七八九"
+KIF_PIECES = {"歩": PAWN, "香": LANCE, "桂": KNIGHT, "銀": SILVER, "金": GOLD, "角": BISHOP, "飛": ROOK}
+
+#７六歩(77), ２二角成(88), 同　銀(31), ４五角打
+def parseKifMove(position: Position, text: str, lastMove: Optional[int]) -> Optional[int]:
+    #some programs mark whose move it was
+    text = text.lstrip("▲△☗☖")
+    if text.startswith("同"):
+        if lastMove is None:
+            return None
+        to = (lastMove >> TO_SHIFT) & SQUARE_MASK
+        rest = text[1:].lstrip("　 ")
+    else:
+        if len(text) < 2 or text[0] not in KIF_FILES or text[1] not in KIF_RANKS:
+            return None
+        to = recordSquare(KIF_FILES.index(text[0]) + 1, KIF_RANKS.index(text[1]) + 1)
+        rest = text[2:]
+    origin = re.search(r"\((\d)(\d)\)", rest)
+    #the piece name comes first, 成香 成桂 成銀 are single (already promoted) pieces
+    pieceLength = 2 if rest.startswith("成") else 1
+    piece = rest[:pieceLength]
+    modifiers = rest[pieceLength:rest.index("(")] if origin else rest[pieceLength:]
+    if origin is None:
+        pieceType = KIF_PIECES.get(piece)
+        return None if pieceType is None else findMove(position, DROP + pieceType, to, False)
+    frm = recordSquare(int(origin.group(1)), int(origin.group(2)))
+    return findMove(position, frm, to, modifiers.startswith("成"))
+
+#every record format is split into games, each a list of move texts in the order they were played
+
+def usiGames(text: str) -> Iterator[List[str]]:
+    #one game per line, a bare move list or "position startpos moves ..."
+    for line in text.splitlines():
+        tokens = line.split()
+        if not tokens or "sfen" in tokens:
+            #games from other start positions can't be played from the book's start position
+            continue
+        yield [token for token in tokens if token not in ("position", "startpos", "moves")]
+
+def csaGames(text: str) -> Iterator[List[str]]:
+    #a "/" line separates the games of a file
+    moves: List[str] = []
+    otherStart = False
+    for line in text.splitlines() + ["/"]:
+        line = line.strip()
+        if line == "/":
+            if moves and not otherStart:
+                yield moves
+            moves = []
+            otherStart = False
+        elif re.fullmatch(r"P[1-9].*", line):
+            otherStart = True
+        else:
+            #a line can hold several statements separated by commas, a move and its time
+            moves.extend(statement for statement in line.split(",") if statement[:1] in ("+", "-") and len(statement) == 7)
+
+def kifGames(text: str) -> Iterator[List[str]]:
+    moves: List[str] = []
+    for line in text.splitlines():
+        handicap = re.match(r"手合割：(.*)", line)
+        if handicap and handicap.group(1).strip() != "平手":
+            return
+        move = re.match(r"\s*\d+\s+(同\s*\S+|\S+)", line)
+        if move is None:
+            continue
+        #the game ends at 投了 (resigned), 中断 (stopped) and the like, which aren't moves
+        if move.group(1).lstrip("▲△☗☖")[:1] not in KIF_FILES and "同" not in move.group(1)[:2]:
+            break
+        moves.append(move.group(1))
+    yield moves
+
+RECORD_FORMATS: Dict[str, Tuple[Callable[[str], Iterator[List[str]]], MoveParser]] = {
+    ".usi": (usiGames, parseUsiMove),
+    ".txt": (usiGames, parseUsiMove),
+    ".csa": (csaGames, parseCsaMove),
+    ".kif": (kifGames, parseKifMove),
+}
+
+class BookBuilder:
+    """
+    counts the moves played from each position in the first maxPlies plies of
+    the games that are added, and writes them out as a book file
+    """
+    maxPlies: int
+    counts: Dict[Tuple[int, int], int]
+    games: int
+
+    def __init__(self, maxPlies: int = DEFAULT_MAX_PLIES):
+        self.maxPlies = maxPlies
+        self.counts = {}
+        self.games = 0
+
+    #the number of moves that were read from the game, a game stops at its first bad move
+    def addGame(self, moves: List[str], parse: MoveParser) -> int:
+        position = Position.fromSfen(BOOK_STARTPOS)
+        lastMove = None
+        played = 0
+        for text in moves[:self.maxPlies]:
+            move = parse(position, text, lastMove)
+            if move is None:
+                break
+            entry = (position.positionKey(), move)
+            self.counts[entry] = self.counts.get(entry, 0) + 1
+            position.makeMove(move)
+            lastMove = move
+            played += 1
+        self.games += 1
+        return played
+
+    def addRecords(self, text: str, suffix: str):
+        splitGames, parse = RECORD_FORMATS[suffix]
+        for moves in splitGames(text):
+            self.addGame(moves, parse)
+
+    def addFile(self, path: str):
+        suffix = Path(path).suffix.lower()
+        if suffix not in RECORD_FORMATS:
+            raise ValueError(f'unknown game record format:{path}')
+        #kif files are usually written in shift_jis
+        data = Path(path).read_bytes()
+        try:
+            text = data.decode("utf-8")
+        except UnicodeDecodeError:
+            text = data.decode("shift_jis")
+        self.addRecords(text, suffix)
+
+    #moves that were played fewer than minCount times are left out
+    def write(self, path: str, minCount: int = 1) -> int:
+        records = sorted((key, move, count) for (key, move), count in self.counts.items() if count >= minCount)
+        with open(path, "wb") as bookFile:
+            bookFile.write(struct.pack(HEADER_FORMAT, BOOK_MAGIC, RECORD_SIZE, len(records)))
+            for record in records:
+                bookFile.write(struct.pack(RECORD_FORMAT, *record))
+        return len(records)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m game.book", description="build or look up an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from game records (.usi/.txt one game per line, .csa, .kif)")
+    build.add_argument("book")
+    build.add_argument("records", nargs="+")
+    build.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES, help="how many plies of each game go into the book")
+    build.add_argument("--min-count", type=int, default=1, help="leave out moves that were played fewer times than this")
+    probe = commands.add_parser("probe", help="print the book moves from a position")
+    probe.add_argument("book")
+    probe.add_argument("sfen", nargs="?", default=BOOK_STARTPOS)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        builder = BookBuilder(args.max_plies)
+        for path in args.records:
+            builder.addFile(path)
+        records = builder.write(args.book, args.min_count)
+        print(f'games:{builder.games} positions:{len({key for key, _ in builder.counts})} records:{records}')
+        return 0
+
+    book = OpeningBook(args.book)
+    position = Position.fromSfen(args.sfen)
+    for move, weight in sorted(book.lookup(position.positionKey()), key=lambda entry: -entry[1]):
+        print(f'{MOVE_STRINGS[move]}: {weight}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
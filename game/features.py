@@ -0,0 +1,65 @@
+from typing import Iterable, List, Tuple, Union
+
+import numpy as np
+
+from .main import Match
+from .bitboard import Position, SENTE, GOTE, PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, KING
+from .bitboard import PRO_PAWN, PRO_LANCE, PRO_KNIGHT, PRO_SILVER, HORSE, DRAGON, makeCode
+from .search import PIECE_SQUARE_TABLE, HAND_VALUES
+
+#positions as dense numpy arrays, for looking at thousands of positions at once
+#(self-play, analysis) without a python call per square of each of them
+#numpy is only needed by this module, the rest of the game package doesn't import it,
+#it is listed in web/server/django_image/requirements.txt, which the game package is installed with
+#
+#   planes, hands, sides = batchFeatures(positions)
+#   scores = batchEvaluate(positions)
+#
+#planes[n][plane][x][y] is 1 where position n has the piece of that plane, the planes
+#are sente's PLANE_TYPES and then gote's, the promoted pieces on planes of their own
+#hands[n][side][pieceType - 1] is how many of fuhyou to hisha that side holds
+#sides[n] is the side to move, SENTE or GOTE
+
+PLANE_TYPES = [PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, KING,
+    PRO_PAWN, PRO_LANCE, PRO_KNIGHT, PRO_SILVER, HORSE, DRAGON]
+PLANES = 2 * len(PLANE_TYPES)
+HAND_TYPES = ROOK - PAWN + 1
+#the piece code that each plane is set for
+PLANE_CODES = np.array([makeCode(pieceType, side) for side in (SENTE, GOTE) for pieceType in PLANE_TYPES], dtype=np.uint8)
+
+#the evaluation's tables as arrays, PIECE_SQUARE_TABLE_ARRAY[code][sq] with sente's sign
+#and the row of the empty square all 0, so the board can be looked up as it is
+PIECE_SQUARE_TABLE_ARRAY = np.array(PIECE_SQUARE_TABLE, dtype=np.int32)
+HAND_VALUE_ARRAY = np.array(HAND_VALUES[PAWN:KING], dtype=np.int32)
+SQUARES = np.arange(81)
+
+def asPosition(position: Union[Position, Match]) -> Position:
+    return position if isinstance(position, Position) else Position.fromMatch(position)
+
+#the piece codes of the boards, the hands and the sides to move
+#every code and count fits in a byte, so each position is copied out as bytes and numpy
+#reads all of them in one go, which is far quicker than it converting the lists an int at a time
+def batchArrays(positions: Iterable[Union[Position, Match]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    loaded: List[Position] = [asPosition(position) for position in positions]
+    boards = np.frombuffer(b"".join([bytes(position.board) for position in loaded]), dtype=np.uint8).reshape(-1, 81)
+    hands = np.frombuffer(b"".join([bytes(position.hand[SENTE]) + bytes(position.hand[GOTE]) for position in loaded]),
+        dtype=np.uint8).reshape(-1, 2, KING)
+    sides = np.frombuffer(bytes([position.sideToMove for position in loaded]), dtype=np.uint8)
+    return boards, hands[:, :, PAWN:KING].astype(np.int32), sides
+
+def batchFeatures(positions: Iterable[Union[Position, Match]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    boards, hands, sides = batchArrays(positions)
+    planes = (boards[:, np.newaxis, :] == PLANE_CODES[np.newaxis, :, np.newaxis]).astype(np.uint8)
+    return planes.reshape(-1, PLANES, 9, 9), hands.astype(np.uint8), sides
+
+#the planes, hands and side to move of a single match
+def matchFeatures(match: Match) -> Tuple[np.ndarray, np.ndarray, int]:
+    planes, hands, sides = batchFeatures([match])
+    return planes[0], hands[0], int(sides[0])
+
+#the same scores as search.evaluate, from the point of view of each position's side to move
+def batchEvaluate(positions: Iterable[Union[Position, Match]]) -> np.ndarray:
+    boards, hands, sides = batchArrays(positions)
+    scores = PIECE_SQUARE_TABLE_ARRAY[boards, SQUARES].sum(axis=1, dtype=np.int64)
+    scores += (hands[:, SENTE] - hands[:, GOTE]) @ HAND_VALUE_ARRAY
+    return np.where(sides == SENTE, scores, -scores)
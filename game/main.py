@@ -1,6 +1,8 @@
 from copy import deepcopy
 from curses.ascii import isalpha, islower
 from typing import Dict, List, Tuple, Optional
+
+from .zobrist import PIECE_KEYS, HAND_KEYS, SIDE_KEY, MAX_HAND_COUNT, handKey
 from enum import Enum
 from pprint import pprint
 
@@ -62,29 +64,8 @@ class Koma:
         return self.onHand
 
     def encode(self) -> str:
-            serialized_piece = ""
-            if self.isPromoted(): serialized_piece += "+"
-
-            if type(self) is Fuhyou:
-                serialized_piece += "p"
-            if type(self) is Kyousha:
-                serialized_piece += "l"
-            if type(self) is Keima:
-                serialized_piece += "n"
-            if type(self) is Kinshou:
-                serialized_piece += "g"
-            if type(self) is Gyokushou:
-                serialized_piece += "k"
-            if type(self) is Ginshou:
-                serialized_piece += "s"
-            if type(self) is Kakugyou:
-                serialized_piece += "b"
-            if type(self) is Hisha:
-                serialized_piece += "r"
-            if self.isSente():
-                serialized_piece = serialized_piece.upper()
-
-            return serialized_piece
+        #the letters are worked out once per piece type, see KOMA_ENCODINGS
+        return KOMA_ENCODINGS[type(self)][self.promoted][self.sente]
 
     def getPieceName(self) -> PieceName:
         if type(self) is Fuhyou: return PieceName.Fuhyou
@@ -128,9 +109,12 @@ class Masu:
 
 class Banmen:
     grid: List[List[Masu]]
+    # where each side's king was last seen, keyed by isSente
+    kingCoordinates: Dict[bool, Optional[Tuple[int, int]]]
 
     def __init__(self) -> None:
         self.grid = self.initialBanmen()
+        self.kingCoordinates = {True: (4, 8), False: (4, 0)}
 
     def getMasu(self, x: int, y: int) -> Masu:
         if x < 0 or x > 8 or y < 0 or y > 8:
@@ -143,12 +127,16 @@ class Banmen:
             for j in range(0, 9):
                 self.grid[i][j].setKoma(None)
 
-    def initialBanmen(self):
+    def emptyBanmen(self) -> List[List[Masu]]:
         board: List[List[Masu]] = []
         for i in range(0,9):
             board.append([])
             for j in range(0,9):
                 board[i].append(Masu(i, j, None))
+        return board
+
+    def initialBanmen(self):
+        board = self.emptyBanmen()
 
         #file, rank order
         board[0][0].setKoma(Kyousha(False))
@@ -197,10 +185,20 @@ class Banmen:
         return pieces
 
     def findKingCoordinates(self, isSente: bool) -> Optional[Tuple[int, int]]:
+        # makeMove keeps track of the kings, but the grid can also be edited directly,
+        # so make sure that the king is still there before trusting the tracked location
+        coords = self.kingCoordinates.get(isSente)
+        if not coords is None:
+            komaAtMasu = self.grid[coords[0]][coords[1]].koma
+            if type(komaAtMasu) is Gyokushou and komaAtMasu.isSente() == isSente:
+                return coords
+
+        self.kingCoordinates[isSente] = None
         for i in range(0,9):
             for j in range(0,9):
                 komaAtMasu = self.getMasu(i,j).getKoma()
                 if type(komaAtMasu) is Gyokushou and komaAtMasu.isSente() == isSente: 
+                    self.kingCoordinates[isSente] = (i,j)
                     return (i,j)
         return None
 
@@ -214,45 +212,163 @@ class Banmen:
                     masuList.append(masu)
         return masuList
 
+    #apply a move to this board in place, the returned record holds everything
+    #that unmakeMove needs to put the board back the way it was
+    def makeMove(self, move: "Move") -> "MoveUndo":
+        src_square = move.src_square
+        trgt_square = move.trgt_square
+        undo = MoveUndo(move)
+        if not src_square is None:
+            srcMasu = self.grid[src_square.x][src_square.y]
+            undo.src_koma = srcMasu.koma
+            srcMasu.koma = None
+            undo.promoted = trgt_square.koma.isPromoted() and not undo.src_koma.isPromoted()
+        targetMasu = self.grid[trgt_square.x][trgt_square.y]
+        undo.captured = targetMasu.koma
+        targetMasu.koma = trgt_square.koma
+        if type(targetMasu.koma) is Gyokushou:
+            self.kingCoordinates[targetMasu.koma.isSente()] = (trgt_square.x, trgt_square.y)
+        return undo
+
+    def unmakeMove(self, undo: "MoveUndo"):
+        src_square = undo.move.src_square
+        trgt_square = undo.move.trgt_square
+        self.grid[trgt_square.x][trgt_square.y].koma = undo.captured
+        if not src_square is None:
+            self.grid[src_square.x][src_square.y].koma = undo.src_koma
+            if type(undo.src_koma) is Gyokushou:
+                self.kingCoordinates[undo.src_koma.isSente()] = (src_square.x, src_square.y)
+
+    #look outwards from the square, first at the squares that a piece could step
+    #onto it from, and then along the lines that a ranged piece could slide in on
+    def isSquareAttacked(self, x: int, y: int, bySente: bool) -> bool:
+        grid = self.grid
+        for dX, dY in STEP_ATTACK_OFFSETS:
+            aX = x + dX
+            aY = y + dY
+            if -1 < aX < 9 and -1 < aY < 9:
+                koma = grid[aX][aY].koma
+                if koma is None or koma.sente != bySente:
+                    continue
+                #the attacker steps by (-dX, -dY), the step tables are written for sente
+                steps = KOMA_STEPS[type(koma), koma.promoted]
+                if ((-dX, -dY) if bySente else (dX, dY)) in steps:
+                    return True
+
+        for dX, dY in SLIDE_DIRECTIONS:
+            aX = x + dX
+            aY = y + dY
+            while -1 < aX < 9 and -1 < aY < 9:
+                koma = grid[aX][aY].koma
+                if koma is None:
+                    aX += dX
+                    aY += dY
+                    continue
+                if koma.sente == bySente:
+                    slides = KOMA_SLIDES[type(koma), koma.promoted]
+                    if ((-dX, -dY) if bySente else (dX, dY)) in slides:
+                        return True
+                break
+        return False
+
+    #walk out from the king to find what is attacking it, and what is pinned to it
+    #checks has a set per checking piece of the squares that would stop that check,
+    #the checker's own square and the squares between a ranged checker and the king
+    #pins maps the square of a pinned piece to the squares it can still move to,
+    #which are the squares on the line between the king and the pinning piece
+    def findChecksAndPins(self, kingX: int, kingY: int, isSente: bool) -> Tuple[List[set], Dict[Tuple[int, int], set]]:
+        grid = self.grid
+        checks: List[set] = []
+        pins: Dict[Tuple[int, int], set] = {}
+        bySente = not isSente
+
+        for dX, dY in STEP_ATTACK_OFFSETS:
+            aX = kingX + dX
+            aY = kingY + dY
+            if -1 < aX < 9 and -1 < aY < 9:
+                koma = grid[aX][aY].koma
+                if koma is None or koma.sente != bySente:
+                    continue
+                steps = KOMA_STEPS[type(koma), koma.promoted]
+                if ((-dX, -dY) if bySente else (dX, dY)) in steps:
+                    checks.append({(aX, aY)})
+
+        for dX, dY in SLIDE_DIRECTIONS:
+            line = set()
+            pinned = None
+            aX = kingX + dX
+            aY = kingY + dY
+            while -1 < aX < 9 and -1 < aY < 9:
+                koma = grid[aX][aY].koma
+                line.add((aX, aY))
+                if koma is None:
+                    aX += dX
+                    aY += dY
+                    continue
+                if koma.sente != bySente:
+                    #the first of our own pieces on the line might be pinned, a second one can't be
+                    if not pinned is None:
+                        break
+                    pinned = (aX, aY)
+                    aX += dX
+                    aY += dY
+                    continue
+                slides = KOMA_SLIDES[type(koma), koma.promoted]
+                if ((-dX, -dY) if bySente else (dX, dY)) in slides:
+                    if pinned is None:
+                        checks.append(line)
+                    else:
+                        line.discard(pinned)
+                        pins[pinned] = line
+                break
+        return (checks, pins)
+
+    #a king can't step onto an attacked square, the king is lifted off of the board
+    #while looking so that a ranged piece checking it also covers the squares behind it
+    def kingCanMoveTo(self, kingCoords: Tuple[int, int], x: int, y: int) -> bool:
+        kingMasu = self.grid[kingCoords[0]][kingCoords[1]]
+        king = kingMasu.koma
+        kingMasu.koma = None
+        attacked = self.isSquareAttacked(x, y, not king.isSente())
+        kingMasu.koma = king
+        return not attacked
+
     def kingIsInCheck(self, isSente: bool) -> bool:
         kingCoords = self.findKingCoordinates(isSente)
         if kingCoords is None:
             return False
-        opposingPieces = list(filter(lambda x: x[0].isSente != isSente, self.getPieces()))
-        for opposingPiece in opposingPieces:
-            piece = opposingPiece[0]
-            masu = opposingPiece[1]
-            moves = piece.legalMoves(self, masu)
-            for move in moves:
-                if move.trgt_square.x == kingCoords[0] and move.trgt_square.y == kingCoords[1]:
-                    return True
-        return False
+        return self.isSquareAttacked(kingCoords[0], kingCoords[1], not isSente)
 
 class Hand:
-    handKoma: list[tuple[Koma, int]]
+    """
+    the pieces that each player holds, as counts[side][pieceType]
+    side 0 is sente and 1 is gote, and the piece types are the numbers in KOMA_TYPES
+    """
+    counts: List[List[int]]
 
     def __init__(self) -> None:
-        self.handKoma = self.initialHand()
-
-    def initialHand(self) -> list[tuple[Koma, int]]:
-        handKoma = [
-                [Fuhyou(sente = True, onHand = True), 0],
-                [Kinshou(sente = True, onHand = True), 0],
-                [Keima(sente = True, onHand = True), 0],
-                [Ginshou(sente = True, onHand = True), 0],
-                [Kakugyou(sente = True, onHand = True), 0],
-                [Hisha(sente = True, onHand = True), 0],
-                [Kyousha(sente = True, onHand = True), 0],
-
-                [Fuhyou(sente = False, onHand = True), 0],
-                [Kinshou(sente = False, onHand = True), 0],
-                [Keima(sente = False, onHand = True), 0],
-                [Ginshou(sente = False, onHand = True), 0],
-                [Kakugyou(sente = False, onHand = True), 0],
-                [Hisha(sente = False, onHand = True), 0],
-                [Kyousha(sente = False, onHand = True), 0]
-            ]
-        return handKoma
+        self.counts = [[0] * 8, [0] * 8]
+
+    def getCount(self, komaType: type, isSente: bool) -> int:
+        return self.counts[0 if isSente else 1][KOMA_TYPES[komaType]]
+
+    def addKoma(self, komaType: type, isSente: bool, amount: int = 1):
+        self.counts[0 if isSente else 1][KOMA_TYPES[komaType]] += amount
+
+    def removeKoma(self, komaType: type, isSente: bool, amount: int = 1):
+        self.counts[0 if isSente else 1][KOMA_TYPES[komaType]] -= amount
+
+    def isEmpty(self) -> bool:
+        return not any(self.counts[0]) and not any(self.counts[1])
+
+    def copy(self) -> "Hand":
+        hand = Hand()
+        hand.counts = [self.counts[0][:], self.counts[1][:]]
+        return hand
+
+    #the hand part of serializeBoardState, nothing at all when both hands are empty
+    def serialize(self) -> str:
+        return serializeHandCounts(self.counts)
 
 class Move:
     src_square: Optional[Masu]
@@ -282,6 +398,45 @@ class Move:
 
         return " ".join(parts)
 
+    #the move packed into an int, see MOVE_DROP
+    def encode(self) -> int:
+        trgt = self.trgt_square
+        move = squareIndex(trgt) << MOVE_TO_SHIFT
+        if self.src_square is None:
+            return move | (MOVE_DROP + KOMA_TYPES[type(trgt.koma)]) | komaCode(trgt.koma) << MOVE_CODE_SHIFT
+        srcKoma = self.src_square.koma
+        move |= squareIndex(self.src_square) | komaCode(srcKoma) << MOVE_CODE_SHIFT
+        if trgt.koma.promoted and not srcKoma.promoted:
+            move |= MOVE_PROMOTE_FLAG
+        return move
+
+class MoveUndo:
+    """
+    what a move changed, so that it can be taken back without copying the board
+    src_koma is the piece that stood on the source square before it moved,
+    which is not the same object as the target koma when the piece promoted
+    """
+    move: Move
+    src_koma: Optional[Koma]
+    captured: Optional[Koma]
+    promoted: bool
+    # the hand count that the move changed, by side and piece type, and by how much
+    hand_side: int
+    hand_type: int
+    hand_delta: int
+    # Match.position_key from before the move
+    position_key: int
+
+    def __init__(self, move: Move) -> None:
+        self.move = move
+        self.src_koma = None
+        self.captured = None
+        self.promoted = False
+        self.hand_side = 0
+        self.hand_type = 0
+        self.hand_delta = 0
+        self.position_key = 0
+
 
 class Fuhyou(Koma):
     def __init__(self, sente, onHand = False):
@@ -344,7 +499,7 @@ class Fuhyou(Koma):
                         hasFuhyou = True
                 if not hasFuhyou:
                     for masu in column:
-                        if masu.getKoma() == None and ((isSente and masu.getY() != 8) or (not isSente and masu.getY() != 0)):
+                        if masu.getKoma() == None and ((isSente and masu.getY() != 0) or (not isSente and masu.getY() != 8)):
                             moves.append(Move(None, Masu(masu.getX(),masu.getY(), newPiece)))
 
         return moves
@@ -418,8 +573,9 @@ class Kyousha(Koma):
         return moves
 
     def isLegalLanceDropSpace(self, masu: Masu):
+        #a kyousha placed on the last rank would never be able to move
         y = masu.getY()
-        result = y != 0 and y != 8
+        result = y != 0 if self.isSente() else y != 8
         return result
 
 
@@ -450,13 +606,14 @@ class Keima(Koma):
                         targetMasu = board.getMasu(tX, tY)
                         targetKoma = targetMasu.getKoma()
                         if (targetKoma == None or targetKoma.isSente() != piece.isSente()):
-                            #mandatory knight promotion
-                            if (isSente and tY < 2) or (not isSente and tY > 6):
+                            #promotion is optional in the last 3 ranks
+                            if (isSente and tY < 3) or (not isSente and tY > 5):
                                 promoted_piece = deepcopy(piece)
                                 promoted_piece.Promote()
                                 moves.append(Move(src_square, Masu(tX, tY, promoted_piece)))
-                            else:
-                                moves.append(Move(src_square, Masu(tX, tY, piece)))        
+                            #mandatory knight promotion in the last 2 ranks
+                            if not ((isSente and tY < 2) or (not isSente and tY > 6)):
+                                moves.append(Move(src_square, Masu(tX, tY, piece)))
             else:
                 virtual_kin = Kinshou(piece.isSente())
                 moves.extend(virtual_kin.legalMoves(board, src_square, hand, piece))
@@ -545,8 +702,10 @@ class Kinshou(Koma):
             raise Exception("legalMoves requires either a src square or the hand object to be passed in to it")
         moves: List[Move] = []
 
+        #promoted pieces borrow the gold general's moves, but the piece that lands
+        #on the target square has to stay the promoted piece and not turn into a gold
         if virtualized_piece != None:
-            piece = deepcopy(virtualized_piece)
+            piece = virtualized_piece
         else:
             #piece = src_square.getKoma()
             piece = self
@@ -554,7 +713,6 @@ class Kinshou(Koma):
         if not self.isOnHand():
             if src_square.getKoma() == None:
                 print(f'Strange behavior in legal moves for kinshou, piece at src_square is none', src_square.getKoma())
-            piece = self
             isSente = piece.isSente()
 
             x = src_square.getX()
@@ -768,10 +926,134 @@ class Gyokushou(Koma):
         return moves
 
 
+#the attack patterns of every koma, keyed by (type, isPromoted)
+#written from sente's point of view, gote's are the same deltas flipped
+GOLD_STEPS = frozenset([(1, -1), (0, -1), (-1, -1), (1, 0), (-1, 0), (0, 1)])
+ORTHOGONAL_STEPS = frozenset([(0, 1), (0, -1), (1, 0), (-1, 0)])
+DIAGONAL_STEPS = frozenset([(1, -1), (1, 1), (-1, -1), (-1, 1)])
+NO_STEPS = frozenset()
+
+KOMA_STEPS = {
+    (Fuhyou, False): frozenset([(0, -1)]),
+    (Kyousha, False): NO_STEPS,
+    (Keima, False): frozenset([(1, -2), (-1, -2)]),
+    (Ginshou, False): frozenset([(1, -1), (0, -1), (-1, -1), (1, 1), (-1, 1)]),
+    (Kinshou, False): GOLD_STEPS,
+    (Kakugyou, False): NO_STEPS,
+    (Hisha, False): NO_STEPS,
+    (Gyokushou, False): ORTHOGONAL_STEPS | DIAGONAL_STEPS,
+    (Fuhyou, True): GOLD_STEPS,
+    (Kyousha, True): GOLD_STEPS,
+    (Keima, True): GOLD_STEPS,
+    (Ginshou, True): GOLD_STEPS,
+    (Kakugyou, True): ORTHOGONAL_STEPS,
+    (Hisha, True): DIAGONAL_STEPS,
+}
+
+#the directions that ranged pieces slide in
+KOMA_SLIDES = {komaKind: NO_STEPS for komaKind in KOMA_STEPS}
+KOMA_SLIDES[Kyousha, False] = frozenset([(0, -1)])
+KOMA_SLIDES[Kakugyou, False] = KOMA_SLIDES[Kakugyou, True] = DIAGONAL_STEPS
+KOMA_SLIDES[Hisha, False] = KOMA_SLIDES[Hisha, True] = ORTHOGONAL_STEPS
+
+#where a piece that steps onto a square could be standing, relative to that square
+#the 8 neighbours, plus the knight squares of both sides
+STEP_ATTACK_OFFSETS = list(ORTHOGONAL_STEPS | DIAGONAL_STEPS) + [(1, 2), (-1, 2), (1, -2), (-1, -2)]
+SLIDE_DIRECTIONS = list(ORTHOGONAL_STEPS | DIAGONAL_STEPS)
+
 class MoveNotFound(Exception):
     def __init__(self, message):
         super().__init__(message)
 
+class InvalidSfen(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+#the letters used for each koma in sfen, lowercase
+SFEN_KOMA: Dict[str, type] = {
+    "p": Fuhyou, "l": Kyousha, "n": Keima, "s": Ginshou,
+    "g": Kinshou, "b": Kakugyou, "r": Hisha, "k": Gyokushou,
+}
+#the piece numbers shared with the bitboard core and the zobrist keys
+KOMA_TYPES: Dict[type, int] = {
+    Fuhyou: 1, Kyousha: 2, Keima: 3, Ginshou: 4,
+    Kinshou: 5, Kakugyou: 6, Hisha: 7, Gyokushou: 8,
+}
+
+def komaCode(koma: Koma) -> int:
+    code = KOMA_TYPES[type(koma)]
+    if koma.promoted:
+        code += 8
+    if not koma.sente:
+        code += 16
+    return code
+
+def squareIndex(masu: Masu) -> int:
+    return masu.x * 9 + masu.y
+
+#moves packed into an int, the layout is shared with the bitboard core
+#   bits 0-6   from square, or MOVE_DROP + piece type for a piece placed from the hand
+#   bits 7-13  to square
+#   bit 14     promotion flag
+#   bits 15-19 komaCode of the piece before it moves
+#the piece is part of the move so that the wire string can be looked up from the int alone
+MOVE_DROP = 80
+MOVE_TO_SHIFT = 7
+MOVE_PROMOTE_FLAG = 1 << 14
+MOVE_CODE_SHIFT = 15
+MOVE_SQUARE_MASK = 127
+
+#only these can be written with a "+"
+SFEN_PROMOTABLE = (Fuhyou, Kyousha, Keima, Ginshou, Kakugyou, Hisha)
+
+#KOMA_ENCODINGS[komaType][isPromoted][isSente] is what Koma.encode returns
+KOMA_ENCODINGS: Dict[type, List[List[str]]] = {
+    komaType: [[letter, letter.upper()], ["+" + letter, "+" + letter.upper()]]
+    for letter, komaType in SFEN_KOMA.items()
+}
+
+KOMA_CLASSES: Dict[int, type] = {pieceType: komaType for komaType, pieceType in KOMA_TYPES.items()}
+#the order that the held pieces are serialized and their drops are listed in
+HAND_ORDER: Tuple[int, ...] = tuple(KOMA_TYPES[komaType] for komaType in (Fuhyou, Kinshou, Keima, Ginshou, Kakugyou, Hisha, Kyousha))
+#a held koma of every type for each side, which works out the drops for that type
+HAND_KOMA: List[Dict[int, Koma]] = [
+    {pieceType: KOMA_CLASSES[pieceType](isSente, onHand=True) for pieceType in HAND_ORDER}
+    for isSente in (True, False)
+]
+#HAND_SFEN_FRAGMENTS[side][pieceType][count] is what that count adds to the sfen hand
+HAND_SFEN_FRAGMENTS: List[List[List[str]]] = [[[""] * (MAX_HAND_COUNT + 1) for _ in range(8)] for _ in range(2)]
+for _side, _isSente in enumerate((True, False)):
+    for _pieceType in HAND_ORDER:
+        _letter = KOMA_ENCODINGS[KOMA_CLASSES[_pieceType]][False][_isSente]
+        HAND_SFEN_FRAGMENTS[_side][_pieceType][1] = _letter
+        for _count in range(2, MAX_HAND_COUNT + 1):
+            HAND_SFEN_FRAGMENTS[_side][_pieceType][_count] = str(_count) + _letter
+
+#counts are indexed [side][pieceType] like Hand.counts
+def serializeHandCounts(counts: List[List[int]]) -> str:
+    senteFragments = HAND_SFEN_FRAGMENTS[0]
+    goteFragments = HAND_SFEN_FRAGMENTS[1]
+    sente = counts[0]
+    gote = counts[1]
+    return "".join([senteFragments[pieceType][sente[pieceType]] for pieceType in HAND_ORDER]
+        + [goteFragments[pieceType][gote[pieceType]] for pieceType in HAND_ORDER])
+
+#split an sfen string into its board, side to move, hand and move number
+#serializeBoardState leaves out the move number and writes nothing for an empty hand,
+#while the usual sfen has "-" and the move number, both are accepted
+def splitSfen(sfen: str) -> Tuple[str, bool, str, int]:
+    fields = sfen.split()
+    if len(fields) < 2 or len(fields) > 4:
+        raise InvalidSfen(f'sfen needs a board and a side to move:"{sfen}"')
+    if fields[1] != "b" and fields[1] != "w":
+        raise InvalidSfen(f'side to move must be b or w in sfen:"{sfen}"')
+    hand = fields[2] if len(fields) > 2 else "-"
+    moveNumber = 1
+    if len(fields) > 3:
+        if not fields[3].isdigit():
+            raise InvalidSfen(f'bad move number in sfen:"{sfen}"')
+        moveNumber = int(fields[3])
+    return fields[0], fields[1] == "b", hand, moveNumber
 
 class Match:
     player_one: Player
@@ -780,6 +1062,11 @@ class Match:
     hand: Hand
     current_turn: Player
     current_legal_moves: List[Move]
+    # the same moves keyed by Move.serialize, for looking up the moves sent by the client
+    current_legal_move_map: Dict[str, Move]
+    move_number: int
+    # zobrist key of the board and the hand, the side to move is added in by positionKey
+    position_key: int
 
     def __init__(self, p1: Player, p2: Player):
         self.player_one = p1
@@ -794,51 +1081,99 @@ class Match:
             self.current_turn = self.player_two
 
         self.current_legal_moves = []
+        self.current_legal_move_map = {}
+        self.move_number = 1
+        self.position_key = self.computePositionKey()
+
+    #build a match straight from a position, instead of replaying the moves that led to it
+    @classmethod
+    def fromSfen(cls, sfen: str, p1: Optional[Player] = None, p2: Optional[Player] = None) -> "Match":
+        match = cls(p1 or ComputerPlayer(True), p2 or ComputerPlayer(False))
+        match.deserializeBoardState(sfen)
+        return match
 
     def doTurn(self, string_move: str):
-        string_moves = [move.serialize() for move in self.current_legal_moves]
-        if string_move not in string_moves:
+        current_move = self.current_legal_move_map.get(string_move)
+        if current_move is None:
             raise MoveNotFound("The move that was sent is not valid.")
 
-        move_index = string_moves.index(string_move)
-
-        current_move = self.current_legal_moves[move_index]
-        print(f'current_move:{current_move}')
-        src_square = current_move.src_square
-        trgt_square = current_move.trgt_square
-
-        moveTargetKoma = trgt_square.koma
-
-        #need to decrement the count for the held piece that is about to be placed
-        if src_square is None:
-            #it's the held piece we're looking for if the piece type and the player match
-            #the move being made
-            matchingHeldKoma = filter(lambda x: type(x[0]) == type(moveTargetKoma) and x[0].isSente() == moveTargetKoma.isSente(), self.hand.handKoma)
-            #print(matchingHeldKoma)
-            thisKomaType = next(matchingHeldKoma)
-            if thisKomaType is None:
-                print(f'failed to find held koma for pieceName:{moveTargetKoma.getPieceName()} and isSente:{moveTargetKoma.isSente()}')
-            else:
-                #decrease the # of held koma
-                thisKomaType[1] -= 1
+        self.doTurnMove(current_move)
 
-        if not src_square is None:
-            self.grid.getMasu(src_square.getX(), src_square.getY()).setKoma(None)
+    #for callers that already hold one of the moves from getMoves, like the computer player,
+    #so that the move doesn't have to go through its string form
+    def doTurnMove(self, move: Move):
+        if not move in self.current_legal_moves:
+            raise MoveNotFound("The move that was sent is not valid.")
 
-        targetMasu = self.grid.getMasu(trgt_square.getX(), trgt_square.getY())
-        pieceOnBoardAtDestination = targetMasu.getKoma()
-        if not pieceOnBoardAtDestination is None:
-            #need to increment the held piece count for the player that made the move
-            #if a piece was taken
-            countForTakenKoma = next(filter(lambda x: type(x[0]) == type(pieceOnBoardAtDestination) and x[0].isSente() == self.current_turn.senteSide, self.hand.handKoma))
-            countForTakenKoma[1] += 1
+        self.makeMove(move)
+        #the moves were for the position before this move
+        self.current_legal_moves = []
+        self.current_legal_move_map = {}
 
+    #play a move in place, the returned record lets unmakeMove take it back
+    def makeMove(self, move: Move) -> MoveUndo:
+        isSente = self.current_turn.isSente()
+        undo = self.grid.makeMove(move)
+
+        #a placed piece comes out of the mover's hand, and a taken piece goes into it
+        undo.hand_side = 0 if isSente else 1
+        if move.src_square is None:
+            undo.hand_type = KOMA_TYPES[type(move.trgt_square.koma)]
+            undo.hand_delta = -1
+        elif not undo.captured is None:
+            undo.hand_type = KOMA_TYPES[type(undo.captured)]
+            undo.hand_delta = 1
+
+        #only the keys of what the move changed are xored in and out
+        undo.position_key = key = self.position_key
+        trgtSquare = squareIndex(move.trgt_square)
+        key ^= PIECE_KEYS[komaCode(move.trgt_square.koma)][trgtSquare]
+        if not move.src_square is None:
+            key ^= PIECE_KEYS[komaCode(undo.src_koma)][squareIndex(move.src_square)]
+            if not undo.captured is None:
+                key ^= PIECE_KEYS[komaCode(undo.captured)][trgtSquare]
+        if undo.hand_delta != 0:
+            counts = self.hand.counts[undo.hand_side]
+            count = counts[undo.hand_type]
+            counts[undo.hand_type] = count + undo.hand_delta
+            handKeys = HAND_KEYS[undo.hand_side][undo.hand_type]
+            key ^= handKeys[count] ^ handKeys[count + undo.hand_delta]
+        self.position_key = key
 
-        #the masu stored in trgt_square may have been promoted, so it is not
-        #sufficient to just set the koma at trgt to the src koma
-        targetMasu.setKoma(moveTargetKoma)
+        self.changeTurn()
+        self.move_number += 1
+        return undo
 
+    def unmakeMove(self, undo: MoveUndo):
         self.changeTurn()
+        self.move_number -= 1
+        self.position_key = undo.position_key
+        if undo.hand_delta != 0:
+            self.hand.counts[undo.hand_side][undo.hand_type] -= undo.hand_delta
+        self.grid.unmakeMove(undo)
+
+    #a 64 bit key for the position, two positions with the same pieces on the same squares,
+    #the same hands and the same side to move get the same key
+    def positionKey(self) -> int:
+        if self.current_turn.isSente():
+            return self.position_key
+        return self.position_key ^ SIDE_KEY
+
+    #builds position_key from scratch, makeMove keeps it up to date after that,
+    #so this only needs to be called again after the grid or hand are edited directly
+    def computePositionKey(self) -> int:
+        key = 0
+        for column in self.grid.grid:
+            for masu in column:
+                if not masu.koma is None:
+                    key ^= PIECE_KEYS[komaCode(masu.koma)][squareIndex(masu)]
+        return key ^ handKey(self.hand.counts)
+
+    def setSenteToMove(self, isSente: bool):
+        if self.player_one.isSente() == isSente:
+            self.current_turn = self.player_one
+        else:
+            self.current_turn = self.player_two
 
     def changeTurn(self):
         if self.current_turn == self.player_one:
@@ -853,100 +1188,87 @@ class Match:
             return self.player_two
 
     def getMoves(self) -> List[Move]:
+        moves = self.generateLegalMoves()
+        self.current_legal_moves = moves
+        #serialize reads the source koma off of the board, so the strings have to be made
+        #now, before any of the moves are played
+        self.current_legal_move_map = {move.serialize(): move for move in moves}
 
-        def filtersOote(all_moves: List[Move], isSente: bool):
-            legal_moves: List[Move] = []
-
-            # testing if a move is illegal in regards to the king being put in check
-            # as a result of the move, OR failing to do something about your king already being in check
-            # involves copying the board, doing the move, and then checking if your king is under attack
-            # or not
-            for move in all_moves:
-                valid_move = True
-                # copy the board
-                virtual_board = deepcopy(self.grid)
-
-                moveTargetSquare = move.trgt_square
-                if not move.src_square is None:
-                    virtual_board.grid[move.src_square.x][move.src_square.y].setKoma(None)
-                virtualTargetSquare = virtual_board.grid[moveTargetSquare.x][moveTargetSquare.y]
-                virtualTargetSquare.setKoma(moveTargetSquare.getKoma())
-
-                if virtual_board.kingIsInCheck(isSente):
-                    valid_move = False
-
-                # if move.src_square is not None and type(move.src_square.getKoma()) is Gyokushou:
-                #     king = move.src_square.getKoma()
-                #     kingX = move.src_square.getX()
-                #     kingY = move.src_square.getY()
-                #     #take the king off of the board so that kyousha, kakugyou and
-                #     #hisha can also attack the squares behind it
-                #     virtual_board.grid[kingX][kingY] = Masu(kingX, kingY, None)
-                #     attacked_squares:List[Tuple[int, int]] = []
-                #     attacking_pieces = filter(lambda x: x[0].isSente() != isSente, virtual_board.getPieces())
-                #     for koma, masu in attacking_pieces:
-                #         if koma.isOnHand():
-                #             raise Exception('filtersOote, attaking piece cannot be a held piece')
-                #         attacking_moves = koma.legalMoves(virtual_board, masu)
-                #         for attacking_move in attacking_moves:
-                #             attacked_square = attacking_move.trgt_square
-                #             attacked_squares.append([attacked_square.getX(), attacked_square.getY()])
-                #     moveTargetSquare = move.trgt_square;
-                #     targetSquareIsBeingAttacked = [moveTargetSquare.getX(), moveTargetSquare.getY()] in attacked_squares
-                #     if targetSquareIsBeingAttacked:
-                #         # the king cannot be moved into a square that is being attacked by another piece
-                #         valid_move = False
-                #     #put the king back where it was
-                #     virtual_board.grid[kingX][kingY] = Masu(kingX, kingY, king)
-                # else:
-                #     if move.src_square is not None:
-                #         virtual_board.getMasu(move.src_square.getX(), move.src_square.getY()).setKoma(None)
-                #     virtual_board.getMasu(move.trgt_square.getX(), move.trgt_square.getY()).setKoma(move.trgt_square.getKoma())
-
-                #     king_coordinates: Tuple[int, int] = virtual_board.findKingCoordinates(isSente)
-                #     if king_coordinates is not None:
-                #         #get a (koma, masu) tuple for every piece on the board, as a list
-                #         attacking_pieces = list(filter(lambda x: x[0].isSente() != isSente, virtual_board.getPieces()))
-
-                #         for attacking_piece in attacking_pieces:
-                #             masu = attacking_piece[1]
-                #             koma = attacking_piece[0]
-                #             attacking_moves = koma.legalMoves(virtual_board, masu)
-                #             for attacking_move in attacking_moves:
-                #                 attackingMoveSquare = attacking_move.trgt_square
-                #                 if attackingMoveSquare.getX() == king_coordinates[0] and attackingMoveSquare.getY() == king_coordinates[1]:
-                #                     #move is invalid because it would put the king in check
-                #                     #or, the king is already in check and this move won't get the king out of check
-                #                     valid_move = False
-
-                if valid_move:
-                    legal_moves.append(move)
-
-            return legal_moves
+        return moves
 
+    def generateLegalMoves(self) -> List[Move]:
+        # the checks and pins on the king are worked out once for the position,
+        # and then every candidate move is kept or dropped by where it lands,
+        # so no move has to be played out to see if it leaves the king in check
         isSente = self.current_turn.isSente()
+        kingCoords = self.grid.findKingCoordinates(isSente)
+        if kingCoords is None:
+            checks, pins = [], {}
+        else:
+            checks, pins = self.grid.findChecksAndPins(kingCoords[0], kingCoords[1], isSente)
+
+        #when the king is in check, the other pieces can only take the checking piece
+        #or get in between it and the king, and in double check only the king can move
+        answersCheck: Optional[set] = None
+        if len(checks) == 1:
+            answersCheck = checks[0]
+        elif len(checks) > 1:
+            answersCheck = set()
+
         moves: List[Move] = []
         #get moves from pieces on the board
         for i in range(0, 9):
             for j in range(0, 9):
-                koma = self.grid.getMasu(i,j).getKoma()
-                if not koma is None and koma.isSente() == isSente:
-                    #print(f'board piece:{koma.getPieceName()}')
-                    moves.extend(koma.legalMoves(self.grid, self.grid.getMasu(i,j)))
+                masu = self.grid.grid[i][j]
+                koma = masu.koma
+                if koma is None or koma.isSente() != isSente:
+                    continue
+                if (i, j) == kingCoords:
+                    moves.extend(filter(lambda mv: self.grid.kingCanMoveTo(kingCoords, mv.trgt_square.x, mv.trgt_square.y), koma.legalMoves(self.grid, masu)))
+                    continue
+                allowed = pins.get((i, j))
+                if not answersCheck is None:
+                    allowed = answersCheck if allowed is None else allowed & answersCheck
+                if allowed is None:
+                    moves.extend(koma.legalMoves(self.grid, masu))
+                elif len(allowed) > 0:
+                    moves.extend(filter(lambda mv: (mv.trgt_square.x, mv.trgt_square.y) in allowed, koma.legalMoves(self.grid, masu)))
 
         #get moves from the held pieces per player
         #note that do to the piece placement rules of the pawns(fuhyou),
         #it is possible to have pieces in your hand but no moves that come
         #from held pieces
-        heldPiecesMoves = self.getHeldPiecesMoves(isSente)
-        moves.extend(heldPiecesMoves)
+        #a placed piece can never uncover the king, but it can only answer a check
+        #by being placed in between the checking piece and the king
+        if answersCheck is None:
+            heldMoves = self.getHeldPiecesMoves(isSente)
+        elif len(answersCheck) > 0:
+            heldMoves = list(filter(lambda mv: (mv.trgt_square.x, mv.trgt_square.y) in answersCheck, self.getHeldPiecesMoves(isSente)))
+        else:
+            heldMoves = []
 
-        moves = filtersOote(moves, isSente)
-        self.current_legal_moves = moves
+        #uchifuzume, a fuhyou can't be placed to give a check that mates
+        enemyKingCoords = self.grid.findKingCoordinates(not isSente)
+        if not enemyKingCoords is None:
+            checkingSquare = (enemyKingCoords[0], enemyKingCoords[1] + (1 if isSente else -1))
+            heldMoves = list(filter(lambda mv: not (type(mv.trgt_square.koma) is Fuhyou
+                and (mv.trgt_square.x, mv.trgt_square.y) == checkingSquare
+                and self.isPawnDropMate(mv)), heldMoves))
+        moves.extend(heldMoves)
 
         return moves
 
+    #a fuhyou check can't be blocked, so the answers looked at here never include
+    #a placed fuhyou and this never has to look any deeper
+    def isPawnDropMate(self, move: Move) -> bool:
+        undo = self.makeMove(move)
+        mate = len(self.generateLegalMoves()) == 0
+        self.unmakeMove(undo)
+        return mate
+
     def serializeMoves(self, moves: List[Move]) -> List[str]:
+        if moves is self.current_legal_moves:
+            return list(self.current_legal_move_map)
         return list(map(lambda x: x.serialize(), moves))
 
 
@@ -956,15 +1278,71 @@ class Match:
 
     def getHeldPiecesMoves(self, isSente: bool) -> List[Move]:
         moves = []
-        for komaCount in self.hand.handKoma:
-            number = komaCount[1]
-            koma = komaCount[0]
-            if number > 0 and koma.isSente() == isSente:
-                moves.extend(koma.legalMoves(self.grid, None, self.hand))
+        counts = self.hand.counts[0 if isSente else 1]
+        handKoma = HAND_KOMA[0 if isSente else 1]
+        for pieceType in HAND_ORDER:
+            if counts[pieceType] > 0:
+                moves.extend(handKoma[pieceType].legalMoves(self.grid, None, self.hand))
         return moves
 
+    #replace the position of this match with the one in the sfen string
+    #the board is read the same way that serializeBoardState writes it
     def deserializeBoardState(self, sfen: str) -> Banmen:
-        pass
+        board, isSente, handSfen, moveNumber = splitSfen(sfen)
+
+        ranks = board.split("/")
+        if len(ranks) != 9:
+            raise InvalidSfen(f'sfen board needs 9 ranks:"{sfen}"')
+        banmen = Banmen()
+        banmen.grid = banmen.emptyBanmen()
+        banmen.kingCoordinates = {True: None, False: None}
+        for y, rank in enumerate(ranks):
+            x = 0
+            promoted = False
+            for letter in rank:
+                if letter.isdigit():
+                    x += int(letter)
+                    continue
+                if letter == "+":
+                    promoted = True
+                    continue
+                komaType = SFEN_KOMA.get(letter.lower())
+                if komaType is None or x > 8 or (promoted and not komaType in SFEN_PROMOTABLE):
+                    raise InvalidSfen(f'bad rank "{rank}" in sfen:"{sfen}"')
+                koma = komaType(letter.isupper())
+                if promoted:
+                    koma.Promote()
+                    promoted = False
+                banmen.grid[x][y].koma = koma
+                if komaType is Gyokushou:
+                    banmen.kingCoordinates[koma.isSente()] = (x, y)
+                x += 1
+            if x != 9 or promoted:
+                raise InvalidSfen(f'rank "{rank}" does not have 9 squares in sfen:"{sfen}"')
+
+        hand = Hand()
+        if handSfen != "-":
+            count = 0
+            for letter in handSfen:
+                if letter.isdigit():
+                    count = count * 10 + int(letter)
+                    continue
+                komaType = SFEN_KOMA.get(letter.lower())
+                if komaType is None or komaType is Gyokushou:
+                    raise InvalidSfen(f'bad hand "{handSfen}" in sfen:"{sfen}"')
+                hand.addKoma(komaType, letter.isupper(), max(count, 1))
+                if hand.getCount(komaType, letter.isupper()) > MAX_HAND_COUNT:
+                    raise InvalidSfen(f'too many held pieces in sfen:"{sfen}"')
+                count = 0
+
+        self.grid = banmen
+        self.hand = hand
+        self.setSenteToMove(isSente)
+        self.move_number = moveNumber
+        self.current_legal_moves = []
+        self.current_legal_move_map = {}
+        self.position_key = self.computePositionKey()
+        return banmen
 
     def serializeBoardState(self) -> str:
         # The sfen notation is defined here: http://hgm.nubati.net/usi.html
@@ -991,17 +1369,7 @@ class Match:
             sfen+= "/"
         sfen = sfen[:-1]
         sfen += " b " if self.current_turn.isSente() else " w "
-        for komaCount in self.hand.handKoma:
-            number = komaCount[1]
-            koma = komaCount[0]
-            if number > 0:
-                if number == 1:
-                    serializedKoma = koma.encode()
-                else:
-                    serializedKoma = str(number) + koma.encode()
-
-                #print(f'serialize hand koma, koma is sente:{koma.isSente()} add to Sfen:${serializedKoma}')
-                sfen += serializedKoma
+        sfen += self.hand.serialize()
         return sfen
 
 def getDefaultHeldPieceMoves(board: Banmen, piece: Koma) -> list[Move]:
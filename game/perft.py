@@ -0,0 +1,120 @@
+import argparse
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+from .main import Match
+from .bitboard import Position
+
+#counts the leaf nodes of the move tree below a position, to check the move
+#generators against known numbers and to see how fast they are
+#
+#   python -m game.perft <sfen|startpos> <depth> [--divide] [--core bitboard|banmen]
+#   python -m game.perft --suite [--max-depth 3] [--core bitboard|banmen]
+
+STARTPOS = "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
+
+#well known positions and their node counts, starting at depth 1
+#the positions are written in the usual sfen file order, the board here reads
+#each rank starting from the other side, which mirrors them left to right
+#but mirroring doesn't change any of the counts
+PERFT_POSITIONS: List[Tuple[str, str, List[int]]] = [
+    ("startpos", STARTPOS, [30, 900, 25470, 719731, 19861490]),
+    ("matsuri", "l6nl/5+P1gk/2np1S3/p1p4Pp/3P2Sp1/1PPb2P1P/P5GS1/R8/LN4bKL w RGgsn5p 1", [207, 28684, 4809015]),
+    ("max-moves", "R8/2K1S1SSk/4B4/9/9/9/9/9/1L1L1L3 b RBGSNLP3g3n17p 1", [593]),
+]
+
+CORES = ("bitboard", "banmen")
+
+def loadPosition(sfen: str, core: str = "bitboard"):
+    if sfen == "startpos":
+        sfen = STARTPOS
+    if core == "bitboard":
+        return Position.fromSfen(sfen)
+    return Match.fromSfen(sfen)
+
+#both cores can play a move in place and take it back, they only differ in how they list the moves
+def moveGenerator(position) -> Callable[[], list]:
+    if isinstance(position, Position):
+        return position.generateMoves
+    return position.generateLegalMoves
+
+def moveName(position, move) -> str:
+    if isinstance(position, Position):
+        return position.moveToString(move)
+    return move.serialize()
+
+def perft(position, depth: int) -> int:
+    if depth < 1:
+        return 1
+    moves = moveGenerator(position)()
+    #the leaves don't need to be played, counting the moves is enough
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        undo = position.makeMove(move)
+        nodes += perft(position, depth - 1)
+        position.unmakeMove(undo)
+    return nodes
+
+#the node count under every move at the root, to narrow down where two generators disagree
+def divide(position, depth: int) -> List[Tuple[str, int]]:
+    counts = []
+    for move in moveGenerator(position)():
+        #the name is read off of the board, so it has to be made before the move is played
+        name = moveName(position, move)
+        undo = position.makeMove(move)
+        counts.append((name, perft(position, depth - 1)))
+        position.unmakeMove(undo)
+    return counts
+
+def timedPerft(position, depth: int) -> Tuple[int, float]:
+    start = time.perf_counter()
+    nodes = perft(position, depth)
+    return nodes, time.perf_counter() - start
+
+def formatResult(nodes: int, seconds: float) -> str:
+    nps = int(nodes / seconds) if seconds > 0 else 0
+    return f'nodes:{nodes} time:{seconds:.3f}s nps:{nps}'
+
+def runSuite(maxDepth: int, core: str) -> bool:
+    passed = True
+    for name, sfen, counts in PERFT_POSITIONS:
+        for depth, expected in enumerate(counts[:maxDepth], start=1):
+            nodes, seconds = timedPerft(loadPosition(sfen, core), depth)
+            ok = nodes == expected
+            passed = passed and ok
+            print(f'{name} depth:{depth} {"ok" if ok else "FAIL expected:" + str(expected)} {formatResult(nodes, seconds)}')
+    return passed
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m game.perft", description="count the leaf nodes below a position")
+    parser.add_argument("sfen", nargs="?", help='the position to search, or "startpos"')
+    parser.add_argument("depth", nargs="?", type=int)
+    parser.add_argument("--divide", action="store_true", help="print the node count under every root move")
+    parser.add_argument("--core", choices=CORES, default="bitboard", help="the move generator to count with")
+    parser.add_argument("--suite", action="store_true", help="check the known positions against their counts")
+    parser.add_argument("--max-depth", type=int, default=3, help="the deepest count to check with --suite")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if runSuite(args.max_depth, args.core) else 1
+    if args.sfen is None or args.depth is None:
+        parser.error("a position and a depth are required unless --suite is given")
+
+    position = loadPosition(args.sfen, args.core)
+    start = time.perf_counter()
+    if args.divide and args.depth > 0:
+        counts = divide(position, args.depth)
+        for name, nodes in counts:
+            print(f'{name}: {nodes}')
+        nodes = sum(nodes for _, nodes in counts)
+        print(f'moves:{len(counts)}')
+    else:
+        nodes = perft(position, args.depth)
+    print(formatResult(nodes, time.perf_counter() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,427 @@
+import time
+from typing import List, Optional, Union
+
+from .main import Match
+from .bitboard import Position, SENTE, GOTE, EMPTY, PAWN, LANCE, KNIGHT, SILVER, GOLD, BISHOP, ROOK, KING
+from .bitboard import PRO_PAWN, PRO_LANCE, PRO_KNIGHT, PRO_SILVER, HORSE, DRAGON
+from .bitboard import TO_SHIFT, CODE_SHIFT, SQUARE_MASK, TYPE_MASK, MOVE_STRINGS, makeCode
+from .transposition import TranspositionTable, BOUND_EXACT, BOUND_LOWER, BOUND_UPPER
+from .tsume import solve
+
+#a computer player for the Match, an iterative deepening alpha-beta (negamax) search
+#on the bitboard core, with a quiescence search over captures at the leaves
+#
+#   result = search(match, max_ms=1000, max_nodes=200000)
+#   match.doTurn(result.moveString())
+#
+#passing the same TranspositionTable to the search of every move of a match
+#lets each search start from what the searches before it found
+#
+#with mate_ms the mate solver (tsume.py) first looks for a mate by checks, which
+#is found far deeper than the alpha-beta search gets, and the search gets the rest of the time
+#
+#scores are in centipawn-ish units from the point of view of the side to move
+
+MATE_SCORE = 30000
+#a score past this is a mate, the number of plies to the mate is taken off of MATE_SCORE
+#so that the quickest mate scores the highest
+MATE_THRESHOLD = MATE_SCORE - 1000
+INFINITY = MATE_SCORE + 1
+MAX_PLY = 128
+
+DEFAULT_MAX_MS = 1000
+DEFAULT_MAX_NODES = 1_000_000
+#the clock is only looked at once every this many nodes + 1
+CLOCK_CHECK_MASK = 255
+#each iteration takes a few times longer than the one before it, so one that starts
+#after this much of the time budget is gone would be cut off before it finishes
+NEXT_ITERATION_SHARE = 0.4
+
+#moves are searched in this order, each band is above anything that the bands below it can score
+#   the best move from the transposition table
+#   captures, the most valuable victim first and then the least valuable attacker
+#   the two killer moves of the ply, quiet moves that caused a cutoff in a sibling position
+#   the other quiet moves by how often the same piece moving to the same square caused a cutoff
+TT_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORE = 1 << 26
+#the history scores are halved when one gets past this, so they stay under the killers
+HISTORY_LIMIT = 1 << 20
+
+#values of the pieces on the board, indexed by piece type
+PIECE_VALUES = [0] * 16
+PIECE_VALUES[PAWN] = 90
+PIECE_VALUES[LANCE] = 315
+PIECE_VALUES[KNIGHT] = 405
+PIECE_VALUES[SILVER] = 495
+PIECE_VALUES[GOLD] = 540
+PIECE_VALUES[BISHOP] = 855
+PIECE_VALUES[ROOK] = 990
+PIECE_VALUES[PRO_PAWN] = 540
+PIECE_VALUES[PRO_LANCE] = 540
+PIECE_VALUES[PRO_KNIGHT] = 540
+PIECE_VALUES[PRO_SILVER] = 540
+PIECE_VALUES[HORSE] = 945
+PIECE_VALUES[DRAGON] = 1395
+
+#a held piece can be dropped anywhere, so it is worth a little more than the same piece on the board
+HAND_VALUES = [0] * 8
+for _pieceType in range(PAWN, KING):
+    HAND_VALUES[_pieceType] = PIECE_VALUES[_pieceType] * 11 // 10
+
+#piece square bonuses from sente's point of view, indexed by piece type and then [x][y]
+#y = 0 is gote's back rank, so sente advances as y goes down
+def advancementBonus(perRank: int, limit: int = 9):
+    return lambda x, y: perRank * min(8 - y, limit)
+
+def centralBonus(perFile: int):
+    return lambda x, y: perFile * (4 - abs(x - 4))
+
+def kingBonus(x: int, y: int) -> int:
+    #the king is safest behind its own pieces and away from the middle file
+    ranks = {8: 30, 7: 20, 6: 0}
+    return ranks.get(y, -40) + 5 * abs(x - 4)
+
+SQUARE_BONUSES = {
+    PAWN: advancementBonus(4, 6),
+    LANCE: lambda x, y: 0,
+    KNIGHT: advancementBonus(6, 4),
+    SILVER: lambda x, y: advancementBonus(6, 4)(x, y) + centralBonus(3)(x, y),
+    GOLD: lambda x, y: centralBonus(4)(x, y) - (20 if y < 5 else 0),
+    BISHOP: centralBonus(2),
+    ROOK: advancementBonus(5, 6),
+    KING: kingBonus,
+    PRO_PAWN: advancementBonus(5, 6),
+    PRO_LANCE: advancementBonus(5, 6),
+    PRO_KNIGHT: advancementBonus(5, 6),
+    PRO_SILVER: advancementBonus(5, 6),
+    HORSE: centralBonus(4),
+    DRAGON: advancementBonus(5, 6),
+}
+
+def buildPieceSquareTable() -> List[List[int]]:
+    #table[code][sq] is the value of that piece on that square with sente's sign,
+    #gote's pieces use the same bonuses on the square turned around the middle of the board
+    table = [[0] * 81 for _ in range(32)]
+    for pieceType, bonus in SQUARE_BONUSES.items():
+        for sq in range(81):
+            x, y = divmod(sq, 9)
+            table[makeCode(pieceType, SENTE)][sq] = PIECE_VALUES[pieceType] + bonus(x, y)
+            table[makeCode(pieceType, GOTE)][sq] = -(PIECE_VALUES[pieceType] + bonus(8 - x, 8 - y))
+    return table
+
+PIECE_SQUARE_TABLE = buildPieceSquareTable()
+
+def evaluate(position: Position) -> int:
+    board = position.board
+    table = PIECE_SQUARE_TABLE
+    score = 0
+    for sq in range(81):
+        code = board[sq]
+        if code != EMPTY:
+            score += table[code][sq]
+    senteHand = position.hand[SENTE]
+    goteHand = position.hand[GOTE]
+    for pieceType in range(PAWN, KING):
+        score += HAND_VALUES[pieceType] * (senteHand[pieceType] - goteHand[pieceType])
+    return score if position.sideToMove == SENTE else -score
+
+class SearchStopped(Exception):
+    pass
+
+class SearchResult:
+    """
+    what a search found, move is the packed best move or None when there are no legal moves,
+    depth is the deepest iteration that finished and pv is the line that it expects to be played
+    """
+    move: Optional[int]
+    score: int
+    depth: int
+    nodes: int
+    pv: List[int]
+    elapsedMs: float
+    #transposition table lookups made by this search, and how many found their position
+    ttProbes: int
+    ttHits: int
+
+    def __init__(self):
+        self.move = None
+        self.score = 0
+        self.depth = 0
+        self.nodes = 0
+        self.pv = []
+        self.elapsedMs = 0.0
+        self.ttProbes = 0
+        self.ttHits = 0
+
+    def moveString(self) -> Optional[str]:
+        return None if self.move is None else MOVE_STRINGS[self.move]
+
+    def pvStrings(self) -> List[str]:
+        return [MOVE_STRINGS[move] for move in self.pv]
+
+    def ttHitRate(self) -> float:
+        return self.ttHits / self.ttProbes if self.ttProbes else 0.0
+
+    def isMate(self) -> bool:
+        return abs(self.score) > MATE_THRESHOLD
+
+    def __str__(self) -> str:
+        nps = int(self.nodes * 1000 / self.elapsedMs) if self.elapsedMs > 0 else 0
+        return f'depth:{self.depth} score:{self.score} nodes:{self.nodes} time:{self.elapsedMs:.0f}ms nps:{nps} tthits:{self.ttHitRate():.1%} pv:{" ".join(self.pvStrings())}'
+
+#mate scores count plies from the root, but the table is shared between positions at
+#different plies, so they are stored counting from the position itself
+def scoreToTable(score: int, ply: int) -> int:
+    if score > MATE_THRESHOLD:
+        return score + ply
+    if score < -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+def scoreFromTable(score: int, ply: int) -> int:
+    if score > MATE_THRESHOLD:
+        return score - ply
+    if score < -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+class Searcher:
+    position: Position
+    tt: TranspositionTable
+    nodes: int
+    maxNodes: int
+    deadline: float
+
+    def __init__(self, position: Position, tt: TranspositionTable, maxMs: int, maxNodes: int):
+        self.position = position
+        self.tt = tt
+        self.nodes = 0
+        self.maxNodes = maxNodes
+        self.deadline = time.perf_counter() + maxMs / 1000
+        #a byte that another process sets to stop this search, looked at along with the clock (see smp.py)
+        self.stopFlag = None
+        #triangular pv table, pvTable[ply] holds the best line found from ply onwards
+        self.pvTable = [[] for _ in range(MAX_PLY + 1)]
+        self.rootMoveFirst = None
+        #move ordering can be turned off to see what it saves, see game.bench
+        self.ordering = True
+        #killers[ply] is the last two quiet moves that caused a cutoff at that ply
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        #history[piece code][to square]
+        self.history = [[0] * 81 for _ in range(32)]
+
+    def countNode(self):
+        self.nodes += 1
+        if self.nodes >= self.maxNodes:
+            raise SearchStopped()
+        if not self.nodes & CLOCK_CHECK_MASK and (time.perf_counter() >= self.deadline
+                or self.stopFlag is not None and self.stopFlag[0]):
+            raise SearchStopped()
+
+    #bestMove is the move that the transposition table (or at the root, the last iteration) found
+    def orderMoves(self, moves, bestMove: Optional[int] = None, ply: int = 0) -> List[int]:
+        if not self.ordering:
+            return moves
+        board = self.position.board
+        history = self.history
+        firstKiller, secondKiller = self.killers[ply]
+        scored = []
+        for move in moves:
+            to = (move >> TO_SHIFT) & SQUARE_MASK
+            victim = board[to]
+            if move == bestMove:
+                score = TT_MOVE_SCORE
+            elif victim:
+                score = CAPTURE_SCORE + PIECE_VALUES[victim & TYPE_MASK] * 64 - PIECE_VALUES[(move >> CODE_SHIFT) & TYPE_MASK]
+            elif move == firstKiller:
+                score = KILLER_SCORE + 1
+            elif move == secondKiller:
+                score = KILLER_SCORE
+            else:
+                score = history[move >> CODE_SHIFT][to]
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    #a quiet move that caused a cutoff is likely to cause one in the positions next to this one too
+    def rememberCutoff(self, move: int, depth: int, ply: int):
+        to = (move >> TO_SHIFT) & SQUARE_MASK
+        if self.position.board[to]:
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        scores = self.history[move >> CODE_SHIFT]
+        scores[to] += depth * depth
+        if scores[to] > HISTORY_LIMIT:
+            for row in self.history:
+                for sq in range(81):
+                    row[sq] >>= 1
+
+    def negamax(self, depth: int, alpha: int, beta: int, ply: int) -> int:
+        if depth <= 0 or ply >= MAX_PLY:
+            self.pvTable[ply] = []
+            return self.quiescence(alpha, beta, ply)
+        self.countNode()
+        position = self.position
+        self.pvTable[ply] = []
+        key = position.positionKey()
+        ttMove = None
+        entry = self.tt.probe(key)
+        if entry is not None:
+            ttMove, ttScore, ttDepth, ttBound = entry
+            #the root always searches, so that there is a best move and a pv to return
+            if ttDepth >= depth and ply > 0:
+                ttScore = scoreFromTable(ttScore, ply)
+                if ttBound == BOUND_EXACT \
+                        or (ttBound == BOUND_LOWER and ttScore >= beta) \
+                        or (ttBound == BOUND_UPPER and ttScore <= alpha):
+                    if ttMove:
+                        self.pvTable[ply] = [ttMove]
+                    return ttScore
+        if ply == 0:
+            ttMove = self.rootMoveFirst or ttMove
+
+        moves = position.generateMoves()
+        #there is no stalemate in shogi, having no moves loses
+        if not moves:
+            return -MATE_SCORE + ply
+
+        alphaStart = alpha
+        best = -INFINITY
+        bestMove = 0
+        for move in self.orderMoves(moves, ttMove, ply):
+            undo = position.makeMove(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            position.unmakeMove(undo)
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    bestMove = move
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        if self.ordering:
+                            self.rememberCutoff(move, depth, ply)
+                        break
+
+        if best >= beta:
+            bound = BOUND_LOWER
+        elif best > alphaStart:
+            bound = BOUND_EXACT
+        else:
+            bound = BOUND_UPPER
+        self.tt.store(key, depth, bound, bestMove, scoreToTable(best, ply))
+        return best
+
+    #only captures are searched past the horizon so that a capture is never
+    #scored without looking at the recapture, when in check every evasion is searched
+    def quiescence(self, alpha: int, beta: int, ply: int) -> int:
+        self.countNode()
+        position = self.position
+        inCheck = position.inCheck()
+        if ply >= MAX_PLY:
+            return evaluate(position)
+        if inCheck:
+            moves = position.generateMoves()
+            if not moves:
+                return -MATE_SCORE + ply
+            best = -INFINITY
+        else:
+            best = evaluate(position)
+            if best >= beta:
+                return best
+            if best > alpha:
+                alpha = best
+            moves = position.generateMoves(capturesOnly=True)
+
+        for move in self.orderMoves(moves, None, ply):
+            undo = position.makeMove(move)
+            score = -self.quiescence(-beta, -alpha, ply + 1)
+            position.unmakeMove(undo)
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+def search(match: Union[Match, Position], max_ms: int = DEFAULT_MAX_MS, max_nodes: int = DEFAULT_MAX_NODES, max_depth: int = MAX_PLY,
+        tt: Optional[TranspositionTable] = None, ordering: bool = True, mate_ms: int = 0,
+        start_depth: int = 1, stop_flag=None) -> SearchResult:
+    start = time.perf_counter()
+    #the search plays its moves on its own copy of the position, the match is never touched
+    position = match.copy() if isinstance(match, Position) else Position.fromMatch(match)
+    mateNodes = 0
+    if mate_ms > 0:
+        mate = solve(position, min(mate_ms, max_ms), max_nodes)
+        if mate.isMate() and mate.line:
+            result = SearchResult()
+            result.move = mate.line[0]
+            result.pv = mate.line
+            result.depth = len(mate.line)
+            result.score = MATE_SCORE - len(mate.line)
+            result.nodes = mate.nodes
+            result.elapsedMs = (time.perf_counter() - start) * 1000
+            return result
+        mateNodes = mate.nodes
+        max_ms = max(1, max_ms - int(mate.elapsedMs))
+        max_nodes = max(1, max_nodes - mate.nodes)
+    searchStart = time.perf_counter()
+    if tt is None:
+        tt = TranspositionTable()
+    tt.newSearch()
+    probes = tt.probes
+    hits = tt.hits
+    searcher = Searcher(position, tt, max_ms, max_nodes)
+    searcher.ordering = ordering
+    searcher.stopFlag = stop_flag
+    result = SearchResult()
+    rootMoves = position.generateMoves()
+    if rootMoves:
+        #something to play even if the first iteration runs out of budget
+        result.move = rootMoves[0]
+        result.pv = [rootMoves[0]]
+
+    for depth in range(min(start_depth, max_depth), min(max_depth, MAX_PLY) + 1):
+        if not rootMoves:
+            result.score = -MATE_SCORE
+            break
+        try:
+            score = searcher.negamax(depth, -INFINITY, INFINITY, 0)
+        except SearchStopped:
+            #an unfinished iteration leaves the position half played, it isn't used again
+            break
+        result.depth = depth
+        result.score = score
+        result.pv = searcher.pvTable[0]
+        result.move = result.pv[0]
+        searcher.rootMoveFirst = result.move
+        #a mate that has been found won't get any shorter with a deeper search
+        #and with a single legal move there is nothing to choose between
+        if result.isMate() or len(rootMoves) == 1:
+            break
+        if time.perf_counter() - searchStart > max_ms * NEXT_ITERATION_SHARE / 1000:
+            break
+
+    result.nodes = searcher.nodes + mateNodes
+    result.ttProbes = tt.probes - probes
+    result.ttHits = tt.hits - hits
+    result.elapsedMs = (time.perf_counter() - start) * 1000
+    return result
+
+#a process that only runs searches for another one (see the server's aiPool) is handed
+#positions as sfen, and keeps a single table for every search that it runs
+#the sfen is loaded straight into a Position, the search never needs the Match around it
+workerTable: Optional[TranspositionTable] = None
+
+def initSearchWorker(ttMegabytes: float):
+    global workerTable
+    workerTable = TranspositionTable(ttMegabytes)
+
+def searchSfen(sfen: str, max_ms: int = DEFAULT_MAX_MS, max_nodes: int = DEFAULT_MAX_NODES, max_depth: int = MAX_PLY,
+        mate_ms: int = 0) -> SearchResult:
+    return search(Position.fromSfen(sfen), max_ms, max_nodes, max_depth, tt=workerTable, mate_ms=mate_ms)
@@ -0,0 +1,258 @@
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .main import Match, ComputerPlayer
+from .bitboard import Position, SENTE, GOTE, MOVE_STRINGS
+from .perft import formatResult
+from .search import search, MAX_PLY
+from .transposition import TranspositionTable
+
+#plays engines against each other without the websocket consumers, on a pool of
+#processes, to load the engine and to get games to tune it with
+#
+#   python -m game.selfplay --games 100 --workers 4 --engine-a search:ms=200 --engine-b search:depth=2
+#       [--max-plies 320] [--random-plies 4] [--seed 1] [--sfen <start>] [--output games.jsonl]
+#
+#an engine is "random" or "search" with any of ms, nodes, depth, mate_ms and tt (megabytes)
+#   search:ms=100,nodes=50000,depth=4,mate_ms=20,tt=4
+#
+#the games come in pairs that start with the same random opening moves, engine a plays
+#sente in the first one and gote in the second, a game ends with
+#   mate, the side to move has no legal moves and loses
+#   repetition, the same position for the fourth time is a draw, unless one side gave check
+#       with every move since the first time, then that side loses (perpetual check)
+#   maxPlies, a draw once the game is that long
+#every game is written to the output as a line of json as soon as it is over
+
+DEFAULT_GAMES = 10
+DEFAULT_MAX_PLIES = 320
+DEFAULT_RANDOM_PLIES = 4
+#how many random openings are tried before the game is played from the start position as it is
+OPENING_ATTEMPTS = 100
+#the fourth time that the same position comes up ends the game (sennichite)
+REPETITION_COUNT = 4
+ENGINE_KINDS = ("random", "search")
+#the options of a search engine, and what they are passed to search as
+SEARCH_OPTIONS = {"ms": "max_ms", "nodes": "max_nodes", "depth": "max_depth", "mate_ms": "mate_ms", "tt": "tt"}
+DEFAULT_SEARCH = {"max_ms": 100, "max_nodes": 1_000_000, "max_depth": MAX_PLY, "mate_ms": 0, "tt": 4}
+
+class Engine:
+    """
+    one side of the games, a spec like search:ms=100,depth=3 or random
+    it only holds its settings so that it can be sent to the worker processes
+    """
+    spec: str
+    kind: str
+    options: Dict[str, float]
+
+    def __init__(self, spec: str):
+        kind, _, optionText = spec.partition(":")
+        if kind not in ENGINE_KINDS:
+            raise argparse.ArgumentTypeError(f'engine must be one of {", ".join(ENGINE_KINDS)}:"{spec}"')
+        options = dict(DEFAULT_SEARCH)
+        for option in filter(None, optionText.split(",")):
+            name, _, value = option.partition("=")
+            if kind != "search" or name not in SEARCH_OPTIONS:
+                raise argparse.ArgumentTypeError(f'unknown engine option "{name}" in:"{spec}"')
+            try:
+                options[SEARCH_OPTIONS[name]] = float(value) if name == "tt" else int(value)
+            except ValueError:
+                raise argparse.ArgumentTypeError(f'engine option {name} needs a number:"{spec}"')
+        self.spec = spec
+        self.kind = kind
+        self.options = options
+
+    #a new table for every game, so that each game is played the same way whatever the worker played before
+    def newGame(self) -> Optional[TranspositionTable]:
+        return TranspositionTable(self.options["tt"]) if self.kind == "search" else None
+
+    #(move, nodes that it took)
+    def chooseMove(self, position: Position, moves, tt: Optional[TranspositionTable], rng: random.Random) -> Tuple[int, int]:
+        if self.kind == "random":
+            return rng.choice(moves), 0
+        options = self.options
+        result = search(position, options["max_ms"], options["max_nodes"], options["max_depth"], tt=tt,
+            mate_ms=options["mate_ms"])
+        return result.move, result.nodes
+
+    def __str__(self) -> str:
+        return self.spec
+
+def startPosition(sfen: Optional[str]) -> Position:
+    if sfen:
+        return Position.fromSfen(sfen)
+    return Position.fromMatch(Match(ComputerPlayer(True), ComputerPlayer(False)))
+
+#the same random moves for both games of a pair, a game that is over before the engines get to play is tried again
+#no opening at all when there is none to be found, a start that is already over is then scored as it is
+def randomOpening(start: Position, plies: int, seed: int) -> List[int]:
+    rng = random.Random(seed)
+    if plies == 0 or not start.generateMoves():
+        return []
+    for _ in range(OPENING_ATTEMPTS):
+        position = start.copy()
+        opening = []
+        for _ in range(plies):
+            moves = position.generateMoves()
+            if not moves:
+                break
+            move = rng.choice(moves)
+            position.makeMove(move)
+            opening.append(move)
+        if len(opening) == plies and position.generateMoves():
+            return opening
+    return []
+
+#one game, the record that is written out for it
+def playGame(game: int, engineA: Engine, engineB: Engine, sfen: Optional[str], maxPlies: int,
+        randomPlies: int, seed: int) -> dict:
+    start = time.perf_counter()
+    position = startPosition(sfen)
+    startSfen = position.serialize()
+    #a pair of games shares its opening, engine a is sente in the first one
+    aIsSente = game % 2 == 0
+    engines = {SENTE: engineA, GOTE: engineB} if aIsSente else {SENTE: engineB, GOTE: engineA}
+    tables = {side: engine.newGame() for side, engine in engines.items()}
+    rng = random.Random(seed * 1_000_003 + game)
+
+    moves = []
+    #for every ply, whether the move put the other side in check
+    checks = []
+    seen: Dict[int, List[int]] = {}
+    nodes = 0
+    winner = None
+    reason = "maxPlies"
+    opening = randomOpening(position, randomPlies, seed * 1_000_003 + game // 2)
+    while len(moves) < maxPlies:
+        key = position.positionKey()
+        seen.setdefault(key, []).append(len(moves))
+        if len(seen[key]) >= REPETITION_COUNT:
+            reason = "repetition"
+            winner = perpetualCheckWinner(checks, seen[key][0], position.sideToMove)
+            if winner is not None:
+                reason = "perpetualCheck"
+            break
+        legal = position.generateMoves()
+        if not legal:
+            reason = "mate"
+            winner = position.sideToMove ^ 1
+            break
+        side = position.sideToMove
+        if len(moves) < len(opening):
+            move = opening[len(moves)]
+        else:
+            move, moveNodes = engines[side].chooseMove(position, legal, tables[side], rng)
+            nodes += moveNodes
+        position.makeMove(move)
+        moves.append(move)
+        checks.append(position.inCheck())
+
+    if winner is None:
+        result = "draw"
+    else:
+        result = "sente" if winner == SENTE else "gote"
+    #engine a's score, 1 for a win, 0.5 for a draw and 0 for a loss
+    score = 0.5 if winner is None else float((winner == SENTE) == aIsSente)
+    return {
+        "game": game,
+        "sente": str(engines[SENTE]),
+        "gote": str(engines[GOTE]),
+        "result": result,
+        "reason": reason,
+        "scoreA": score,
+        "plies": len(moves),
+        "nodes": nodes,
+        "seconds": round(time.perf_counter() - start, 3),
+        "start": startSfen,
+        "moves": [MOVE_STRINGS[move] for move in moves],
+    }
+
+#when one side gave check with every one of its moves since the position first came up,
+#that side loses, the winner is returned, or None when it is an ordinary draw
+#checks[ply] is for the move made at that ply, sideToMove is the side to move after the last one
+def perpetualCheckWinner(checks: List[bool], since: int, sideToMove: int) -> Optional[int]:
+    last = len(checks) - 1
+    for checker in (sideToMove ^ 1, sideToMove):
+        #the checker's moves are every other ply counting back from its last one
+        end = last if checker == sideToMove ^ 1 else last - 1
+        plies = range(end, since - 1, -2)
+        if plies and all(checks[ply] for ply in plies):
+            return checker ^ 1
+    return None
+
+#the elo difference that a score (0 to 1) is worth, and the margin of it for 95% confidence
+def eloEstimate(wins: int, draws: int, losses: int) -> Tuple[float, float]:
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, 0.0
+    score = (wins + draws / 2) / games
+    #a score of 0 or 1 has no finite elo, scores are held half a game inside of them
+    def clamp(value: float) -> float:
+        return min(max(value, 0.5 / games), 1 - 0.5 / games)
+    def toElo(value: float) -> float:
+        return 400 * math.log10(value / (1 - value))
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return toElo(clamp(score)), (toElo(clamp(score + margin)) - toElo(clamp(score - margin))) / 2
+
+def playGameArgs(args: tuple) -> dict:
+    return playGame(*args)
+
+#the records in the order that the games finish
+def runGames(engineA: Engine, engineB: Engine, games: int, workers: int, sfen: Optional[str] = None,
+        maxPlies: int = DEFAULT_MAX_PLIES, randomPlies: int = DEFAULT_RANDOM_PLIES, seed: int = 1) -> Iterator[dict]:
+    jobs = [(game, engineA, engineB, sfen, maxPlies, randomPlies, seed) for game in range(games)]
+    if workers <= 1:
+        yield from map(playGameArgs, jobs)
+        return
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        yield from pool.imap_unordered(playGameArgs, jobs)
+
+def summary(records: List[dict], engineA: Engine, engineB: Engine, seconds: float) -> str:
+    wins = sum(1 for record in records if record["scoreA"] == 1)
+    losses = sum(1 for record in records if record["scoreA"] == 0)
+    draws = len(records) - wins - losses
+    elo, margin = eloEstimate(wins, draws, losses)
+    nodes = sum(record["nodes"] for record in records)
+    gamesPerSecond = len(records) / seconds if seconds > 0 else 0
+    return (f'{engineA} vs {engineB} games:{len(records)} +{wins} ={draws} -{losses} elo:{elo:+.0f} +/-{margin:.0f} '
+        f'games/s:{gamesPerSecond:.2f} {formatResult(nodes, seconds)}')
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m game.selfplay", description="play engines against each other")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="how many games to play, in pairs with the sides swapped")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="how many games are played at once")
+    parser.add_argument("--engine-a", type=Engine, default=Engine("search"), help="the engine that the elo is for")
+    parser.add_argument("--engine-b", type=Engine, default=Engine("random"), help="the engine that it plays against")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES, help="a game this long is a draw")
+    parser.add_argument("--random-plies", type=int, default=DEFAULT_RANDOM_PLIES, help="random moves that each pair of games opens with")
+    parser.add_argument("--seed", type=int, default=1, help="the seed of the random openings")
+    parser.add_argument("--sfen", help="the position that every game starts from instead of the usual one")
+    parser.add_argument("--output", help="a file to write a line of json to for every game")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, "w") if args.output else None
+    records = []
+    start = time.perf_counter()
+    try:
+        for record in runGames(args.engine_a, args.engine_b, args.games, args.workers, args.sfen,
+                args.max_plies, args.random_plies, args.seed):
+            records.append(record)
+            if output:
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+            print(f'game:{record["game"]} {record["sente"]} vs {record["gote"]} {record["result"]} {record["reason"]} plies:{record["plies"]}')
+    finally:
+        if output:
+            output.close()
+    print(summary(records, args.engine_a, args.engine_b, time.perf_counter() - start))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional
+
+from .bitboard import Position
+from .search import search, SearchResult, DEFAULT_MAX_MS, DEFAULT_MAX_NODES, MAX_PLY
+from .transposition import SharedTranspositionTable, DEFAULT_TT_MB
+
+#lazy smp, a search that uses more than one core
+#python only runs one search per process at a time, so a few helper processes search the
+#same position at once, each at its own pace, and share what they find through a
+#transposition table in shared memory, the helpers that are ahead fill it with deeper
+#results that the others pick up, so together they get deeper than one of them would
+#
+#   smp = LazySmp(helpers=4)
+#   result = smp.search(match.serializeBoardState(), max_ms=3000)
+#   match.doTurn(result.moveString())
+#   smp.close()
+#
+#the first helper to finish stops the others, and the deepest search that finished wins
+
+DEFAULT_HELPERS = os.cpu_count() or 1
+#helper i starts its iterative deepening at depth 1 + i % DEPTH_STAGGER, so that they
+#are not all searching the same depth at the same time
+DEPTH_STAGGER = 3
+#how long the helpers get to notice that they were told to stop, on top of the time budget
+STOP_GRACE_MS = 500
+
+#set up in each helper process by initHelper
+helperTable: Optional[SharedTranspositionTable] = None
+helperStop: Optional[SharedMemory] = None
+
+def initHelper(tableName: str, megabytes: float, stopName: str):
+    global helperTable, helperStop
+    helperTable = SharedTranspositionTable(megabytes, tableName)
+    helperStop = SharedMemory(name=stopName)
+
+def helperSearch(sfen: str, max_ms: int, max_nodes: int, max_depth: int, start_depth: int, mate_ms: int) -> SearchResult:
+    return search(Position.fromSfen(sfen), max_ms, max_nodes, max_depth, tt=helperTable, mate_ms=mate_ms,
+        start_depth=start_depth, stop_flag=helperStop.buf)
+
+class LazySmp:
+    """
+    a pool of helper processes and the table that they share
+    it searches one position at a time, a search that comes in while
+    another one is running waits for it
+    """
+    table: SharedTranspositionTable
+    #a single byte, the helpers stop searching when it is set
+    stop: SharedMemory
+    executor: ProcessPoolExecutor
+    helpers: int
+
+    def __init__(self, helpers: int = DEFAULT_HELPERS, megabytes: float = DEFAULT_TT_MB):
+        self.helpers = max(1, helpers)
+        self.table = SharedTranspositionTable(megabytes)
+        self.stop = SharedMemory(create=True, size=1)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.helpers,
+            #the helpers start from a fresh interpreter, it isn't safe to fork a process with threads
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initHelper,
+            initargs=(self.table.name, megabytes, self.stop.name),
+        )
+        self.lock = threading.Lock()
+
+    def search(self, sfen: str, max_ms: int = DEFAULT_MAX_MS, max_nodes: int = DEFAULT_MAX_NODES,
+            max_depth: int = MAX_PLY, mate_ms: int = 0) -> SearchResult:
+        with self.lock:
+            start = time.perf_counter()
+            self.stop.buf[0] = 0
+            self.table.advanceAge()
+            #only the first helper looks for a mate, the others get straight to searching
+            futures = [
+                self.executor.submit(helperSearch, sfen, max_ms, max_nodes, max_depth,
+                    1 + helper % DEPTH_STAGGER, mate_ms if helper == 0 else 0)
+                for helper in range(self.helpers)
+            ]
+            wait(futures, timeout=(max_ms + STOP_GRACE_MS) / 1000, return_when=FIRST_COMPLETED)
+            self.stop.buf[0] = 1
+            results: List[SearchResult] = [future.result() for future in futures]
+
+        #the deepest search, the first helper's when they went as deep
+        best = results[0]
+        for result in results[1:]:
+            if result.move is not None and (result.depth > best.depth or best.move is None):
+                best = result
+        combined = SearchResult()
+        combined.move = best.move
+        combined.score = best.score
+        combined.depth = best.depth
+        combined.pv = best.pv
+        combined.nodes = sum(result.nodes for result in results)
+        combined.ttProbes = sum(result.ttProbes for result in results)
+        combined.ttHits = sum(result.ttHits for result in results)
+        combined.elapsedMs = (time.perf_counter() - start) * 1000
+        return combined
+
+    def close(self):
+        self.executor.shutdown()
+        self.table.close()
+        self.stop.close()
+        self.stop.unlink()
@@ -0,0 +1,183 @@
+import random
+import unittest
+
+from . import *
+from .bitboard import Position, SENTE, GOTE, PAWN, DROP, SQUARE_MASK, MOVE_STRINGS, makeCode, squareOf, moveToString, moveFromString
+from .perft import PERFT_POSITIONS
+
+#the bitboard core has to agree with the Banmen/Masu core on every position
+#so most of these tests play the same moves on both and compare them
+
+def playRandomPlies(plies: int, seed: int):
+    rng = random.Random(seed)
+    match = Match(ComputerPlayer(True), ComputerPlayer(False))
+    bitboardMatch = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+    for _ in range(plies):
+        yield match, bitboardMatch
+        moves = match.serializeMoves(match.getMoves())
+        bitboardMatch.getMoves()
+        if len(moves) == 0:
+            return
+        move = rng.choice(moves)
+        match.doTurn(move)
+        bitboardMatch.doTurn(move)
+
+class TestBitboardMatch(unittest.TestCase):
+    def testInitialPosition(self):
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        bitboardMatch = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        self.assertEqual(match.serializeBoardState(), bitboardMatch.serializeBoardState())
+        moves = sorted(match.serializeMoves(match.getMoves()))
+        bitboardMoves = sorted(bitboardMatch.serializeMoves(bitboardMatch.getMoves()))
+        self.assertEqual(len(bitboardMoves), 30)
+        self.assertEqual(moves, bitboardMoves)
+
+    def testSameMovesAsBanmen(self):
+        for match, bitboardMatch in playRandomPlies(30, 7):
+            self.assertEqual(match.serializeBoardState(), bitboardMatch.serializeBoardState())
+            moves = sorted(match.serializeMoves(match.getMoves()))
+            bitboardMoves = sorted(bitboardMatch.serializeMoves(bitboardMatch.getMoves()))
+            self.assertEqual(moves, bitboardMoves, bitboardMatch.serializeBoardState())
+
+    def testGridRoundTrip(self):
+        bitboardMatch = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        banmen = Banmen()
+        banmen.clearPieces()
+        banmen.grid[4][0].setKoma(Gyokushou(False))
+        banmen.grid[4][8].setKoma(Gyokushou(True))
+        promotedRook = Hisha(True)
+        promotedRook.Promote()
+        banmen.grid[1][0].setKoma(promotedRook)
+        bitboardMatch.grid = banmen
+
+        pieces = bitboardMatch.grid.getPieces()
+        self.assertIs(len(pieces), 3)
+        rook = bitboardMatch.grid.getMasu(1, 0).getKoma()
+        self.assertIs(type(rook), Hisha)
+        self.assertTrue(rook.isPromoted())
+        self.assertTrue(rook.isSente())
+
+    def testPromotedPieceStaysPromoted(self):
+        bitboardMatch = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        banmen = Banmen()
+        banmen.clearPieces()
+        banmen.grid[4][0].setKoma(Gyokushou(False))
+        banmen.grid[4][8].setKoma(Gyokushou(True))
+        tokin = Fuhyou(True)
+        tokin.Promote()
+        banmen.grid[0][4].setKoma(tokin)
+        bitboardMatch.grid = banmen
+
+        bitboardMatch.getMoves()
+        bitboardMatch.doTurn("04+P 03+P")
+        koma = bitboardMatch.grid.getMasu(0, 3).getKoma()
+        self.assertIs(type(koma), Fuhyou)
+        self.assertTrue(koma.isPromoted())
+
+    def testMoveCodesKeepWireStrings(self):
+        for match, bitboardMatch in playRandomPlies(40, 13):
+            moves = match.getMoves()
+            codes = bitboardMatch.position.generateMoves()
+            self.assertEqual(sorted(move.encode() for move in moves), sorted(codes))
+            for move in moves:
+                code = move.encode()
+                self.assertEqual(moveToString(code), move.serialize())
+                self.assertEqual(moveFromString(move.serialize()), code)
+                self.assertEqual(bitboardMatch.position.toMove(code).serialize(), move.serialize())
+
+    def testLegalCodesAreAnArray(self):
+        bitboardMatch = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        bitboardMatch.getMoves()
+        self.assertEqual(bitboardMatch.current_legal_codes.typecode, "I")
+        self.assertEqual(len(bitboardMatch.current_legal_codes), 30)
+        with self.assertRaises(MoveNotFound):
+            bitboardMatch.doTurn("88L 86L")
+        bitboardMatch.doTurn("88L 87L")
+        self.assertIs(type(bitboardMatch.grid.getMasu(8, 7).getKoma()), Kyousha)
+
+    def testDoTurnWithoutGetMoves(self):
+        bitboardMatch = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        with self.assertRaises(MoveNotFound):
+            bitboardMatch.doTurn("88L 86L")
+        bitboardMatch.doTurn("88L 87L")
+        #the moves are sente's, and it is gote's turn now
+        with self.assertRaises(MoveNotFound):
+            bitboardMatch.doTurn("66P 65P")
+        bitboardMatch.doTurn("22p 23p")
+        self.assertTrue(bitboardMatch.hasMoves())
+
+    def testMovesForOneOrigin(self):
+        for match, bitboardMatch in playRandomPlies(40, 5):
+            bitboardMatch.getMoves()
+            queried = BitboardMatch.fromSfen(bitboardMatch.serializeBoardState(), ComputerPlayer(True), ComputerPlayer(False))
+            codes = bitboardMatch.current_legal_codes
+            for origin in list(range(81)) + [DROP + pieceType for pieceType in range(PAWN, 8)]:
+                expected = [MOVE_STRINGS[code] for code in codes if code & SQUARE_MASK == origin]
+                #generated for the origin alone, and filtered from the legal codes
+                self.assertEqual(sorted(queried.getMovesFrom(origin)), sorted(expected))
+                self.assertEqual(sorted(bitboardMatch.getMovesFrom(origin)), sorted(expected))
+            self.assertEqual(queried.getMovesForSquare("66"), queried.getMovesFrom(squareOf(6, 6)))
+            self.assertEqual(queried.getDropsForPiece("p"), queried.getMovesFrom(DROP + PAWN))
+            self.assertEqual(queried.getMovesForSquare("9"), [])
+            self.assertEqual(queried.getDropsForPiece("k"), [])
+            self.assertEqual(queried.hasMoves(), len(codes) > 0)
+
+class TestPosition(unittest.TestCase):
+    def testIsAttacked(self):
+        banmen = Banmen()
+        banmen.clearPieces()
+        banmen.grid[8][4].setKoma(Gyokushou(True))
+        banmen.grid[0][4].setKoma(Gyokushou(False))
+        banmen.grid[7][3].setKoma(Kakugyou(False))
+        position = Position.fromBanmen(banmen, Hand(), True)
+        self.assertTrue(position.inCheck(SENTE))
+        self.assertFalse(position.inCheck(GOTE))
+        self.assertTrue(position.isAttacked(squareOf(5, 1), GOTE))
+        #a piece in between blocks the bishop
+        position.putPiece(makeCode(PAWN, SENTE), squareOf(6, 2))
+        self.assertTrue(position.isAttacked(squareOf(6, 2), GOTE))
+        self.assertFalse(position.isAttacked(squareOf(5, 1), GOTE))
+
+    def testLanceAttacksAlongItsFile(self):
+        banmen = Banmen()
+        banmen.clearPieces()
+        banmen.grid[4][8].setKoma(Kyousha(True))
+        position = Position.fromBanmen(banmen, Hand(), True)
+        self.assertTrue(position.isAttacked(squareOf(4, 0), SENTE))
+        self.assertFalse(position.isAttacked(squareOf(3, 0), SENTE))
+        self.assertFalse(position.isAttacked(squareOf(4, 0), GOTE))
+
+    def testMakeUnmakeRestoresPosition(self):
+        for match, bitboardMatch in playRandomPlies(20, 3):
+            position = Position.fromMatch(match)
+            before = position.serialize()
+            for move in position.generateMoves():
+                undo = position.makeMove(move)
+                position.unmakeMove(undo)
+                self.assertEqual(position.serialize(), before)
+
+    def testIsLegalMoveAgreesWithGenerateMoves(self):
+        positions = [Position.fromMatch(match) for match, _ in playRandomPlies(30, 7)]
+        for _, sfen, _ in PERFT_POSITIONS:
+            positions.append(Position.fromSfen(sfen))
+        #the replies to matsuri, which include getting out of check
+        sfen = PERFT_POSITIONS[1][1]
+        for move in Position.fromSfen(sfen).generateMoves():
+            child = Position.fromSfen(sfen)
+            child.makeMove(move)
+            positions.append(child)
+        for position in positions:
+            legal = set(position.generateMoves())
+            for move in MOVE_STRINGS:
+                self.assertEqual(position.isLegalMove(move), move in legal, MOVE_STRINGS[move])
+            self.assertEqual(position.hasLegalMoves(), len(legal) > 0)
+
+    def testPawnDropMateIsNotLegal(self):
+        position = Position.fromSfen("kl7/1s7/G8/9/9/9/9/9/8K b P 1")
+        drop = moveFromString("01P")
+        self.assertIsNotNone(drop)
+        self.assertFalse(position.isLegalMove(drop))
+        self.assertNotIn(drop, position.generateMoves())
+
+if __name__ == '__main__':
+    unittest.main()
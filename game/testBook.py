@@ -0,0 +1,120 @@
+import os
+import random
+import tempfile
+import unittest
+
+from . import *
+from .book import OpeningBook, BookBuilder, InvalidBook, BOOK_STARTPOS
+from .book import usiGames, csaGames, kifGames, parseUsiMove, parseCsaMove, parseKifMove
+
+#the same game in every record format, the bishops are traded and sente drops theirs on 4e
+USI_GAME = "position startpos moves 7g7f 3c3d 8h2b+ 3a2b B*4e"
+CSA_GAME = """V2.2
+N+sente
+N-gote
+PI
++
++7776FU,T1
+-3334FU,T2
++8822UM
+-3122GI
++0045KA
+%TORYO
+"""
+KIF_GAME = """手合割：平手
+先手：sente
+後手：gote
+手数----指手---------消費時間--
+   1 ７六歩(77)   ( 0:01/00:00:01)
+   2 ３四歩(33)   ( 0:02/00:00:02)
+   3 ２二角成(88)   ( 0:01/00:00:02)
+   4 同　銀(31)   ( 0:01/00:00:03)
+   5 ４五角打   ( 0:01/00:00:03)
+   6 投了
+"""
+#the same moves as they are sent over the websocket
+WIRE_GAME = ["66P 65P", "22p 23p", "77B 11+B", "20s 11s", "34B"]
+
+def playWire(moves):
+    match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+    for move in moves:
+        match.getMoves()
+        match.doTurn(move)
+    return match
+
+class TestBookBuilder(unittest.TestCase):
+    def replay(self, games, parse):
+        moves = list(games)
+        self.assertEqual(len(moves), 1)
+        position = Position.fromSfen(BOOK_STARTPOS)
+        lastMove = None
+        played = []
+        for text in moves[0]:
+            move = parse(position, text, lastMove)
+            self.assertIsNotNone(move, text)
+            played.append(position.moveToString(move))
+            position.makeMove(move)
+            lastMove = move
+        return played
+
+    def testRecordFormatsAgree(self):
+        self.assertEqual(self.replay(usiGames(USI_GAME), parseUsiMove), WIRE_GAME)
+        self.assertEqual(self.replay(csaGames(CSA_GAME), parseCsaMove), WIRE_GAME)
+        self.assertEqual(self.replay(kifGames(KIF_GAME), parseKifMove), WIRE_GAME)
+
+    def testGamesFromOtherPositionsAreSkipped(self):
+        self.assertEqual(list(usiGames("position sfen 4k4/9/9/9/9/9/9/9/4K4 b - 1 moves 5i5h")), [])
+        self.assertEqual(list(kifGames("手合割：香落ち\n   1 ３四歩(33)\n")), [])
+
+    def testBadMoveEndsTheGame(self):
+        builder = BookBuilder()
+        self.assertEqual(builder.addGame(["7g7f", "3c3d", "7f7d"], parseUsiMove), 2)
+
+class TestOpeningBook(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".bin")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def testLookupIsWeightedByFrequency(self):
+        builder = BookBuilder(maxPlies=3)
+        builder.addRecords(USI_GAME + "\n7g7f 8c8d\n2g2f 8c8d\n7g7f 3c3d\n", ".usi")
+        builder.addRecords(CSA_GAME, ".csa")
+        builder.addRecords(KIF_GAME, ".kif")
+        self.assertEqual(builder.games, 6)
+        #the first 3 plies of the bishop trade game, 8c8d after 7g7f and 2g2f, and 2g2f
+        self.assertEqual(builder.write(self.path), 6)
+
+        book = OpeningBook(self.path)
+        start = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        moves = {Position.fromSfen(BOOK_STARTPOS).moveToString(move): weight for move, weight in book.lookup(start.positionKey())}
+        self.assertEqual(moves, {"66P 65P": 5, "16P 15P": 1})
+        self.assertEqual(book.lookup(playWire(WIRE_GAME).positionKey()), [])
+        self.assertIsNone(book.chooseMove(playWire(WIRE_GAME)))
+
+        rng = random.Random(1)
+        choices = [book.chooseMove(start, rng) for _ in range(60)]
+        self.assertGreater(choices.count("66P 65P"), choices.count("16P 15P"))
+        self.assertEqual(book.chooseMove(playWire(WIRE_GAME[:2]), rng), "77B 11+B")
+        book.close()
+
+    def testMinCount(self):
+        builder = BookBuilder()
+        builder.addRecords("7g7f 3c3d\n7g7f 8c8d\n", ".usi")
+        self.assertEqual(builder.write(self.path, minCount=2), 1)
+        self.assertEqual(len(OpeningBook(self.path)), 1)
+
+    def testNotABook(self):
+        with open(self.path, "wb") as bookFile:
+            bookFile.write(b"not a book, just some bytes")
+        with self.assertRaises(InvalidBook):
+            OpeningBook(self.path)
+        #an empty file can't even be mapped
+        open(self.path, "wb").close()
+        with self.assertRaises(InvalidBook):
+            OpeningBook(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
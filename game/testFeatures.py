@@ -0,0 +1,56 @@
+import random
+import unittest
+
+from . import *
+from .search import evaluate
+from .bitboard import SENTE, GOTE
+
+#numpy is a requirement (see web/server/django_image/requirements.txt), so these fail
+#without it instead of being skipped
+import numpy as np
+from .features import batchFeatures, batchEvaluate, matchFeatures, PLANES, PLANE_TYPES
+
+#positions from random games, so that there are promoted pieces and pieces in hand
+def randomPositions(count, seed=7):
+    rng = random.Random(seed)
+    positions = []
+    position = Position.fromMatch(BitboardMatch(ComputerPlayer(True), ComputerPlayer(False)))
+    while len(positions) < count:
+        moves = position.generateMoves()
+        if not moves or len(positions) % 80 == 79:
+            position = Position.fromMatch(BitboardMatch(ComputerPlayer(True), ComputerPlayer(False)))
+            moves = position.generateMoves()
+        position.makeMove(rng.choice(moves))
+        positions.append(position.copy())
+    return positions
+
+class TestFeatures(unittest.TestCase):
+    def testStartPosition(self):
+        planes, hands, side = matchFeatures(BitboardMatch(ComputerPlayer(True), ComputerPlayer(False)))
+        self.assertEqual(planes.shape, (PLANES, 9, 9))
+        #9 fuhyou and one gyokushou for each side, and nothing promoted or in hand
+        counts = planes.sum(axis=(1, 2))
+        self.assertEqual(list(counts[:len(PLANE_TYPES)]), [9, 2, 2, 2, 2, 1, 1, 1, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(list(counts[len(PLANE_TYPES):]), list(counts[:len(PLANE_TYPES)]))
+        self.assertEqual(hands.sum(), 0)
+        self.assertEqual(side, SENTE)
+        #sente's fuhyou are on y = 6
+        self.assertEqual(list(planes[0, :, 6]), [1] * 9)
+
+    def testPlanesMatchTheBoard(self):
+        positions = randomPositions(200)
+        planes, hands, sides = batchFeatures(positions)
+        self.assertEqual(planes.shape, (200, PLANES, 9, 9))
+        for n, position in enumerate(positions):
+            occupied = sum(1 for code in position.board if code)
+            self.assertEqual(planes[n].sum(), occupied)
+            self.assertEqual(list(hands[n][GOTE]), position.hand[GOTE][1:8])
+            self.assertEqual(sides[n], position.sideToMove)
+
+    def testBatchEvaluateMatchesEvaluate(self):
+        positions = randomPositions(300)
+        self.assertEqual(list(batchEvaluate(positions)), [evaluate(position) for position in positions])
+        self.assertEqual(len(batchEvaluate([])), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,7 +10,7 @@ from . import *
 
 def getCleanMatch(playerOne, playerTwo) -> Match:
     match = Match(playerOne, playerTwo)
-    match.hand.handKoma = []
+    match.hand = Hand()
     newBanmen = Banmen()
     newBanmen.clearPieces()
     match.grid = newBanmen
@@ -99,6 +99,105 @@ class TestBanMen(HasCleanGame):
         copyPieces = copyBanmen.getPieces()
         self.assertIs(len(copyPieces), 1)
 
+class TestMakeUnmakeMove(unittest.TestCase):
+    def testUnmakeRestoresMatch(self):
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        #bishop trade, so that there are captures, promotions and drops to undo
+        for move in ["66P 65P", "22p 23p", "77B 11+B"]:
+            match.getMoves()
+            match.doTurn(move)
+
+        before = match.serializeBoardState()
+        moves = match.getMoves()
+        self.assertTrue(len(moves) > 0)
+        for move in moves:
+            undo = match.makeMove(move)
+            self.assertNotEqual(match.serializeBoardState(), before)
+            match.unmakeMove(undo)
+            self.assertEqual(match.serializeBoardState(), before)
+
+    def testBitboardUnmakeRestoresMatch(self):
+        match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        for move in ["66P 65P", "22p 23p", "77B 11+B"]:
+            match.getMoves()
+            match.doTurn(move)
+
+        before = match.serializeBoardState()
+        moves = match.getMoves()
+        self.assertTrue(len(moves) > 0)
+        for move in moves:
+            undo = match.makeMove(move)
+            self.assertNotEqual(match.serializeBoardState(), before)
+            self.assertTrue(match.current_turn.isSente())
+            match.unmakeMove(undo)
+            self.assertEqual(match.serializeBoardState(), before)
+            self.assertFalse(match.current_turn.isSente())
+
+    def testUndoRecord(self):
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        for move in ["66P 65P", "22p 23p"]:
+            match.getMoves()
+            match.doTurn(move)
+        moves = match.getMoves()
+        capture = next(filter(lambda mv: mv.serialize() == "77B 11+B", moves))
+        undo = match.makeMove(capture)
+        self.assertIs(type(undo.captured), Kakugyou)
+        self.assertTrue(undo.promoted)
+        self.assertIs(undo.hand_delta, 1)
+        self.assertIs(match.hand.getCount(Kakugyou, True), 1)
+        self.assertFalse(match.current_turn.isSente())
+
+        match.unmakeMove(undo)
+        self.assertIs(match.hand.getCount(Kakugyou, True), 0)
+        self.assertTrue(match.current_turn.isSente())
+        self.assertIs(match.grid.getMasu(7, 7).getKoma(), undo.src_koma)
+
+class TestHand(unittest.TestCase):
+    def testCounts(self):
+        hand = Hand()
+        self.assertTrue(hand.isEmpty())
+        hand.addKoma(Fuhyou, False, 10)
+        hand.addKoma(Hisha, True)
+        hand.removeKoma(Fuhyou, False)
+        self.assertIs(hand.getCount(Fuhyou, False), 9)
+        self.assertIs(hand.getCount(Fuhyou, True), 0)
+        self.assertFalse(hand.isEmpty())
+        #sente's pieces come first, in the order P G N S B R L
+        hand.addKoma(Fuhyou, True)
+        hand.addKoma(Kinshou, False, 2)
+        self.assertEqual(hand.serialize(), "PR9p2g")
+
+    def testCopyIsSeparate(self):
+        hand = Hand()
+        hand.addKoma(Ginshou, True)
+        copied = hand.copy()
+        copied.addKoma(Ginshou, True)
+        self.assertIs(hand.getCount(Ginshou, True), 1)
+        self.assertIs(copied.getCount(Ginshou, True), 2)
+
+class TestDoTurn(unittest.TestCase):
+    def testDoTurnLooksUpMove(self):
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        moves = match.getMoves()
+        self.assertEqual(match.serializeMoves(moves), [move.serialize() for move in moves])
+        with self.assertRaises(MoveNotFound):
+            match.doTurn("66P 64P")
+        match.doTurn("66P 65P")
+        self.assertIsNone(match.grid.getMasu(6, 6).getKoma())
+        #the moves from before the turn can't be played again
+        with self.assertRaises(MoveNotFound):
+            match.doTurn("66P 65P")
+
+    def testDoTurnMove(self):
+        for match in [Match(ComputerPlayer(True), ComputerPlayer(False)), BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))]:
+            moves = match.getMoves()
+            move = next(move for move in moves if move.serialize() == "66P 65P")
+            match.doTurnMove(move)
+            self.assertFalse(match.current_turn.isSente())
+            self.assertIs(type(match.grid.getMasu(6, 5).getKoma()), Fuhyou)
+            with self.assertRaises(MoveNotFound):
+                match.doTurnMove(move)
+
 class TestPieceMoves(HasCleanGame):
     def testLanceMoves(self):
         self.playerOne = ComputerPlayer(True)
@@ -140,6 +239,18 @@ class TestPieceMoves(HasCleanGame):
         movesXYList = list(map(self.moveToTupleForTest, knightMoves))
         self.assertTrue(self.checkMovesAgainstAnswerMoves(movesXYList, answerXYList))
 
+    def testKnightPromotionIsOptionalOnThirdRank(self):
+        knight = Keima(True)
+        knightMasu = Masu(4, 4, knight)
+        self.match.grid.grid[4][4] = knightMasu
+        answerXYList = [
+            [5, 2, False], [5, 2, True],
+            [3, 2, False], [3, 2, True]
+        ]
+        knightMoves = knight.legalMoves(self.match.grid, knightMasu, None)
+        movesXYList = list(map(self.moveToTupleForTest, knightMoves))
+        self.assertTrue(self.checkMovesAgainstAnswerMoves(movesXYList, answerXYList))
+
     def testFuhyouMoves(self):
         self.match.current_player = self.playerTwo
         fuhyou = Fuhyou(False)
@@ -248,6 +359,58 @@ class TestCheck(HasCleanGame):
         self.assertFalse(board.kingIsInCheck(False))
 
 
+    def testIsSquareAttacked(self):
+        board = self.match.grid
+        board.grid[4][4] = Masu(4, 4, Keima(True))
+        # sente knight jumps forward two ranks
+        self.assertTrue(board.isSquareAttacked(3, 2, True))
+        self.assertTrue(board.isSquareAttacked(5, 2, True))
+        self.assertFalse(board.isSquareAttacked(3, 6, True))
+        self.assertFalse(board.isSquareAttacked(3, 2, False))
+
+        # gote lance slides down the file until it hits a piece
+        board.grid[0][0] = Masu(0, 0, Kyousha(False))
+        self.assertTrue(board.isSquareAttacked(0, 8, False))
+        board.grid[0][5] = Masu(0, 5, Fuhyou(True))
+        self.assertTrue(board.isSquareAttacked(0, 5, False))
+        self.assertFalse(board.isSquareAttacked(0, 6, False))
+
+        # a promoted silver moves like a gold, so it can no longer go backwards diagonally
+        promotedSilver = Ginshou(False)
+        promotedSilver.Promote()
+        board.grid[6][6] = Masu(6, 6, promotedSilver)
+        self.assertTrue(board.isSquareAttacked(6, 5, False))
+        self.assertTrue(board.isSquareAttacked(7, 6, False))
+        self.assertFalse(board.isSquareAttacked(7, 5, False))
+
+        # a promoted rook gains the diagonal steps
+        promotedRook = Hisha(True)
+        promotedRook.Promote()
+        board.grid[8][0] = Masu(8, 0, promotedRook)
+        self.assertTrue(board.isSquareAttacked(7, 1, True))
+        self.assertFalse(board.isSquareAttacked(6, 2, True))
+        self.assertTrue(board.isSquareAttacked(8, 8, True))
+
+    def testKingIsTrackedByMakeMove(self):
+        board = self.match.grid
+        king = Gyokushou(True)
+        board.grid[4][8] = Masu(4, 8, king)
+        self.assertEqual(board.findKingCoordinates(True), (4, 8))
+
+        undo = board.makeMove(Move(board.getMasu(4, 8), Masu(4, 7, king)))
+        self.assertEqual(board.kingCoordinates[True], (4, 7))
+        self.assertEqual(board.findKingCoordinates(True), (4, 7))
+        board.unmakeMove(undo)
+        self.assertEqual(board.kingCoordinates[True], (4, 8))
+
+        # editing the grid directly is noticed as well
+        board.grid[4][8].setKoma(None)
+        board.grid[3][8].setKoma(king)
+        self.assertEqual(board.findKingCoordinates(True), (3, 8))
+        board.grid[3][8].setKoma(None)
+        self.assertIsNone(board.findKingCoordinates(True))
+
+
 class TestFiltersOote(HasCleanGame):
     #the keima cannot move because it would put the king in check
     def testCantPutOwnKingInCheck(self):
@@ -292,10 +455,56 @@ class TestFiltersOote(HasCleanGame):
         ]
         self.assertTrue(self.checkMovesAgainstAnswerMoves(movesXYList, answerList))
 
+    #the gold is pinned to the king by the hisha, so it can only move along the file
+    def testPinnedPieceStaysOnPinRay(self):
+        gold = Kinshou(True)
+        self.match.grid.grid[4][8] = Masu(4, 8, Gyokushou(True))
+        self.match.grid.grid[4][6] = Masu(4, 6, gold)
+        self.match.grid.grid[4][2] = Masu(4, 2, Hisha(False))
+        self.match.grid.grid[0][0] = Masu(0, 0, Gyokushou(False))
+
+        moves = self.match.getMoves()
+        goldMoves = list(filter(lambda mv: mv.src_square is not None and mv.src_square.getKoma() is gold, moves))
+        movesXYList = list(map(self.moveToTupleForTest, goldMoves))
+        self.assertTrue(self.checkMovesAgainstAnswerMoves(movesXYList, [[4, 5, False], [4, 7, False]]))
+
+    #a held piece can only be placed in between the checking hisha and the king
+    def testDropsBlockCheck(self):
+        self.match.hand.addKoma(Kinshou, True)
+        self.match.grid.grid[4][8] = Masu(4, 8, Gyokushou(True))
+        self.match.grid.grid[4][2] = Masu(4, 2, Hisha(False))
+        self.match.grid.grid[0][0] = Masu(0, 0, Gyokushou(False))
+
+        moves = self.match.getMoves()
+        dropMoves = list(filter(lambda mv: mv.src_square is None, moves))
+        movesXYList = list(map(self.moveToTupleForTest, dropMoves))
+        answerList = [[4, 3, False], [4, 4, False], [4, 5, False], [4, 6, False], [4, 7, False]]
+        self.assertTrue(self.checkMovesAgainstAnswerMoves(movesXYList, answerList))
+
+    #when two pieces give check at once, only the king can do anything about it
+    def testDoubleCheckOnlyKingMoves(self):
+        king = Gyokushou(True)
+        self.match.hand.addKoma(Kinshou, True)
+        self.match.grid.grid[4][8] = Masu(4, 8, king)
+        self.match.grid.grid[4][2] = Masu(4, 2, Hisha(False))
+        self.match.grid.grid[3][6] = Masu(3, 6, Keima(False))
+        # the silver could take the knight, if the hisha wasn't also checking
+        self.match.grid.grid[2][7] = Masu(2, 7, Ginshou(True))
+        self.match.grid.grid[0][0] = Masu(0, 0, Gyokushou(False))
+
+        moves = self.match.getMoves()
+        self.assertTrue(len(moves) > 0)
+        for move in moves:
+            self.assertIsNotNone(move.src_square)
+            self.assertIs(move.src_square.getKoma(), king)
+        movesXYList = list(map(self.moveToTupleForTest, moves))
+        answerList = [[3, 8, False], [5, 8, False], [3, 7, False], [5, 7, False]]
+        self.assertTrue(self.checkMovesAgainstAnswerMoves(movesXYList, answerList))
+
 class TestHeldPieceMoves(HasCleanGame):
     def testPlaceKakugyou(self):
         kakugyou = Kakugyou(True, onHand=True)
-        self.match.hand.handKoma.append([kakugyou, 1])
+        self.match.hand.addKoma(Kakugyou, True)
         self.match.grid.grid[2][4] = Masu(2, 4, Fuhyou(False))
         heldKakuMoves = kakugyou.legalMoves(self.match.grid, None, self.match.hand)
         self.assertIs(len(heldKakuMoves), 80)
@@ -306,9 +515,19 @@ class TestHeldPieceMoves(HasCleanGame):
         moves = self.match.getMoves()
         self.assertIs(len(moves), 79)
 
+    def testPlaceFuhyouAndKyousha(self):
+        #neither can be placed on the last rank, where it would never be able to move
+        for komaType in [Fuhyou, Kyousha]:
+            senteMoves = komaType(True, onHand=True).legalMoves(self.match.grid, None, self.match.hand)
+            self.assertEqual(len(senteMoves), 72)
+            self.assertFalse(any(move.trgt_square.getY() == 0 for move in senteMoves))
+            goteMoves = komaType(False, onHand=True).legalMoves(self.match.grid, None, self.match.hand)
+            self.assertEqual(len(goteMoves), 72)
+            self.assertFalse(any(move.trgt_square.getY() == 8 for move in goteMoves))
+
     def testPlaceKnight(self):
         knight = Keima(True, onHand=True)
-        self.match.hand.handKoma.append(knight)
+        self.match.hand.addKoma(Keima, True)
         #the knight cannot be placed such that it is near the end of the board and therefore
         #cannot move
         #remove the first two ranks from the list of available masu from an empty board 81 - (9 files * 2 ranks) = 63 squares
@@ -372,6 +591,27 @@ class TestHeldPieceMoves(HasCleanGame):
         return squareCountMap
 
 class TestMates(HasCleanGame):
+    def testFuhyouDropMateIsNotAllowed(self):
+        self.match.grid.grid[0][0] = Masu(0, 0, Gyokushou(False))
+        self.match.grid.grid[8][8] = Masu(8, 8, Gyokushou(True))
+        #the gold defends the placed fuhyou and covers (1, 1), the knight covers (1, 0)
+        self.match.grid.grid[1][2] = Masu(1, 2, Kinshou(True))
+        self.match.grid.grid[2][2] = Masu(2, 2, Keima(True))
+        self.match.hand.addKoma(Fuhyou, True)
+
+        for match in [self.match, BitboardMatch(self.playerOne, self.playerTwo)]:
+            if isinstance(match, BitboardMatch):
+                match.grid = self.match.grid
+                match.hand = self.match.hand
+            moves = match.serializeMoves(match.getMoves())
+            self.assertNotIn("01P", moves)
+            self.assertIn("02P", moves)
+
+        #without the knight the king can get away, so the same check is allowed
+        self.match.grid.grid[2][2] = Masu(2, 2, None)
+        moves = self.match.serializeMoves(self.match.getMoves())
+        self.assertIn("01P", moves)
+
     def testLadderMate(self):
         #Gote's turn
         kingKoma = Gyokushou(False)
@@ -0,0 +1,48 @@
+import unittest
+
+from . import *
+from .perft import PERFT_POSITIONS, STARTPOS, loadPosition, perft, divide
+
+#the deeper counts take too long for the test run, python -m game.perft --suite checks those
+
+class TestPerft(unittest.TestCase):
+    def testKnownCounts(self):
+        for core in ["bitboard", "banmen"]:
+            for name, sfen, counts in PERFT_POSITIONS:
+                for depth, expected in enumerate(counts[:2], start=1):
+                    self.assertEqual(perft(loadPosition(sfen, core), depth), expected, f'{name} depth:{depth} core:{core}')
+
+    def testDivideAddsUpToPerft(self):
+        position = loadPosition(STARTPOS)
+        counts = divide(position, 2)
+        self.assertEqual(len(counts), 30)
+        self.assertEqual(sum(nodes for _, nodes in counts), 900)
+        self.assertIn(("66P 65P", 30), counts)
+
+    def testPerftLeavesPositionUnchanged(self):
+        for core in ["bitboard", "banmen"]:
+            position = loadPosition(PERFT_POSITIONS[1][1], core)
+            before = position.serialize() if core == "bitboard" else position.serializeBoardState()
+            perft(position, 2)
+            after = position.serialize() if core == "bitboard" else position.serializeBoardState()
+            self.assertEqual(before, after)
+
+class TestPositionFromSfen(unittest.TestCase):
+    def testStartpos(self):
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        #the board is read the same way serializeBoardState writes it
+        position = Position.fromSfen(match.serializeBoardState())
+        self.assertEqual(position.serialize(), match.serializeBoardState())
+
+    def testHandCounts(self):
+        position = Position.fromSfen(PERFT_POSITIONS[1][1])
+        self.assertEqual(position.serialize().split(" ")[2], "GR5pgns")
+        self.assertEqual(position.sideToMove, 1)
+
+    def testInvalidSfen(self):
+        for sfen in ["", "9/9/9 b -", "9/9/9/9/9/9/9/9/+G8 b -", "lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSN b -", "9/9/9/9/9/9/9/9/9 x -"]:
+            with self.assertRaises(InvalidSfen):
+                Position.fromSfen(sfen)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from . import *
+from .search import search, evaluate, Searcher, MATE_SCORE
+from .bitboard import moveFromString, CODE_SHIFT, TO_SHIFT, SQUARE_MASK
+from .transposition import TranspositionTable
+
+#the searches here are small enough to always finish their depth well inside of the budget
+
+class TestSearch(unittest.TestCase):
+    def testStartPositionIsEven(self):
+        match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        self.assertEqual(evaluate(Position.fromMatch(match)), 0)
+
+    def testFindsMateInOne(self):
+        #the gold dropped in front of the king is held up by the fuhyou
+        match = Match.fromSfen("4k4/9/4P4/9/9/9/9/9/4K4 b G 1")
+        result = search(match, max_ms=5000, max_nodes=100000)
+        self.assertEqual(result.moveString(), "41G")
+        self.assertEqual(result.score, MATE_SCORE - 1)
+        self.assertTrue(result.isMate())
+
+    def testTakesHangingRook(self):
+        match = Match.fromSfen("4k4/9/9/9/4r4/9/9/9/K3R4 w - 1")
+        result = search(match, max_ms=5000, max_depth=2)
+        self.assertEqual(result.depth, 2)
+        self.assertEqual(result.moveString(), "44r 48+r")
+
+    def testStopsAtNodeBudget(self):
+        match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        result = search(match, max_ms=60000, max_nodes=500)
+        self.assertLessEqual(result.nodes, 500)
+        self.assertIsNotNone(result.move)
+        self.assertIn(result.move, match.position.generateMoves())
+
+    def testStopsAtDeadline(self):
+        match = Match.fromSfen("l6nl/5+P1gk/2np1S3/p1p4Pp/3P2Sp1/1PPb2P1P/P5GS1/R8/LN4bKL w RGgsn5p 1")
+        result = search(match, max_ms=150, tt=TranspositionTable(1))
+        #the clock is only looked at every few hundred nodes
+        self.assertLess(result.elapsedMs, 1000)
+        self.assertIn(result.moveString(), match.serializeMoves(match.getMoves()))
+
+    def testPrincipalVariationIsPlayable(self):
+        match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        result = search(match, max_ms=5000, max_depth=2)
+        self.assertEqual(result.depth, 2)
+        self.assertEqual(result.pv[0], result.move)
+        for move in result.pvStrings():
+            match.getMoves()
+            match.doTurn(move)
+
+    def testNoMovesLoses(self):
+        match = Match.fromSfen("4k4/4G4/4P4/9/9/9/9/9/4K4 w - 1")
+        result = search(match)
+        self.assertIsNone(result.move)
+        self.assertEqual(result.score, -MATE_SCORE)
+
+class TestMoveOrdering(unittest.TestCase):
+    def testOrder(self):
+        #the lance can take the rook, the gold can take the rook or the gold
+        position = Position.fromSfen("4k4/9/3gr4/3GL4/9/9/9/9/4K4 b - 1")
+        searcher = Searcher(position, TranspositionTable(0), 1000, 1000)
+        ttMove = moveFromString("48K 38K")
+        killer = moveFromString("48K 58K")
+        searcher.killers[0] = [killer, 0]
+        ordered = [position.moveToString(move) for move in searcher.orderMoves(position.generateMoves(), ttMove, 0)]
+        self.assertEqual(ordered[:5], ["48K 38K", "43L 42+L", "43L 42L", "33G 42G", "33G 32G"])
+        self.assertEqual(ordered[5], "48K 58K")
+
+    def testCutoffsAreRemembered(self):
+        position = Position.fromSfen("4k4/9/3gr4/3GL4/9/9/9/9/4K4 b - 1")
+        searcher = Searcher(position, TranspositionTable(0), 1000, 1000)
+        quiet = moveFromString("48K 58K")
+        capture = moveFromString("43L 42+L")
+        searcher.rememberCutoff(capture, 3, 2)
+        self.assertEqual(searcher.killers[2], [0, 0])
+        searcher.rememberCutoff(quiet, 3, 2)
+        self.assertEqual(searcher.killers[2], [quiet, 0])
+        self.assertEqual(searcher.history[quiet >> CODE_SHIFT][(quiet >> TO_SHIFT) & SQUARE_MASK], 9)
+
+    def testOrderingSearchesFewerNodes(self):
+        match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        ordered = search(match, max_ms=60000, max_depth=3, tt=TranspositionTable(1))
+        unordered = search(match, max_ms=60000, max_depth=3, tt=TranspositionTable(1), ordering=False)
+        self.assertEqual(ordered.depth, 3)
+        self.assertEqual(unordered.depth, 3)
+        self.assertLess(ordered.nodes * 2, unordered.nodes)
+
+if __name__ == '__main__':
+    unittest.main()
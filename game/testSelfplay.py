@@ -0,0 +1,71 @@
+import io
+import json
+import os
+from contextlib import redirect_stdout
+import tempfile
+import unittest
+
+from . import *
+from .bitboard import Position, SENTE, GOTE
+from .selfplay import Engine, playGame, randomOpening, runGames, perpetualCheckWinner, eloEstimate, main
+
+class TestSelfplay(unittest.TestCase):
+    def testEngineSpecs(self):
+        engine = Engine("search:ms=20,depth=2,tt=0.5")
+        self.assertEqual((engine.options["max_ms"], engine.options["max_depth"], engine.options["tt"]), (20, 2, 0.5))
+        for spec in ["alphazero", "search:speed=9", "random:ms=5", "search:ms=fast"]:
+            with self.assertRaises(Exception):
+                Engine(spec)
+
+    def testPairsShareTheirOpening(self):
+        first = playGame(0, Engine("random"), Engine("search:depth=1"), None, 12, 4, 3)
+        second = playGame(1, Engine("random"), Engine("search:depth=1"), None, 12, 4, 3)
+        self.assertEqual(first["moves"][:4], second["moves"][:4])
+        self.assertEqual((first["sente"], second["sente"]), ("random", "search:depth=1"))
+        self.assertEqual((first["reason"], first["plies"], first["scoreA"]), ("maxPlies", 12, 0.5))
+
+    def testMateEndsTheGame(self):
+        #gote's gyokushou has no way out of the kinshou on 5b
+        record = playGame(0, Engine("search:depth=1"), Engine("random"), "4k4/9/4P4/9/9/9/9/9/4K4 b G 1", 10, 0, 1)
+        self.assertEqual((record["result"], record["reason"], record["plies"], record["scoreA"]), ("sente", "mate", 1, 1.0))
+
+    def testStartThatIsAlreadyOver(self):
+        #gote is already mated, there is no random opening to play before that is found
+        for randomPlies in [0, 4]:
+            record = playGame(0, Engine("random"), Engine("random"), "4k4/4G4/4P4/9/9/9/9/9/4K4 w - 1", 10, randomPlies, 1)
+            self.assertEqual((record["result"], record["reason"], record["plies"]), ("sente", "mate", 0))
+        self.assertEqual(randomOpening(Position.fromSfen("4k4/4G4/4P4/9/9/9/9/9/4K4 w - 1"), 4, 1), [])
+
+    def testPerpetualCheck(self):
+        #gote answered every one of sente's checks, sente to move again in the same position
+        self.assertEqual(perpetualCheckWinner([False, True, False, True, False, True, False, True, False], 1, SENTE), GOTE)
+        self.assertIsNone(perpetualCheckWinner([False, True, False, False, False, True, False, True, False], 1, SENTE))
+
+    def testElo(self):
+        self.assertEqual(eloEstimate(5, 0, 5)[0], 0)
+        self.assertAlmostEqual(eloEstimate(3, 0, 1)[0], 190.85, places=2)
+        #a clean sweep is held just under a score of 1, it still has an elo
+        self.assertGreater(eloEstimate(10, 0, 0)[0], 0)
+        elo, margin = eloEstimate(8, 1, 1)
+        self.assertGreater(elo, margin)
+
+    def testRecordsAreWritten(self):
+        handle, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(handle)
+        try:
+            with redirect_stdout(io.StringIO()):
+                main(["--games", "2", "--workers", "1", "--engine-a", "random", "--max-plies", "8", "--output", path])
+            with open(path) as output:
+                records = [json.loads(line) for line in output]
+        finally:
+            os.remove(path)
+        self.assertEqual([record["game"] for record in records], [0, 1])
+        self.assertEqual(len(records[1]["moves"]), 8)
+        self.assertEqual(Match.fromSfen(records[0]["start"]).serializeBoardState(), records[0]["start"])
+
+    def testPool(self):
+        records = list(runGames(Engine("random"), Engine("random"), 4, 2, maxPlies=6))
+        self.assertEqual(sorted(record["game"] for record in records), [0, 1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import random
+import unittest
+
+from . import *
+
+#every position reached in these games should come back the same way
+#after a trip through serializeBoardState and deserializeBoardState
+
+def randomGame(seed: int, plies: int, matchType = Match):
+    rng = random.Random(seed)
+    match = matchType(ComputerPlayer(True), ComputerPlayer(False))
+    for _ in range(plies):
+        yield match
+        moves = match.serializeMoves(match.getMoves())
+        if len(moves) == 0:
+            return
+        match.doTurn(rng.choice(moves))
+
+class TestSfenRoundTrip(unittest.TestCase):
+    def testRoundTripRandomGames(self):
+        for seed in range(8):
+            for match in randomGame(seed, 60):
+                sfen = match.serializeBoardState()
+                loaded = Match.fromSfen(sfen)
+                self.assertEqual(loaded.serializeBoardState(), sfen)
+                self.assertEqual(sorted(loaded.serializeMoves(loaded.getMoves())), sorted(match.serializeMoves(match.getMoves())), sfen)
+
+    def testRoundTripBitboardMatch(self):
+        for match in randomGame(11, 80, BitboardMatch):
+            sfen = match.serializeBoardState()
+            loaded = BitboardMatch.fromSfen(sfen)
+            self.assertEqual(loaded.serializeBoardState(), sfen)
+            self.assertEqual(Match.fromSfen(sfen).serializeBoardState(), sfen)
+
+    def testInitialPosition(self):
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        loaded = Match.fromSfen(match.serializeBoardState())
+        self.assertEqual(loaded.grid.findKingCoordinates(True), (4, 8))
+        self.assertEqual(loaded.grid.findKingCoordinates(False), (4, 0))
+        self.assertEqual(len(loaded.getMoves()), 30)
+
+class TestDeserializeBoardState(unittest.TestCase):
+    def testStandardSfenFields(self):
+        match = Match.fromSfen("l6nl/5+P1gk/2np1S3/p1p4Pp/3P2Sp1/1PPb2P1P/P5GS1/R8/LN4bKL w RGgsn5p 124")
+        self.assertFalse(match.current_turn.isSente())
+        self.assertEqual(match.move_number, 124)
+        self.assertEqual(match.hand.getCount(Fuhyou, False), 5)
+        self.assertEqual(match.hand.getCount(Hisha, True), 1)
+        tokin = match.grid.getMasu(5, 1).getKoma()
+        self.assertIs(type(tokin), Fuhyou)
+        self.assertTrue(tokin.isPromoted())
+        self.assertTrue(tokin.isSente())
+
+    def testEmptyHand(self):
+        match = Match.fromSfen("lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1")
+        self.assertTrue(match.hand.isEmpty())
+
+    def testMoveNumberFollowsMoves(self):
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        match.getMoves()
+        match.doTurn("66P 65P")
+        self.assertEqual(match.move_number, 2)
+
+    def testPlayersAreKept(self):
+        human = HumanPlayer(False)
+        computer = ComputerPlayer(True)
+        match = Match.fromSfen("4k4/9/9/9/9/9/9/9/4K4 w", computer, human)
+        self.assertIs(match.current_turn, human)
+
+    def testInvalidSfen(self):
+        for sfen in ["", "4k4/9/9/9/9/9/9/9/4K4", "4k4/9/9/9/9/9/9/9/4K5 b", "4k4/9/9/9/9/9/9/9/4K4 x",
+                     "4+k4/9/9/9/9/9/9/9/4K4 b", "4k4/9/9/9/9/9/9/9/4K4 b K", "4k4/9/9/9/9/9/9/9/4K4 b - one"]:
+            with self.assertRaises(InvalidSfen, msg=sfen):
+                Match.fromSfen(sfen)
+
+if __name__ == '__main__':
+    unittest.main()
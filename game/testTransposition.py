@@ -0,0 +1,101 @@
+import unittest
+
+from . import *
+from .search import search
+from .transposition import TranspositionTable, SharedTranspositionTable, BOUND_EXACT, BOUND_LOWER, BOUND_UPPER, ENTRY_BYTES
+from .smp import LazySmp
+
+class TestTranspositionTable(unittest.TestCase):
+    def testStoreAndProbe(self):
+        tt = TranspositionTable(1)
+        key = 0x1234_5678_9abc_def0
+        self.assertIsNone(tt.probe(key))
+        tt.store(key, 5, BOUND_LOWER, 123456, -29990)
+        self.assertEqual(tt.probe(key), (123456, -29990, 5, BOUND_LOWER))
+        self.assertEqual((tt.probes, tt.hits, tt.stores), (2, 1, 1))
+        self.assertEqual(tt.hitRate(), 0.5)
+
+    def testSizeIsCapped(self):
+        for megabytes in (0.5, 1, 3, 16):
+            tt = TranspositionTable(megabytes)
+            self.assertLessEqual(tt.sizeBytes(), megabytes * 1024 * 1024)
+            self.assertGreater(tt.sizeBytes() * 2, megabytes * 1024 * 1024)
+        self.assertEqual(TranspositionTable(0).sizeBytes(), 2 * ENTRY_BYTES)
+
+    def testDeepEntryIsKept(self):
+        tt = TranspositionTable(0)
+        #every key lands in the only bucket
+        tt.store(1, 8, BOUND_EXACT, 11, 100)
+        tt.store(2, 2, BOUND_EXACT, 22, 200)
+        tt.store(3, 1, BOUND_UPPER, 33, 300)
+        self.assertEqual(tt.probe(1), (11, 100, 8, BOUND_EXACT))
+        self.assertIsNone(tt.probe(2))
+        self.assertEqual(tt.probe(3), (33, 300, 1, BOUND_UPPER))
+        #a deeper search takes the deep slot, and the entry it pushes out takes the other one
+        tt.store(4, 9, BOUND_EXACT, 44, 400)
+        self.assertEqual(tt.probe(4), (44, 400, 9, BOUND_EXACT))
+        self.assertEqual(tt.probe(1), (11, 100, 8, BOUND_EXACT))
+        self.assertIsNone(tt.probe(3))
+
+    def testOldEntriesAreReplaced(self):
+        tt = TranspositionTable(0)
+        tt.store(1, 8, BOUND_EXACT, 11, 100)
+        tt.newSearch()
+        tt.store(2, 1, BOUND_EXACT, 22, 200)
+        tt.store(3, 1, BOUND_EXACT, 33, 300)
+        self.assertEqual(tt.probe(2), (22, 200, 1, BOUND_EXACT))
+        self.assertEqual(tt.probe(3), (33, 300, 1, BOUND_EXACT))
+        self.assertIsNone(tt.probe(1))
+
+    def testFailLowKeepsBestMove(self):
+        tt = TranspositionTable(1)
+        tt.store(7, 3, BOUND_EXACT, 77, 10)
+        tt.store(7, 4, BOUND_UPPER, 0, -50)
+        self.assertEqual(tt.probe(7), (77, -50, 4, BOUND_UPPER))
+
+    def testTableIsSharedAcrossMoves(self):
+        tt = TranspositionTable(1)
+        match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        first = search(match, max_ms=10000, max_depth=3, tt=tt)
+        #searching the same position again starts from the entries of the first search
+        second = search(match, max_ms=10000, max_depth=3, tt=tt)
+        self.assertEqual(first.move, second.move)
+        self.assertLess(second.nodes, first.nodes)
+        self.assertGreater(second.ttHitRate(), first.ttHitRate())
+        self.assertEqual(tt.probes, first.ttProbes + second.ttProbes)
+
+    def testTornSlotReadsAsEmpty(self):
+        tt = TranspositionTable(0)
+        tt.store(1, 8, BOUND_EXACT, 11, 100)
+        tt.store(2, 2, BOUND_EXACT, 22, 200)
+        #the key of one store with the entry of another, as two processes writing at once can leave it
+        tt.entries[1] = tt.entries[0]
+        self.assertIsNone(tt.probe(2))
+        self.assertEqual(tt.probe(1), (11, 100, 8, BOUND_EXACT))
+
+class TestSharedTranspositionTable(unittest.TestCase):
+    def testAttachedTableSeesStores(self):
+        owner = SharedTranspositionTable(1)
+        attached = SharedTranspositionTable(1, owner.name)
+        owner.advanceAge()
+        attached.newSearch()
+        self.assertEqual(attached.age, 1)
+        attached.store(7, 3, BOUND_EXACT, 77, 10)
+        self.assertEqual(owner.probe(7), (77, 10, 3, BOUND_EXACT))
+        attached.close()
+        owner.close()
+
+    def testHelpersAgreeWithOneSearch(self):
+        match = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        smp = LazySmp(helpers=2, megabytes=1)
+        try:
+            result = smp.search(match.serializeBoardState(), max_ms=10000, max_depth=2)
+        finally:
+            smp.close()
+        single = search(match, max_ms=10000, max_depth=2, tt=TranspositionTable(1))
+        self.assertEqual(result.depth, 2)
+        self.assertEqual(result.score, single.score)
+        self.assertGreater(result.ttHits, 0)
+
+if __name__ == '__main__':
+    unittest.main()
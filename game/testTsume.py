@@ -0,0 +1,65 @@
+import unittest
+
+from . import *
+from .tsume import solve, solveMate
+from .search import search, MATE_SCORE
+
+#gote's king on 5a with a fuhyou under it, a kinshou dropped on 5b is mate
+MATE_IN_ONE = "4k4/9/4P4/9/9/9/9/9/4K4 b G 1"
+#the ginshou next to the king take the first kinshou, the second one mates
+MATE_IN_THREE = "3sks3/9/4S4/9/9/9/9/9/4K4 b 2G 1"
+#a lone kinshou can check the king but never mate it
+NO_MATE = "4k4/9/9/9/9/9/9/9/4K4 b G 1"
+
+def playLine(sfen, line):
+    position = Position.fromSfen(sfen)
+    for move in line:
+        position.makeMove(move)
+    return position
+
+class TestTsume(unittest.TestCase):
+    def assertMated(self, sfen, result, length):
+        self.assertTrue(result.isMate())
+        self.assertEqual(len(result.line), length)
+        position = playLine(sfen, result.line)
+        self.assertTrue(position.inCheck())
+        self.assertEqual(len(position.generateMoves()), 0)
+
+    def testMateInOne(self):
+        self.assertMated(MATE_IN_ONE, solve(Position.fromSfen(MATE_IN_ONE)), 1)
+
+    def testMateInThree(self):
+        self.assertMated(MATE_IN_THREE, solve(Position.fromSfen(MATE_IN_THREE)), 3)
+
+    def testNoMate(self):
+        result = solve(Position.fromSfen(NO_MATE))
+        self.assertIs(result.proven, False)
+        self.assertEqual(result.line, [])
+
+    def testBudgetRunsOut(self):
+        result = solve(Position.fromSfen(MATE_IN_THREE), max_nodes=5)
+        self.assertIsNone(result.proven)
+        self.assertEqual(result.nodes, 5)
+
+    def testChecksAreTheLegalMovesThatCheck(self):
+        #the ginshou on 5c blocks the hisha on 5i, moving it off of the file is a discovered check
+        for sfen in [MATE_IN_THREE, "4k4/9/4S4/9/9/9/9/9/4R3K b GNLP 1"]:
+            position = Position.fromSfen(sfen)
+            checking = []
+            for move in position.generateMoves():
+                undo = position.makeMove(move)
+                if position.inCheck():
+                    checking.append(move)
+                position.unmakeMove(undo)
+            self.assertEqual(sorted(position.generateChecks()), sorted(checking))
+
+    def testSearchPlaysTheMate(self):
+        #a single iteration of the search can't see it, the solver finds it first
+        match = Match.fromSfen(MATE_IN_THREE)
+        result = search(match, max_ms=5000, max_depth=1, mate_ms=1000)
+        self.assertEqual(result.moveString(), solveMate(match).moveString())
+        self.assertEqual(result.score, MATE_SCORE - 3)
+        self.assertEqual(len(result.pv), 3)
+
+if __name__ == '__main__':
+    unittest.main()
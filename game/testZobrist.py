@@ -0,0 +1,58 @@
+import random
+import unittest
+
+from . import *
+
+#the key that makeMove/doTurn keep up to date has to be the same as one built
+#from scratch, and the two position cores have to agree on it
+
+class TestPositionKey(unittest.TestCase):
+    def testIncrementalKeyMatchesFullKey(self):
+        rng = random.Random(5)
+        match = Match(ComputerPlayer(True), ComputerPlayer(False))
+        bitboardMatch = BitboardMatch(ComputerPlayer(True), ComputerPlayer(False))
+        for _ in range(120):
+            sfen = match.serializeBoardState()
+            self.assertEqual(match.position_key, match.computePositionKey(), sfen)
+            self.assertEqual(match.positionKey(), Match.fromSfen(sfen).positionKey(), sfen)
+            self.assertEqual(match.positionKey(), bitboardMatch.positionKey(), sfen)
+            self.assertEqual(bitboardMatch.positionKey(), Position.fromSfen(sfen).positionKey(), sfen)
+            moves = match.serializeMoves(match.getMoves())
+            bitboardMatch.getMoves()
+            if len(moves) == 0:
+                break
+            move = rng.choice(moves)
+            match.doTurn(move)
+            bitboardMatch.doTurn(move)
+
+    def testTranspositionsShareAKey(self):
+        keys = []
+        for moves in [["66P 65P", "22p 23p", "26P 25P"], ["26P 25P", "22p 23p", "66P 65P"]]:
+            match = Match(ComputerPlayer(True), ComputerPlayer(False))
+            for move in moves:
+                match.getMoves()
+                match.doTurn(move)
+            keys.append(match.positionKey())
+        self.assertEqual(keys[0], keys[1])
+
+    def testSideToMoveChangesKey(self):
+        sente = Match.fromSfen("4k4/9/9/9/9/9/9/9/4K4 b")
+        gote = Match.fromSfen("4k4/9/9/9/9/9/9/9/4K4 w")
+        self.assertNotEqual(sente.positionKey(), gote.positionKey())
+
+    def testUnmakeRestoresKey(self):
+        match = Match.fromSfen("l6nl/5+P1gk/2np1S3/p1p4Pp/3P2Sp1/1PPb2P1P/P5GS1/R8/LN4bKL w RGgsn5p 1")
+        position = Position.fromMatch(match)
+        key = match.positionKey()
+        for move in match.getMoves():
+            undo = match.makeMove(move)
+            self.assertNotEqual(match.positionKey(), key)
+            match.unmakeMove(undo)
+            self.assertEqual(match.positionKey(), key)
+        for move in position.generateMoves():
+            undo = position.makeMove(move)
+            position.unmakeMove(undo)
+            self.assertEqual(position.positionKey(), key)
+
+if __name__ == '__main__':
+    unittest.main()
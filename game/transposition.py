@@ -0,0 +1,216 @@
+from array import array
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Tuple
+
+#a fixed size hash table of search results, indexed by the zobrist key of the position
+#in shogi the same position is reached by many move orders (drops especially), so a
+#result that was searched once can be reused instead of searching the position again
+#
+#the table is two parallel arrays of 64 bit ints, one with the full key xored with the
+#entry to check that the entry really belongs to the position, and one with the packed entry
+#   score + SCORE_OFFSET | depth << DEPTH_SHIFT | bound << BOUND_SHIFT | age << AGE_SHIFT | move << MOVE_SHIFT
+#xoring the key with the entry means that a slot that two processes wrote to at the same
+#time (see SharedTranspositionTable) doesn't check out, so no lock is needed around it
+#
+#entries are kept in buckets of two slots
+#   slot 0 keeps the deepest search of the positions that land in the bucket
+#   slot 1 always takes the newest entry
+#and an entry that was left by an older search can always be replaced
+
+DEFAULT_TT_MB = 16
+#a key and an entry, 8 bytes each
+ENTRY_BYTES = 16
+BUCKET_SLOTS = 2
+
+#what the stored score means, an empty slot has no bound
+BOUND_NONE = 0
+#the score is at least this much, the search failed high
+BOUND_LOWER = 1
+#the score is at most this much, the search failed low
+BOUND_UPPER = 2
+BOUND_EXACT = 3
+
+SCORE_OFFSET = 1 << 15
+DEPTH_SHIFT = 16
+BOUND_SHIFT = 24
+AGE_SHIFT = 26
+MOVE_SHIFT = 32
+DEPTH_MASK = 255
+BOUND_MASK = 3
+AGE_MASK = 63
+SCORE_MASK = (1 << 16) - 1
+
+#the largest power of two of buckets that fits in the memory
+def bucketCount(megabytes: float) -> int:
+    buckets = 1
+    while buckets * 2 * BUCKET_SLOTS * ENTRY_BYTES <= megabytes * 1024 * 1024:
+        buckets *= 2
+    return buckets
+
+class TranspositionTable:
+    """
+    a transposition table that is capped at a number of megabytes
+    it can be kept for a whole match so that each move starts with what
+    the search for the moves before it found
+    """
+    keys: array
+    entries: array
+    bucketMask: int
+    age: int
+    probes: int
+    hits: int
+    stores: int
+
+    def __init__(self, megabytes: float = DEFAULT_TT_MB):
+        buckets = bucketCount(megabytes)
+        self.bucketMask = buckets - 1
+        self.keys = array("Q", bytes(8 * buckets * BUCKET_SLOTS))
+        self.entries = array("Q", bytes(8 * buckets * BUCKET_SLOTS))
+        self.age = 0
+        self.resetStats()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def sizeBytes(self) -> int:
+        return len(self.entries) * ENTRY_BYTES
+
+    def clear(self):
+        size = len(self.entries)
+        self.keys = array("Q", bytes(8 * size))
+        self.entries = array("Q", bytes(8 * size))
+        self.age = 0
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    #called at the start of every search, so that entries from the searches
+    #of earlier moves give way to the new ones
+    def newSearch(self):
+        self.age = (self.age + 1) & AGE_MASK
+
+    #(move, score, depth, bound) of the position, or None when it isn't in the table
+    def probe(self, key: int) -> Optional[Tuple[int, int, int, int]]:
+        self.probes += 1
+        index = (key & self.bucketMask) * BUCKET_SLOTS
+        keys = self.keys
+        entries = self.entries
+        for slot in range(index, index + BUCKET_SLOTS):
+            entry = entries[slot]
+            if entry and keys[slot] ^ entry == key:
+                self.hits += 1
+                return (
+                    entry >> MOVE_SHIFT,
+                    (entry & SCORE_MASK) - SCORE_OFFSET,
+                    (entry >> DEPTH_SHIFT) & DEPTH_MASK,
+                    (entry >> BOUND_SHIFT) & BOUND_MASK,
+                )
+        return None
+
+    def store(self, key: int, depth: int, bound: int, move: int, score: int):
+        self.stores += 1
+        deep = (key & self.bucketMask) * BUCKET_SLOTS
+        newest = deep + 1
+        keys = self.keys
+        entries = self.entries
+        entry = (score + SCORE_OFFSET) | min(depth, DEPTH_MASK) << DEPTH_SHIFT | bound << BOUND_SHIFT \
+            | self.age << AGE_SHIFT
+        deepEntry = entries[deep]
+        newestEntry = entries[newest]
+        inDeep = deepEntry and keys[deep] ^ deepEntry == key
+        inNewest = newestEntry and keys[newest] ^ newestEntry == key
+        #a search that failed low has no best move, so the one found before is kept
+        if not move:
+            if inNewest:
+                move = newestEntry >> MOVE_SHIFT
+            elif inDeep:
+                move = deepEntry >> MOVE_SHIFT
+        entry |= move << MOVE_SHIFT
+
+        if not deepEntry or depth >= (deepEntry >> DEPTH_SHIFT) & DEPTH_MASK \
+                or (deepEntry >> AGE_SHIFT) & AGE_MASK != self.age:
+            #the entry that is pushed out of the deep slot still gets the other one
+            if deepEntry and not inDeep:
+                keys[newest] = keys[deep]
+                entries[newest] = deepEntry
+            elif inNewest:
+                keys[newest] = 0
+                entries[newest] = 0
+            keys[deep] = key ^ entry
+            entries[deep] = entry
+        else:
+            keys[newest] = key ^ entry
+            entries[newest] = entry
+
+    def hitRate(self) -> float:
+        return self.hits / self.probes if self.probes else 0.0
+
+    #how many of the first thousand slots hold an entry from the current search, in permille
+    def fullness(self) -> int:
+        sample = min(1000, len(self.entries))
+        used = 0
+        for slot in range(sample):
+            entry = self.entries[slot]
+            if entry and (entry >> AGE_SHIFT) & AGE_MASK == self.age:
+                used += 1
+        return used * 1000 // sample
+
+    def __str__(self) -> str:
+        return f'tt size:{self.sizeBytes() // 1024}kB probes:{self.probes} hits:{self.hits} hitrate:{self.hitRate():.1%} stores:{self.stores} full:{self.fullness()}/1000'
+
+
+#each word of the header of a shared table
+HEADER_AGE = 0
+HEADER_WORDS = 1
+
+class SharedTranspositionTable(TranspositionTable):
+    """
+    a transposition table in shared memory, for several processes that search the same
+    position at once (see smp.py), one process creates it and the others attach to it by name
+    the processes write to it without a lock, a slot that was written by two of them at
+    once doesn't check out against either key and reads as empty
+    """
+    memory: SharedMemory
+    owner: bool
+
+    def __init__(self, megabytes: float = DEFAULT_TT_MB, name: Optional[str] = None):
+        buckets = bucketCount(megabytes)
+        self.bucketMask = buckets - 1
+        slots = buckets * BUCKET_SLOTS
+        self.owner = name is None
+        if self.owner:
+            self.memory = SharedMemory(create=True, size=8 * (HEADER_WORDS + 2 * slots))
+        else:
+            self.memory = SharedMemory(name=name)
+        words = self.memory.buf.cast("Q")
+        self.header = words[:HEADER_WORDS]
+        self.keys = words[HEADER_WORDS:HEADER_WORDS + slots]
+        self.entries = words[HEADER_WORDS + slots:HEADER_WORDS + 2 * slots]
+        self.words = words
+        self.age = self.header[HEADER_AGE]
+        self.resetStats()
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    #the process that starts the searches moves the age on, and the searches pick it up
+    def advanceAge(self):
+        self.header[HEADER_AGE] = (self.header[HEADER_AGE] + 1) & AGE_MASK
+
+    def newSearch(self):
+        self.age = self.header[HEADER_AGE]
+
+    def clear(self):
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+        self.age = 0
+
+    #the creator also frees the memory, the table can't be used after this
+    def close(self):
+        for view in (self.header, self.keys, self.entries, self.words):
+            view.release()
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
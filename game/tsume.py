@@ -0,0 +1,261 @@
+import argparse
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .main import Match
+from .bitboard import Position, MOVE_STRINGS
+from .perft import formatResult
+
+#a checkmate (tsume) solver, a depth first proof number search (df-pn) where the
+#attacker only plays checks and the defender plays every legal move
+#
+#   result = solveMate(match, max_ms=500)
+#   if result.isMate(): match.doTurn(result.moveString())
+#
+#   python -m game.tsume problems.txt [--max-nodes 100000] [--max-ms 10000]
+#
+#every node keeps two numbers from the point of view of its side to move
+#   phi, how many more leaves have to be proven to show that the side to move wins
+#   delta, how many more leaves have to be proven to show that it loses
+#so at the attacker's nodes phi is the proof number and delta the disproof number,
+#and the other way around at the defender's nodes, which lets both be searched alike
+#   phi(node) = min(delta(child)), delta(node) = sum(phi(child))
+
+INFINITE = 100_000_000
+DEFAULT_MAX_MS = 10_000
+DEFAULT_MAX_NODES = 1_000_000
+#the table is cleared when it gets this big, a solve is cut short long before this anyway
+DEFAULT_TABLE_SIZE = 1_000_000
+CLOCK_CHECK_MASK = 255
+#a mate line is followed this far at the most, in case the table lost part of it
+MAX_LINE_LENGTH = 255
+
+class SolveStopped(Exception):
+    pass
+
+class MateResult:
+    """
+    proven is True when there is a forced mate, False when there isn't one, and None
+    when the budget ran out first, line is one mate (not always the shortest one)
+    """
+    proven: Optional[bool]
+    line: List[int]
+    nodes: int
+    elapsedMs: float
+
+    def __init__(self):
+        self.proven = None
+        self.line = []
+        self.nodes = 0
+        self.elapsedMs = 0.0
+
+    def isMate(self) -> bool:
+        return self.proven is True
+
+    def moveString(self) -> Optional[str]:
+        return MOVE_STRINGS[self.line[0]] if self.line else None
+
+    def lineStrings(self) -> List[str]:
+        return [MOVE_STRINGS[move] for move in self.line]
+
+    def __str__(self) -> str:
+        state = {True: "mate", False: "nomate", None: "unknown"}[self.proven]
+        return f'{state} length:{len(self.line)} {formatResult(self.nodes, self.elapsedMs / 1000)} line:{" ".join(self.lineStrings())}'
+
+class MateSolver:
+    position: Position
+    #the side that is giving the checks
+    attacker: int
+    #position key -> (phi, delta), the solver's own table, separate from the search's
+    table: Dict[int, Tuple[int, int]]
+    #position key -> how many plies the attacker mates in, for the positions that are proven
+    #for the attacker, so that the mate line always heads for a quicker mate and never goes round
+    mateLengths: Dict[int, int]
+    nodes: int
+
+    def __init__(self, position: Position, maxMs: int = DEFAULT_MAX_MS, maxNodes: int = DEFAULT_MAX_NODES,
+            tableSize: int = DEFAULT_TABLE_SIZE):
+        self.position = position
+        self.attacker = position.sideToMove
+        self.table = {}
+        self.mateLengths = {}
+        self.tableSize = tableSize
+        self.nodes = 0
+        self.maxNodes = maxNodes
+        self.deadline = time.perf_counter() + maxMs / 1000
+        #keys of the positions between the root and the node being searched
+        self.path = set()
+
+    def countNode(self):
+        self.nodes += 1
+        if self.nodes >= self.maxNodes:
+            raise SolveStopped()
+        if not self.nodes & CLOCK_CHECK_MASK and time.perf_counter() >= self.deadline:
+            raise SolveStopped()
+
+    def generateFor(self, position: Position):
+        if position.sideToMove == self.attacker:
+            return position.generateChecks()
+        return position.generateMoves()
+
+    def lookup(self, key: int) -> Tuple[int, int]:
+        return self.table.get(key, (1, 1))
+
+    def store(self, key: int, phi: int, delta: int):
+        if len(self.table) >= self.tableSize:
+            self.table.clear()
+            self.mateLengths.clear()
+        self.table[key] = (phi, delta)
+
+    def attackerWins(self, numbers: Tuple[int, int], attackerToMove: bool) -> bool:
+        return numbers == ((0, INFINITE) if attackerToMove else (INFINITE, 0))
+
+    #the attacker takes the quickest mate and the defender the slowest one
+    def storeMateLength(self, key: int, moves):
+        position = self.position
+        attackerToMove = position.sideToMove == self.attacker
+        lengths = []
+        for move in moves:
+            undo = position.makeMove(move)
+            childKey = position.positionKey()
+            if self.attackerWins(self.lookup(childKey), not attackerToMove):
+                lengths.append(self.mateLengths.get(childKey, 0))
+            position.unmakeMove(undo)
+        self.mateLengths[key] = 1 + (min(lengths) if attackerToMove else max(lengths))
+
+    #(phi, delta) of the position after each move
+    def childNumbers(self, moves) -> List[Tuple[int, int]]:
+        position = self.position
+        numbers = []
+        for move in moves:
+            undo = position.makeMove(move)
+            key = position.positionKey()
+            if key in self.path:
+                #going back to a position on the path is a perpetual check, which the attacker loses,
+                #so it is proven for the defender, whichever side is to move after it
+                if position.sideToMove == self.attacker:
+                    numbers.append((INFINITE, 0))
+                else:
+                    numbers.append((0, INFINITE))
+            else:
+                numbers.append(self.lookup(key))
+            position.unmakeMove(undo)
+        return numbers
+
+    def mid(self, thresholdPhi: int, thresholdDelta: int) -> Tuple[int, int]:
+        self.countNode()
+        position = self.position
+        key = position.positionKey()
+        phi, delta = self.lookup(key)
+        if phi >= thresholdPhi or delta >= thresholdDelta:
+            return (phi, delta)
+        moves = self.generateFor(position)
+        if not moves:
+            #no checks left for the attacker, or no way out of check for the defender
+            self.store(key, INFINITE, 0)
+            if position.sideToMove != self.attacker:
+                self.mateLengths[key] = 0
+            return (INFINITE, 0)
+
+        self.path.add(key)
+        while True:
+            numbers = self.childNumbers(moves)
+            phi = INFINITE
+            delta = 0
+            best = 0
+            secondDelta = INFINITE
+            bestPhi = 0
+            for index, (childPhi, childDelta) in enumerate(numbers):
+                delta = min(INFINITE, delta + childPhi)
+                if childDelta < phi:
+                    secondDelta = phi
+                    phi = childDelta
+                    best = index
+                    bestPhi = childPhi
+                elif childDelta < secondDelta:
+                    secondDelta = childDelta
+            if phi >= thresholdPhi or delta >= thresholdDelta:
+                break
+            childThresholdPhi = min(INFINITE, thresholdDelta + bestPhi - delta)
+            childThresholdDelta = min(thresholdPhi, secondDelta + 1)
+            undo = position.makeMove(moves[best])
+            try:
+                self.mid(childThresholdPhi, childThresholdDelta)
+            finally:
+                position.unmakeMove(undo)
+        self.path.discard(key)
+        self.store(key, phi, delta)
+        if self.attackerWins((phi, delta), position.sideToMove == self.attacker):
+            self.storeMateLength(key, moves)
+        return (phi, delta)
+
+    #follows proven positions in the table from the root, the attacker takes the quickest
+    #mate and the defender holds out the longest, as far as the proof went
+    def mateLine(self) -> List[int]:
+        position = self.position.copy()
+        line = []
+        while len(line) < MAX_LINE_LENGTH:
+            attackerToMove = position.sideToMove == self.attacker
+            chosen = None
+            chosenLength = 0
+            for move in self.generateFor(position):
+                undo = position.makeMove(move)
+                key = position.positionKey()
+                if self.attackerWins(self.lookup(key), not attackerToMove) and key in self.mateLengths:
+                    length = self.mateLengths[key]
+                    if chosen is None or (length < chosenLength if attackerToMove else length > chosenLength):
+                        chosen = move
+                        chosenLength = length
+                position.unmakeMove(undo)
+            #mated, or the table was cleared under part of the proof
+            if chosen is None:
+                break
+            line.append(chosen)
+            position.makeMove(chosen)
+        return line
+
+def solve(position: Position, max_ms: int = DEFAULT_MAX_MS, max_nodes: int = DEFAULT_MAX_NODES) -> MateResult:
+    start = time.perf_counter()
+    solver = MateSolver(position.copy(), max_ms, max_nodes)
+    result = MateResult()
+    try:
+        phi, delta = solver.mid(INFINITE, INFINITE)
+        if phi == 0:
+            result.proven = True
+            result.line = solver.mateLine()
+        elif delta == 0:
+            result.proven = False
+    except SolveStopped:
+        pass
+    result.nodes = solver.nodes
+    result.elapsedMs = (time.perf_counter() - start) * 1000
+    return result
+
+#is there a mate by checks for the side to move in the match
+def solveMate(match: Match, max_ms: int = DEFAULT_MAX_MS, max_nodes: int = DEFAULT_MAX_NODES) -> MateResult:
+    return solve(Position.fromMatch(match), max_ms, max_nodes)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m game.tsume", description="solve tsume problems, one sfen per line with the attacker to move")
+    parser.add_argument("problems", help="a file of sfen, blank lines and lines starting with # are skipped")
+    parser.add_argument("--max-nodes", type=int, default=DEFAULT_MAX_NODES, help="the node budget of each problem")
+    parser.add_argument("--max-ms", type=int, default=DEFAULT_MAX_MS, help="the time budget of each problem")
+    args = parser.parse_args(argv)
+
+    with open(args.problems) as problemFile:
+        problems = [line.strip() for line in problemFile if line.strip() and not line.startswith("#")]
+    solved = 0
+    nodes = 0
+    seconds = 0.0
+    for number, sfen in enumerate(problems, start=1):
+        result = solve(Position.fromSfen(sfen), args.max_ms, args.max_nodes)
+        solved += result.isMate()
+        nodes += result.nodes
+        seconds += result.elapsedMs / 1000
+        print(f'{number}: {result}')
+    print(f'solved:{solved}/{len(problems)} {formatResult(nodes, seconds)}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import random
+from typing import List
+
+#zobrist keys, a position is identified by a 64 bit int that is the xor of a random
+#key for every piece on every square, one for every hand count, and one for gote to move,
+#so that a move only has to xor in the few keys that it changed
+#
+#pieces are numbered the same way as the bitboard core
+#   code = piece type (+ 8 when promoted) + 16 for gote's pieces
+#and squares are sq = x * 9 + y, so both cores give the same key for a position
+
+ZOBRIST_SEED = 0x5107_1ae7
+#there are 18 fuhyou, no piece type can be held more times than that
+MAX_HAND_COUNT = 18
+
+_rng = random.Random(ZOBRIST_SEED)
+
+#PIECE_KEYS[code][sq]
+PIECE_KEYS: List[List[int]] = [[_rng.getrandbits(64) for _ in range(81)] for _ in range(32)]
+#HAND_KEYS[side][pieceType][count], holding none of a piece adds nothing to the key
+HAND_KEYS: List[List[List[int]]] = [
+    [[0] + [_rng.getrandbits(64) for _ in range(MAX_HAND_COUNT)] for _ in range(8)]
+    for _ in range(2)
+]
+SIDE_KEY: int = _rng.getrandbits(64)
+
+#counts are indexed [side][pieceType] like Position.hand
+def handKey(counts: List[List[int]]) -> int:
+    key = 0
+    for side in range(2):
+        for pieceType, count in enumerate(counts[side]):
+            key ^= HAND_KEYS[side][pieceType][count]
+    return key
@@ -9,7 +9,15 @@ enum MessageTypes {
 	ERROR = "err",
 	YOU_LOSE = "yl",
 	YOU_WIN = "yw",
-	GAME_STARTED = "gs"
+	GAME_STARTED = "gs",
+	//the delta protocol, see the server's protocol.py
+	GAME_STATE_DELTA = "gsd",
+	RESYNC = "rs",
+	//the move queries, see the server's protocol.py
+	GET_MOVES_FOR_SQUARE = "gms",
+	GET_DROPS_FOR_PIECE = "gdp",
+	MOVES_FOR_SQUARE = "ms",
+	DROPS_FOR_PIECE = "dp",
 }
 
 enum MessageKeys {
@@ -19,4 +27,12 @@ enum MessageKeys {
 	MOVES = "moves",
 	MOVE = "move",
 	ERROR_MESSAGE = "err_msg",
+	DIFFICULTY = "difficulty",
+	//the delta protocol, see the server's protocol.py
+	VERSION = "ver",
+	HASH = "hash",
+	LAST_MOVE = "last",
+	//the move queries, see the server's protocol.py
+	SQUARE = "sq",
+	PIECE = "piece",
 }
@@ -10,7 +10,7 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 import os
 
 # from channels.auth import AuthMiddlewareStack
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
@@ -29,5 +29,10 @@ application = ProtocolTypeRouter({
         AuthMiddlewareStack(URLRouter(
             mai_shogi_site.routing.websocket_urlpatterns
         ))
-    )
+    ),
+    # the games are played on workers started with runworker, see
+    # mai_shogi_site.engineShards
+    "channel": ChannelNameRouter(
+        mai_shogi_site.routing.engine_channel_routes
+    ),
 })
@@ -0,0 +1,284 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from os import cpu_count, environ
+from typing import Dict, List, Optional, Tuple
+
+from redis import Redis
+
+from .game.search import searchSfen, initSearchWorker, SearchResult
+from .game.search import DEFAULT_MAX_MS, DEFAULT_MAX_NODES, MAX_PLY
+from .game.transposition import DEFAULT_TT_MB
+from .game.book import OpeningBook, InvalidBook
+from .game.smp import LazySmp
+from .engineShards import ENGINE_SHARDS
+
+# the computer opponent thinks in a pool of worker processes, so that a
+# search never holds up the event loop that every other websocket on this
+# daphne process is waiting on
+# the workers are only sent the position as sfen, and send back the result
+#
+# the searches are started by the engine workers (see GameEngineConsumer),
+# every one of them has a pool of its own, so the pools' sizes below are per
+# engine worker, and by default they split the host's cores between them
+# each engine worker publishes how busy its pool is to redis (see
+# publishStats), which /ai/stats adds up
+
+# how long the computer may think about each move, and how many positions it may look at
+AI_MOVE_MS = int(environ.get('SHOGI_AI_MOVE_MS', DEFAULT_MAX_MS))
+AI_MOVE_NODES = int(environ.get('SHOGI_AI_MOVE_NODES', DEFAULT_MAX_NODES))
+# the most memory that each worker's search results can use
+TT_MB = float(environ.get('SHOGI_TT_MB', DEFAULT_TT_MB))
+# the cores that each engine worker's searches get
+SHARD_CPUS = max(1, (cpu_count() or 1) // ENGINE_SHARDS)
+# how many searches can run at the same time in each engine worker
+AI_WORKERS = int(environ.get('SHOGI_AI_WORKERS', min(2, SHARD_CPUS)))
+# the p99 of how long a computer move takes, waiting in the queue included,
+# that the budgets are shrunk to stay under when the pool gets busy
+AI_LATENCY_TARGET_MS = int(environ.get('SHOGI_AI_LATENCY_TARGET_MS', AI_MOVE_MS * 2))
+# how long a consumer waits for a search, including the time that it spends
+# waiting for a free worker, before it gives up on it
+AI_TIMEOUT_MS = int(environ.get('SHOGI_AI_TIMEOUT_MS', AI_LATENCY_TARGET_MS * 2))
+
+# how much of the time budget the mate solver gets to look for a mate by
+# checks before the search starts, the search gets whatever it leaves over
+AI_MATE_SHARE = float(environ.get('SHOGI_AI_MATE_SHARE', 0.25))
+
+# (time budget in ms, node budget, deepest iteration, mate solver share) for each difficulty
+DIFFICULTIES: Dict[str, Tuple[int, int, int, float]] = {
+    "easy": (200, 2_000, 1, 0.0),
+    "normal": (AI_MOVE_MS, AI_MOVE_NODES, 3, AI_MATE_SHARE),
+    "hard": (AI_MOVE_MS * 3, AI_MOVE_NODES * 3, MAX_PLY, AI_MATE_SHARE),
+    "premium": (AI_MOVE_MS * 3, AI_MOVE_NODES * 3, MAX_PLY, AI_MATE_SHARE),
+}
+# premium searches run on their own helper processes, one per core of the
+# engine worker's share by default, that search together through a table
+# in shared memory, one premium game's search at a time, a premium search
+# that comes in while they are busy is searched in the pool instead
+AI_SMP_HELPERS = int(environ.get('SHOGI_AI_SMP_HELPERS', SHARD_CPUS))
+PREMIUM_DIFFICULTY = "premium"
+DEFAULT_DIFFICULTY = environ.get('SHOGI_AI_DIFFICULTY', "normal")
+# a shrunk budget never goes under this, so the computer still plays a move
+# that it looked at
+AI_MIN_MOVE_MS = 50
+# how many of the latest searches the p99 is taken over
+LATENCY_WINDOW = 200
+# an opening book built with python -m game.book, played from before searching
+AI_BOOK_PATH = environ.get('SHOGI_BOOK_PATH')
+# each engine worker's stats are kept in redis under this and its channel,
+# and dropped when it hasn't published them for AI_STATS_TTL_SECONDS
+AI_STATS_PREFIX = "ai-stats:"
+AI_STATS_TTL_SECONDS = 60
+
+executor: Optional[ProcessPoolExecutor] = None
+# searches that were handed to the pool and haven't finished yet, the
+# ones that are running and the ones that are waiting for a worker
+pendingSearches = 0
+# whether the helpers are running a premium search
+premiumPending = 0
+# the time budgets of those searches added up, in ms
+pendingBudgetMs = 0
+# futures finish on the executor's own thread
+pendingLock = threading.Lock()
+# how long the latest searches took, from being handed to the pool to
+# coming back, in ms
+latencies: deque = deque(maxlen=LATENCY_WINDOW)
+# every budget is multiplied by this, it drops every time a search takes
+# longer than the target and creeps back up with every search that comes
+# back well inside of it
+budgetScale = 1.0
+# opened the first time it is needed, False once it turned out to be missing
+book = None
+# started the first time that a premium game needs it
+smp: Optional[LazySmp] = None
+premiumThread: Optional[ThreadPoolExecutor] = None
+
+
+def getExecutor() -> ProcessPoolExecutor:
+    global executor
+    if executor is None:
+        # daphne runs threads, which aren't safe to fork, so the workers
+        # start from a fresh interpreter instead
+        executor = ProcessPoolExecutor(
+            max_workers=AI_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initSearchWorker,
+            initargs=(TT_MB,),
+        )
+    return executor
+
+
+def getSmp() -> LazySmp:
+    global smp
+    if smp is None:
+        smp = LazySmp(AI_SMP_HELPERS, TT_MB)
+    return smp
+
+
+def getPremiumThread() -> ThreadPoolExecutor:
+    global premiumThread
+    if premiumThread is None:
+        premiumThread = ThreadPoolExecutor(max_workers=1)
+    return premiumThread
+
+
+def getBook() -> Optional[OpeningBook]:
+    global book
+    if book is None:
+        book = False
+        if AI_BOOK_PATH:
+            try:
+                book = OpeningBook(AI_BOOK_PATH)
+            except (OSError, InvalidBook) as e:
+                print(f'could not open the opening book {AI_BOOK_PATH}:{e}')
+    return book or None
+
+
+def queueDepth() -> int:
+    return pendingSearches + premiumPending
+
+
+def statsKey(shard: str) -> str:
+    return f'{AI_STATS_PREFIX}{shard}'
+
+
+# how busy the pool of this process is
+def poolStats() -> Dict[str, float]:
+    return {
+        "queueDepth": queueDepth(),
+        "workers": AI_WORKERS,
+        "smpHelpers": AI_SMP_HELPERS,
+        "latencyP99Ms": latencyP99(),
+        "budgetScale": budgetScale,
+    }
+
+
+# called by the engine worker of the shard as its searches start and finish
+def publishStats(conn: Redis, shard: str):
+    pipe = conn.pipeline(transaction=False)
+    pipe.hset(statsKey(shard), mapping=poolStats())
+    pipe.expire(statsKey(shard), AI_STATS_TTL_SECONDS)
+    pipe.execute()
+
+
+# the stats of every engine worker that published them lately, by its channel
+def shardStats(conn: Redis, shards: List[str]) -> Dict[str, Dict[str, float]]:
+    pipe = conn.pipeline(transaction=False)
+    for shard in shards:
+        pipe.hgetall(statsKey(shard))
+    return {
+        shard: {field: float(value) for (field, value) in stats.items()}
+        for (shard, stats) in zip(shards, pipe.execute())
+        if stats
+    }
+
+
+def difficultyBudget(difficulty: Optional[str]) -> Tuple[int, int, int, float]:
+    return DIFFICULTIES.get(difficulty, DIFFICULTIES[DEFAULT_DIFFICULTY])
+
+
+def latencyP99() -> float:
+    if not latencies:
+        return 0.0
+    ordered = sorted(latencies)
+    return ordered[min(len(ordered) - 1, len(ordered) * 99 // 100)]
+
+
+def recordLatency(ms: float):
+    global budgetScale
+    latencies.append(ms)
+    if ms > AI_LATENCY_TARGET_MS:
+        budgetScale = max(0.05, budgetScale * 0.8)
+    elif ms < AI_LATENCY_TARGET_MS / 2:
+        budgetScale = min(1.0, budgetScale + 0.05)
+
+
+# a search has to wait for the searches ahead of it, which share the
+# workers, so it only gets what is left of the latency target after them
+# waitMs is how long that is, the pool's by default
+def shrinkBudget(maxMs: int, maxNodes: int, waitMs: Optional[float] = None) -> Tuple[int, int]:
+    if waitMs is None:
+        waitMs = pendingBudgetMs / AI_WORKERS
+    ms = min(maxMs * budgetScale, AI_LATENCY_TARGET_MS * budgetScale - waitMs)
+    ms = max(AI_MIN_MOVE_MS, int(ms))
+    if ms >= maxMs:
+        return (maxMs, maxNodes)
+    return (ms, max(1, maxNodes * ms // maxMs))
+
+
+def searchFinished(budgetMs: int, start: float, future: Future):
+    global pendingSearches, pendingBudgetMs, executor
+    with pendingLock:
+        pendingSearches -= 1
+        pendingBudgetMs -= budgetMs
+        recordLatency((time.perf_counter() - start) * 1000)
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        # a worker died, the next search starts a new pool
+        executor = None
+
+
+def premiumFinished(helpers: LazySmp, start: float, future: Future):
+    global smp, premiumPending
+    with pendingLock:
+        premiumPending -= 1
+        recordLatency((time.perf_counter() - start) * 1000)
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        smp = None
+        helpers.close()
+
+
+# hands the search to the pool and returns its future straight away, the
+# engine workers (see GameEngineConsumer) wait on it without blocking
+# the future raises BrokenProcessPool if a worker died, the next search
+# starts a new pool
+def submitSearch(sfen: str, difficulty: Optional[str] = None) -> Future:
+    global pendingSearches, pendingBudgetMs, executor, premiumPending
+    maxMs, maxNodes, maxDepth, mateShare = difficultyBudget(difficulty)
+    if difficulty == PREMIUM_DIFFICULTY and AI_SMP_HELPERS > 1:
+        with pendingLock:
+            helpersFree = premiumPending == 0
+            if helpersFree:
+                premiumPending += 1
+        if helpersFree:
+            # nothing is ahead of it on the helpers, but it is still held
+            # to the latency target when the searches have been coming back late
+            maxMs, maxNodes = shrinkBudget(maxMs, maxNodes, 0)
+            helpers = getSmp()
+            try:
+                # the helpers' search blocks until they are done, so it
+                # waits on a thread of its own
+                future = getPremiumThread().submit(helpers.search, sfen, maxMs, maxNodes, maxDepth, int(maxMs * mateShare))
+            except RuntimeError:
+                with pendingLock:
+                    premiumPending -= 1
+                raise
+            future.add_done_callback(partial(premiumFinished, helpers, time.perf_counter()))
+            return future
+    maxMs, maxNodes = shrinkBudget(maxMs, maxNodes)
+    try:
+        future = getExecutor().submit(searchSfen, sfen, maxMs, maxNodes, maxDepth, int(maxMs * mateShare))
+    except BrokenProcessPool:
+        executor = None
+        raise
+    with pendingLock:
+        pendingSearches += 1
+        pendingBudgetMs += maxMs
+    # a search is pending until its worker lets go of it, whether or not
+    # anyone is still waiting for it
+    future.add_done_callback(partial(searchFinished, maxMs, time.perf_counter()))
+    return future
+
+
+# raises asyncio.TimeoutError if the search doesn't come back in timeoutMs,
+# and BrokenProcessPool if a worker died
+async def searchPosition(
+    sfen: str,
+    difficulty: Optional[str] = None,
+    timeoutMs: int = AI_TIMEOUT_MS,
+) -> SearchResult:
+    return await asyncio.wait_for(asyncio.wrap_future(submitSearch(sfen, difficulty)), timeoutMs / 1000)
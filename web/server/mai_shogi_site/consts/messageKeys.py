@@ -7,3 +7,11 @@ class MessageKeys(str, Enum):
     MOVES = "moves"
     MOVE = "move"
     ERROR_MESSAGE = "err_msg"
+    DIFFICULTY = "difficulty"
+    # the delta protocol, see protocol.py
+    VERSION = "ver"
+    HASH = "hash"
+    LAST_MOVE = "last"
+    # the move queries, see protocol.py
+    SQUARE = "sq"
+    PIECE = "piece"
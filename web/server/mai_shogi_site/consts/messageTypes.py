@@ -9,3 +9,11 @@ class MessageTypes(str, Enum):
     ERROR = "err"
     YOU_LOSE = "yl"
     YOU_WIN = "yw"
+    # the delta protocol, see protocol.py
+    GAME_STATE_DELTA = "gsd"
+    RESYNC = "rs"
+    # the move queries, see protocol.py
+    GET_MOVES_FOR_SQUARE = "gms"
+    GET_DROPS_FOR_PIECE = "gdp"
+    MOVES_FOR_SQUARE = "ms"
+    DROPS_FOR_PIECE = "dp"
@@ -1,133 +1,315 @@
-import random
-import json
-from typing import List, Tuple
-from channels.generic.websocket import SyncConsumer
+import threading
+from concurrent.futures import Future
+from functools import partial
+from os import environ
+from typing import Dict, Optional
 
-from ..consts import MessageKeys, MessageTypes
+from asgiref.sync import async_to_sync
+from channels.consumer import SyncConsumer
+from redis.exceptions import RedisError
 
-from ..game import Match
-from ..game import ComputerPlayer
-from ..game import HumanPlayer
 from ..game import MoveNotFound
-from ..game import Move
+from ..game.search import search
+from ..game.transposition import TranspositionTable
+from ..aiPool import submitSearch, queueDepth, getBook, publishStats, AI_TIMEOUT_MS
+from .. import gameStore
+from ..gameStore import GameNotFound, HotGame, MatchCache, NotYourTurn, StaleGameVersion
+
+# how many matches each engine worker keeps in memory, the games that
+# haven't had a move in the longest are dropped first
+ENGINE_HOT_GAMES = int(environ.get('SHOGI_ENGINE_HOT_GAMES', 256))
+# if the worker pool is too busy to answer in time, the computer makes do
+# with a search this small, which is quick enough to run on the worker
+AI_FALLBACK_NODES = 300
+# when redis can't be reached, the computer's move is tried again this many
+# times, this far apart, before its opponent is told that it couldn't be played
+COMPUTER_MOVE_RETRIES = 3
+COMPUTER_MOVE_RETRY_MS = 1000
 
 
 class GameEngineConsumer(SyncConsumer):
     """
-    TODO this isn't actually being used, player 1's websocket is holding
-    the game state. In order to get this to work, I need to learn how to
-    use workers
-    sync consumer that holds the game state, and updates it according to
-    move broadcasts
-    hear move broadcast on the channel group -> process the move
-    -> inform clients of the new state
+    an engine worker, run with runworker on one of the channels of
+    engineShards, it plays the moves of every game that hashes to it and
+    tells the players' consumers what happened, they only relay between
+    the sockets and here
+    the messages that it gets all have the game code under 'game'
+        engine.open             sends the game as it is to 'reply', or to
+                                both players when 'reply' is None, 'queries'
+                                is whether 'player' asks for its moves one
+                                piece at a time
+        engine.move             plays 'move' for 'player' against 'version'
+        engine.query            sends the legal moves from 'square', or the
+                                drops of 'piece', to 'reply'
+        engine.computer.move    the computer's move, from its search
+        engine.close            the player left, the game can be let go of
+    one message is handled at a time, so a match is never played on by two
+    moves at once, and the computer's search runs in aiPool's processes,
+    the move that it finds comes back to this channel as a message of its own
+    every handler catches the RedisErrors, one that got out would take the
+    cached games and the searches that are being waited on down with it
     """
 
-    match = None
-
-    async def connect(self):
-        await self.accept()
-        # this is how we can get URL arguments
-        # in this case, I want to know whether the client is versing the
-        # computer as sente or gote
-        isSente = self.scope["url_route"]["kwargs"]["side"]
-        print(f'isSente?: {isSente}')
-        self.match, self.player = self.createMatch(isSente == "sente")
-        messageDict = {}
-        if not self.match.getPlayerWhoMustMakeTheNextMove().humanPlayer:
-            self.makeAiMove()
-        playerMoves = self.match.getMoves()
-        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.GAME_STATE_UPDATE
-        playerSide = "SENTE" if self.player.isSente() else "GOTE"
-        messageDict[MessageKeys.CLIENT_PLAYER_SIDE] = playerSide
-        messageDict[MessageKeys.MATCH] = self.match.serializeBoardState()
-        messageDict[MessageKeys.MOVES] = self.match.serializeMoves(playerMoves)
-        await self.send(text_data=json.dumps(messageDict))
-
-    def createMatch(self, clientIsSente: bool) -> Tuple[Match, HumanPlayer]:
-        if clientIsSente:
-            # sente human player
-            humanPlayer = HumanPlayer(True)
-            # gote computer player
-            computerPlayer = ComputerPlayer(False)
+    cache: Optional[MatchCache] = None
+    # the games that the computer is searching a move for, and the version
+    # of the game that the search is of
+    searching: Optional[Dict[str, int]] = None
+
+    def getCache(self) -> MatchCache:
+        if self.cache is None:
+            self.cache = MatchCache(gameStore.getRedis(), ENGINE_HOT_GAMES)
+            self.searching = {}
+        return self.cache
+
+    # the stats of this worker's search pool, for /ai/stats, the channel
+    # that the worker was started on is the shard
+    def publishStats(self):
+        try:
+            publishStats(self.getCache().conn, self.scope["channel"])
+        except RedisError as e:
+            print(f'could not publish the ai stats:{e}')
+
+    def reply(self, replyChannel: Optional[str], gameCode: str, event: dict):
+        if replyChannel is None:
+            async_to_sync(self.channel_layer.group_send)(gameCode, event)
         else:
-            # gote human player
-            humanPlayer = HumanPlayer(False)
-            # sente computer player
-            computerPlayer = ComputerPlayer(True)
-        match = Match(
-            computerPlayer,
-            humanPlayer
-        )
-        return (match, humanPlayer)
-
-    async def disconnect(self, close_code):
-        pass
-
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        messageType = text_data_json[MessageKeys.MESSAGE_TYPE]
-        print((messageType, text_data_json))
-        if messageType == MessageTypes.MAKE_MOVE:
-            moveToPost = text_data_json[MessageKeys.MOVE]
-            print(f'need to post move to game:{moveToPost}')
-            try:
-                self.match.doTurn(moveToPost)
-                print(f'did move:{moveToPost}')
-                nextMoveIsComputer = not self.match.getPlayerWhoMustMakeTheNextMove().humanPlayer
-                print(f'is next player the computer{nextMoveIsComputer}')
-
-                computerHasLost = False
-                if nextMoveIsComputer:
-                    computerHasLost = self.makeAiMove()
-
-                closeConnection = False
-
-                messageDict = {}
-                if computerHasLost:
-                    messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.YOU_WIN
-                    messageDict[MessageKeys.MATCH] = self.match.serializeBoardState()
-                    closeConnection = True
-                else:
-                    playerMoves = self.match.getMoves()
-                    playerMovesSerialized = self.match.serializeMoves(playerMoves)
-                    # you lose
-                    if len(playerMoves) == 0:
-                        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.YOU_LOSE
-                        messageDict[MessageKeys.MATCH] = self.match.serializeBoardState()
-                        closeConnection = True
-                    else:
-                        # print(f'playerMoves:{playerMoves}');
-                        messageDict[MessageKeys.MESSAGE_TYPE] = \
-                            MessageTypes.GAME_STATE_UPDATE
-                        messageDict[MessageKeys.MATCH] = \
-                            self.match.serializeBoardState()
-                        messageDict[MessageKeys.MOVES] = \
-                            playerMovesSerialized
-                await self.send(text_data=json.dumps(messageDict))
-                if closeConnection:
-                    await self.close()
-
-            except MoveNotFound as e:
-                print("error on server receive handler for MAKE_MOVE", e)
-                errorDict = {}
-                errorDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.ERROR
-                errorDict[MessageKeys.ERROR_MESSAGE] = \
-                    f'move:{moveToPost} is not valid'
-                await self.send(text_data=json.dumps(errorDict))
+            async_to_sync(self.channel_layer.send)(replyChannel, event)
+
+    def engine_open(self, event):
+        gameCode = event['game']
+        try:
+            game = self.getCache().get(gameCode)
+        except (GameNotFound, RedisError) as e:
+            # the client can ask for the game again with a RESYNC
+            print(f'engine could not open the game:{e}')
+            return
+        queries = event.get('queries')
+        if queries is not None:
+            # the player's consumer stored it in redis too, but the cached
+            # game may have been loaded before it connected
+            field = gameStore.moveQueryField(event['player'])
+            if queries:
+                game.info[field] = 1
+            else:
+                game.info.pop(field, None)
+        self.publishState(gameCode, game, event.get('reply'))
+        self.startComputerMove(gameCode, game)
+
+    def engine_move(self, event):
+        gameCode = event['game']
+        move = event['move']
+        cache = self.getCache()
+        try:
+            game = cache.get(gameCode)
+            difficulty = event.get('difficulty')
+            if difficulty and difficulty != game.info.get(gameStore.DIFFICULTY_FIELD):
+                gameStore.setDifficulty(cache.conn, gameCode, difficulty)
+                game.info[gameStore.DIFFICULTY_FIELD] = difficulty
+            isSente = gameStore.playerSide(game.info, event['player'])
+            if isSente is None or game.info.get(gameStore.WINNER_FIELD):
+                raise NotYourTurn(gameCode)
+            game = cache.play(gameCode, move, isSente, event.get('version'))
+        except (GameNotFound, MoveNotFound, NotYourTurn, StaleGameVersion) as e:
+            print("error on engine handler for engine.move", e)
+            # only the player who sent the move is told that it was invalid
+            self.reply(event['reply'], gameCode, {'type': 'move.error', 'move': move})
+            return
+        except RedisError as e:
+            print("error on engine handler for engine.move", e)
+            self.reply(event['reply'], gameCode, {
+                'type': 'move.error',
+                'move': move,
+                'message': f'move:{move} could not be played, try it again',
+            })
+            return
+        self.publishState(gameCode, game)
+        self.startComputerMove(gameCode, game)
+
+    # the moves of one piece, from the match's cache of the position, only the
+    # player who is to move gets any
+    def engine_query(self, event):
+        gameCode = event['game']
+        square = event.get('square')
+        piece = event.get('piece')
+        try:
+            game = self.getCache().get(gameCode)
+        except (GameNotFound, RedisError) as e:
+            print(f'engine could not query the game:{e}')
+            return
+        match = game.match
+        isSente = gameStore.playerSide(game.info, event['player'])
+        if isSente is None or game.info.get(gameStore.WINNER_FIELD) or \
+                match.getPlayerWhoMustMakeTheNextMove().isSente() != isSente:
+            moves = []
+        elif square is not None:
+            moves = match.getMovesForSquare(square)
         else:
-            print(f'unknown message type:{messageType}')
-
-    # returns False if play continues, or True if the computer has lost
-    def makeAiMove(self) -> bool:
-        moves = self.match.getMoves()
-        if len(moves) == 1:
-            print(moves[0].serialize())
-        print(f'computer has {len(moves)} moves')
-        if len(moves) == 0:
-            return True
-        stringMoves = self.match.serializeMoves(moves)
-        randomMoveIndex = random.randrange(0, len(stringMoves), 1)
-        moveToPost = stringMoves[randomMoveIndex]
-        self.match.doTurn(moveToPost)
-        return False
+            moves = match.getDropsForPiece(piece)
+        self.reply(event['reply'], gameCode, {
+            'type': 'moves.query',
+            'square': square,
+            'piece': piece,
+            'moves': moves,
+            'version': game.version,
+        })
+
+    def engine_computer_move(self, event):
+        gameCode = event['game']
+        version = event['version']
+        cache = self.getCache()
+        if self.searching.get(gameCode) != version:
+            # the game moved on (or was closed) while the computer was
+            # thinking, or the search came back after the fallback was played
+            return
+        del self.searching[gameCode]
+        self.publishStats()
+        move = event['move']
+        try:
+            game = cache.get(gameCode)
+            if move is None:
+                print('ai search failed, falling back to a small search')
+                result = search(game.match, max_nodes=AI_FALLBACK_NODES, tt=TranspositionTable(1))
+                move = result.moveString()
+            computerIsSente = gameStore.playerSide(game.info, gameStore.COMPUTER_PLAYER)
+            game = cache.play(gameCode, move, computerIsSente, version)
+        except (GameNotFound, MoveNotFound, NotYourTurn, StaleGameVersion) as e:
+            print("error on engine handler for engine.computer.move", e)
+            return
+        except RedisError as e:
+            print("error on engine handler for engine.computer.move", e)
+            retries = event.get('retries', 0)
+            if retries < COMPUTER_MOVE_RETRIES:
+                # the move that was found is played again once redis is back
+                self.searching[gameCode] = version
+                timer = threading.Timer(COMPUTER_MOVE_RETRY_MS / 1000, self.postComputerMove,
+                    (gameCode, version, move, retries + 1))
+                timer.daemon = True
+                timer.start()
+            else:
+                # the player can RESYNC, which starts the computer thinking again
+                self.reply(None, gameCode, {
+                    'type': 'move.error',
+                    'move': move,
+                    'message': 'the computer could not play its move',
+                })
+            return
+        self.publishState(gameCode, game)
+
+    def engine_close(self, event):
+        gameCode = event['game']
+        cache = self.getCache()
+        self.searching.pop(gameCode, None)
+        try:
+            game = cache.get(gameCode)
+            cache.evict(gameCode)
+            # nobody can come back to a game against the computer, its code
+            # only ever lived in the consumer that left
+            if gameStore.playerSide(game.info, gameStore.COMPUTER_PLAYER) is not None:
+                gameStore.deleteGame(cache.conn, gameCode)
+        except GameNotFound:
+            return
+        except RedisError as e:
+            # the game expires on its own, see gameStore.GAME_TTL_SECONDS
+            print(f'engine could not close the game:{e}')
+            cache.evict(gameCode)
+
+    # tells the players about the game after a move, or only replyChannel
+    def publishState(self, gameCode: str, game: HotGame, replyChannel: Optional[str] = None):
+        match = game.match
+        matchState = match.serializeBoardState()
+        winner = game.info.get(gameStore.WINNER_FIELD)
+        if winner:
+            self.reply(replyChannel, gameCode, {'type': 'game.over', 'winner': winner, 'match': matchState})
+            return
+        nextPlayerIsSente = match.getPlayerWhoMustMakeTheNextMove().isSente()
+        nextPlayer = game.info["sente"] if nextPlayerIsSente else game.info["gote"]
+        if nextPlayer == gameStore.COMPUTER_PLAYER or gameStore.queriesMoves(game.info, nextPlayer):
+            # nobody would read the list, the search and the queries find
+            # the moves that they need, it is enough to know there is one
+            moves = None
+            hasMoves = match.hasMoves()
+        else:
+            moves = match.serializeMoves(match.getMoves())
+            hasMoves = len(moves) > 0
+        if not hasMoves:
+            # the player who is to move has no moves and lost
+            winner = game.info["gote"] if nextPlayerIsSente else game.info["sente"]
+            try:
+                gameStore.setWinner(self.cache.conn, gameCode, winner)
+            except RedisError as e:
+                # the players are still told, and a game that is loaded again
+                # finds that nobody has a move the same way
+                print(f'engine could not store the winner:{e}')
+            game.info[gameStore.WINNER_FIELD] = winner
+            self.reply(replyChannel, gameCode, {
+                'type': 'game.over',
+                'reason': 'player has no moves',
+                'winner': winner,
+                'match': matchState,
+            })
+            return
+        self.reply(replyChannel, gameCode, {
+            'type': 'game.update',
+            'matchState': matchState,
+            'moves': moves,
+            'nextPlayer': nextPlayerIsSente,
+            'version': game.version,
+            'lastMove': game.lastMove,
+        })
+
+    # starts the computer thinking if it is its turn, the move comes back
+    # as an engine.computer.move
+    def startComputerMove(self, gameCode: str, game: HotGame):
+        computerIsSente = gameStore.playerSide(game.info, gameStore.COMPUTER_PLAYER)
+        match = game.match
+        if computerIsSente is None or match.getPlayerWhoMustMakeTheNextMove().isSente() != computerIsSente:
+            return
+        if game.info.get(gameStore.WINNER_FIELD) or self.searching.get(gameCode) == game.version:
+            return
+        self.searching[gameCode] = game.version
+        # book moves are looked up in a memory mapped file, which is quick
+        # enough to do right here
+        book = getBook()
+        bookMove = book.chooseMove(match) if book else None
+        if bookMove is not None:
+            print(f'computer played book move:{bookMove}')
+            self.engine_computer_move({'game': gameCode, 'version': game.version, 'move': bookMove})
+            return
+        print(f'ai queue depth:{queueDepth()}')
+        try:
+            # the search runs in another process, which only needs the position
+            future = submitSearch(match.serializeBoardState(), game.info.get(gameStore.DIFFICULTY_FIELD))
+        except RuntimeError as e:
+            # BrokenProcessPool, or a pool that is shutting down
+            print(f'ai search failed to start:{type(e).__name__}')
+            self.engine_computer_move({'game': gameCode, 'version': game.version, 'move': None})
+            return
+        # if the search doesn't come back in time the computer plays the
+        # fallback, whichever of them comes back second is stale and dropped
+        timer = threading.Timer(AI_TIMEOUT_MS / 1000, self.postComputerMove, (gameCode, game.version, None))
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(partial(self.searchDone, gameCode, game.version, timer))
+        self.publishStats()
+
+    # on the executor's thread, the move is handed back to the worker
+    # rather than played here
+    def searchDone(self, gameCode: str, version: int, timer: threading.Timer, future: Future):
+        timer.cancel()
+        try:
+            result = future.result()
+            print(f'computer searched {result}')
+            move = result.moveString()
+        except Exception as e:
+            print(f'ai search failed:{type(e).__name__}')
+            move = None
+        self.postComputerMove(gameCode, version, move)
+
+    def postComputerMove(self, gameCode: str, version: int, move: Optional[str], retries: int = 0):
+        async_to_sync(self.channel_layer.send)(self.channel_name, {
+            'type': 'engine.computer.move',
+            'game': gameCode,
+            'version': version,
+            'move': move,
+            'retries': retries,
+        })
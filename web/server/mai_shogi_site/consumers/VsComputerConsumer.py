@@ -1,17 +1,12 @@
-import random
 import json
-from typing import List, Tuple
 from channels.generic.websocket import AsyncWebsocketConsumer
 
-from enum import Enum
-
 from ..consts import MessageKeys, MessageTypes
 
-from ..game import Match
-from ..game import ComputerPlayer
-from ..game import HumanPlayer
-from ..game import MoveNotFound
-from ..game import Move
+from .. import gameStore
+from ..engineShards import engineChannel
+from ..protocol import PROTOCOL_FULL, queryMessage, requestedMoveQueries, requestedProtocol, stateMessage
+from ..views import makeRandomCode
 
 
 class VsComputerConsumer(AsyncWebsocketConsumer):
@@ -19,117 +14,125 @@ class VsComputerConsumer(AsyncWebsocketConsumer):
     taking care to not have race conditions
     when accessing things like Django models
     https://channels.readthedocs.io/en/stable/tutorial/part_2.html
+    the game is kept in redis under a code of its own and played by an
+    engine worker (see GameEngineConsumer), which also does the computer's
+    thinking, this consumer only passes moves on to it and what it sends
+    back on to the client
     """
 
-    match = None
+    redisConn = None
+    playerCode = None
+    gameCode = None
+    isSente = False
+    # one of aiPool.DIFFICULTIES, None plays at the default difficulty
+    difficulty = None
+    # the difficulty can be sent with the first message instead of the URL
+    firstMessage = True
+    # the version of the game that was last sent to the client
+    version = None
+    # how the game's state is sent, see protocol.py
+    protocol = PROTOCOL_FULL
+    # whether the client asks for the moves one piece at a time
+    queries = False
 
     async def connect(self):
         await self.accept()
+        self.protocol = requestedProtocol(self.scope)
+        self.queries = requestedMoveQueries(self.scope)
         # this is how we can get URL arguments
         # in this case, I want to know whether the client is versing the
         # computer as sente or gote
-        isSente = self.scope["url_route"]["kwargs"]["side"]
-        print(f'isSente?: {isSente}')
-        self.match, self.player = self.createMatch(isSente == "sente")
-        messageDict = {}
-        if not self.match.getPlayerWhoMustMakeTheNextMove().humanPlayer:
-            self.makeAiMove()
-        playerMoves = self.match.getMoves()
-        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.GAME_STATE_UPDATE
-        playerSide = "SENTE" if self.player.isSente() else "GOTE"
-        messageDict[MessageKeys.CLIENT_PLAYER_SIDE] = playerSide
-        messageDict[MessageKeys.MATCH] = self.match.serializeBoardState()
-        messageDict[MessageKeys.MOVES] = self.serializeMoves(playerMoves)
-        await self.send(text_data=json.dumps(messageDict))
-
-    def createMatch(self, clientIsSente: bool) -> Tuple[Match, HumanPlayer]:
-        if clientIsSente:
-            # sente human player
-            humanPlayer = HumanPlayer(True)
-            # gote computer player
-            computerPlayer = ComputerPlayer(False)
-        else:
-            # gote human player
-            humanPlayer = HumanPlayer(False)
-            # sente computer player
-            computerPlayer = ComputerPlayer(True)
-        match = Match(
-            computerPlayer,
-            humanPlayer
-        )
-        return (match, humanPlayer)
+        side = self.scope["url_route"]["kwargs"]["side"]
+        print(f'isSente?: {side}')
+        self.isSente = side == "sente"
+        self.difficulty = self.scope["url_route"]["kwargs"].get("difficulty")
+        self.playerCode = makeRandomCode()
+        self.gameCode = f'computer_{self.playerCode}'
+        self.redisConn = gameStore.getAsyncRedis()
+        await gameStore.createComputerGame(
+            self.redisConn, self.gameCode, self.playerCode, self.isSente, self.difficulty, self.queries)
+        await self.channel_layer.group_add(self.gameCode, self.channel_name)
+        # when the computer is sente, the engine plays its first move too
+        await self.sendToEngine({'type': 'engine.open', 'reply': self.channel_name, 'queries': self.queries})
+
+    # the game is played by the engine worker that its code hashes to
+    async def sendToEngine(self, message: dict):
+        await self.channel_layer.send(engineChannel(self.gameCode), {
+            'game': self.gameCode,
+            'player': self.playerCode,
+            **message,
+        })
 
     async def disconnect(self, close_code):
-        pass
+        if self.gameCode:
+            await self.channel_layer.group_discard(self.gameCode, self.channel_name)
+            await self.sendToEngine({'type': 'engine.close'})
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         messageType = text_data_json[MessageKeys.MESSAGE_TYPE]
         print((messageType, text_data_json))
+        if self.firstMessage:
+            self.firstMessage = False
+            if self.difficulty is None:
+                self.difficulty = text_data_json.get(MessageKeys.DIFFICULTY)
+            print(f'difficulty:{self.difficulty}')
         if messageType == MessageTypes.MAKE_MOVE:
             moveToPost = text_data_json[MessageKeys.MOVE]
             print(f'need to post move to game:{moveToPost}')
-            try:
-                self.match.doTurn(moveToPost)
-                print(f'did move:{moveToPost}')
-                nextMoveIsComputer = not self.match.getPlayerWhoMustMakeTheNextMove().humanPlayer
-                print(f'is next player the computer{nextMoveIsComputer}')
-
-                computerHasLost = False
-                if nextMoveIsComputer:
-                    computerHasLost = self.makeAiMove()
-
-                closeConnection = False
-                print(f'computerHasLost:{computerHasLost}')
-
-                messageDict = {}
-                if computerHasLost:
-                    messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.YOU_WIN
-                    messageDict[MessageKeys.MATCH] = self.match.serializeBoardState()
-                    closeConnection = True
-                else:
-                    playerMoves = self.match.getMoves()
-                    print(f'player has:{len(playerMoves)} moves')
-                    playerMovesSerialized = self.serializeMoves(playerMoves)
-                    # you lose
-                    if len(playerMoves) == 0:
-                        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.YOU_LOSE
-                        messageDict[MessageKeys.MATCH] = self.match.serializeBoardState()
-                        closeConnection = True
-                    else:
-                        # print(f'playerMoves:{playerMoves}');
-                        messageDict[MessageKeys.MESSAGE_TYPE] = \
-                            MessageTypes.GAME_STATE_UPDATE
-                        messageDict[MessageKeys.MATCH] = \
-                            self.match.serializeBoardState()
-                        messageDict[MessageKeys.MOVES] = \
-                            playerMovesSerialized
-                await self.send(text_data=json.dumps(messageDict))
-
-                if closeConnection:
-                    await self.close()
-
-            except MoveNotFound as e:
-                print("error on server receive handler for MAKE_MOVE", e)
-                errorDict = {}
-                errorDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.ERROR
-                errorDict[MessageKeys.ERROR_MESSAGE] = \
-                    f'move:{moveToPost} is not valid'
-                await self.send(text_data=json.dumps(errorDict))
+            await self.sendToEngine({
+                'type': 'engine.move',
+                'move': moveToPost,
+                'version': self.version,
+                # sent with every move, whatever the first message was, the
+                # engine only stores it when it changes
+                'difficulty': self.difficulty,
+                'reply': self.channel_name,
+            })
+        elif messageType == MessageTypes.RESYNC:
+            # the client's board went wrong, it gets the whole game again
+            self.version = None
+            await self.sendToEngine({'type': 'engine.open', 'reply': self.channel_name, 'queries': self.queries})
+        elif messageType == MessageTypes.GET_MOVES_FOR_SQUARE:
+            await self.sendToEngine({
+                'type': 'engine.query',
+                'square': str(text_data_json[MessageKeys.SQUARE]),
+                'reply': self.channel_name,
+            })
+        elif messageType == MessageTypes.GET_DROPS_FOR_PIECE:
+            await self.sendToEngine({
+                'type': 'engine.query',
+                'piece': str(text_data_json[MessageKeys.PIECE]),
+                'reply': self.channel_name,
+            })
         else:
             print(f'unknown message type:{messageType}')
 
-    def serializeMoves(self, moves: List[Move]) -> List[str]:
-        return list(map(lambda x: x.serialize(), moves))
+    # the game after the client's move, and again after the computer's
+    async def game_update(self, event):
+        messageDict = stateMessage(event, self.isSente, self.version, self.protocol)
+        self.version = event['version']
+        await self.send(text_data=json.dumps(messageDict))
+
+    # the answer to a GET_MOVES_FOR_SQUARE or a GET_DROPS_FOR_PIECE
+    async def moves_query(self, event):
+        await self.send(text_data=json.dumps(queryMessage(event, self.protocol)))
 
-    # returns False if play continues, or True if the computer has lost
-    def makeAiMove(self) -> bool:
-        moves = self.match.getMoves()
-        print(f'computer has {len(moves)} moves')
-        if len(moves) == 0:
-            return True
-        stringMoves = self.serializeMoves(moves)
-        randomMoveIndex = random.randrange(0, len(stringMoves), 1)
-        moveToPost = stringMoves[randomMoveIndex]
-        self.match.doTurn(moveToPost)
-        return False
+    async def game_over(self, event):
+        messageDict = {}
+        if event['winner'] == self.playerCode:
+            messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.YOU_WIN
+        else:
+            messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.YOU_LOSE
+        messageDict[MessageKeys.MATCH] = event['match']
+        await self.send(text_data=json.dumps(messageDict))
+        await self.close()
+
+    async def move_error(self, event):
+        print(f'error on server receive handler for MAKE_MOVE:{event["move"]}')
+        errorDict = {}
+        errorDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.ERROR
+        # the engine says why when it isn't that the move was invalid
+        errorDict[MessageKeys.ERROR_MESSAGE] = \
+            event.get('message', f'move:{event["move"]} is not valid')
+        await self.send(text_data=json.dumps(errorDict))
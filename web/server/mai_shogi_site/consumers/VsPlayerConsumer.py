@@ -1,13 +1,11 @@
-import redis
 from channels.generic.websocket import AsyncWebsocketConsumer
-from os import environ
 import json
 from pprint import pprint
 
-from typing import List, Tuple
-
-from ..game import Match, HumanPlayer, MoveNotFound
 from ..consts import MessageKeys, MessageTypes
+from .. import gameStore
+from ..engineShards import engineChannel
+from ..protocol import PROTOCOL_FULL, queryMessage, requestedMoveQueries, requestedProtocol, stateMessage
 
 
 class VsPlayerConsumer(AsyncWebsocketConsumer):
@@ -15,16 +13,28 @@ class VsPlayerConsumer(AsyncWebsocketConsumer):
     taking care to not have race conditions
     when accessing things like Django models
     https://channels.readthedocs.io/en/stable/tutorial/part_2.html
+    the game itself is kept in redis (see gameStore) and played by an
+    engine worker (see GameEngineConsumer), both players' consumers only
+    pass their player's moves on to it and what it tells the group back,
+    and a player whose socket dropped picks the game up again from any process
     """
-    match = None
+    redisConn = None
     playerCode = None
-    otherPlayerCode = None
     isPlayerOne = False
     isSente = False
     gameGroupName = None
+    # the version of the game that was last sent to this player, their
+    # next move is played against it
+    version = None
+    # how the game's state is sent, see protocol.py
+    protocol = PROTOCOL_FULL
+    # whether the client asks for the moves one piece at a time
+    queries = False
 
     async def connect(self):
         await self.accept()
+        self.protocol = requestedProtocol(self.scope)
+        self.queries = requestedMoveQueries(self.scope)
         # this is how we can get URL arguments
         # in this case, I want to know whether the client is versing the
         # computer as sente or gote
@@ -32,80 +42,56 @@ class VsPlayerConsumer(AsyncWebsocketConsumer):
         self.playerCode = playerCode
         print(f'playerCode: {playerCode}')
         print(f'channel name: {self.channel_name}')
-        redisHost = environ.get('REDIS_HOST')
-        redisPort = environ.get('REDIS_PORT')
-        redisConn = redis.Redis(
-            host=redisHost,
-            port=redisPort,
-            # decode_responses will turn the bytes from redis into strings
-            # so instead of { b'x': b'y' }, I will get { 'x': 'y' }
-            decode_responses=True,
-        )
-        groupName = redisConn.get(playerCode)
+        # the event loop carries on with the other sockets while redis answers
+        self.redisConn = gameStore.getAsyncRedis()
+        groupName = await self.redisConn.get(playerCode)
+        if groupName is None:
+            # a code that was never handed out, or whose game expired
+            print(f'no game for playerCode:{playerCode}')
+            await self.close()
+            return
         self.gameGroupName = groupName
 
         await self.channel_layer.group_add(groupName, self.channel_name)
 
-        gameInfo = redisConn.hgetall(groupName)
+        gameInfo = await gameStore.gameInfoAsync(self.redisConn, groupName)
         playerOneCode = gameInfo['playerOne']
         sentePlayerCode = gameInfo['sente']
 
         print(f'group name: {groupName}')
         print(f'sentePlayerCode:{sentePlayerCode} my code:{playerCode}')
-        isPlayerOne = playerCode == playerOneCode
-        self.isPlayerOne = isPlayerOne
-        # when the winner is determined, the consumer that holds the
-        # game info will need to know their opponent's code in order to
-        # declare the winner
-        if self.isPlayerOne:
-            self.otherPlayerCode = gameInfo['playerTwo']
-        # player one's consumer will hold the game object
-        # but we need to wait & listen for the message signaling that
-        # player two connected, so that we can send them the information
-        isSente = playerCode == playerOneCode
-        self.isSente = isSente
-        if isPlayerOne:
-            me = HumanPlayer(isSente)
-            opponent = HumanPlayer(not isSente)
+        self.isPlayerOne = playerCode == playerOneCode
+        self.isSente = playerCode == sentePlayerCode
 
-            self.match = Match(p1=me, p2=opponent)
-        else:
+        (added, playerCount) = await gameStore.addPlayer(self.redisConn, gameInfo, groupName, playerCode, self.queries)
+        # wait for the other player, their consumer starts the game
+        if playerCount < 2:
+            return
+        if added:
+            # the second player just connected, the game starts for both of
+            # them, and the engine sends them both the position
             await self.channel_layer.group_send(
                 groupName,
                 {
-                    'type': 'player.connect',
-                    'sender': playerCode
+                    'type': 'game.start',
+                    'sender': playerCode,
                 }
             )
-
-    # group handler
-    async def player_connect(self, event):
-        sender = event['sender']
-        if sender == self.playerCode:
-            return
-        print(f'other player connected:{sender}')
-        print(f'am I player one?{self.isPlayerOne}')
-        if not self.isPlayerOne:
+            await self.sendToEngine({'type': 'engine.open', 'reply': None, 'queries': self.queries})
             return
 
-        (matchState, moves, nextMovePlayer) = self.getGroupGameUpdateState()
-        await self.channel_layer.group_send(
-            self.gameGroupName,
-            {
-                'type': 'game.start',
-                'sender': self.playerCode,
-            }
-        )
-        await self.channel_layer.group_send(
-            self.gameGroupName,
-            {
-                'type': 'game.update',
-                'sender': self.playerCode,
-                'matchState': matchState,
-                'moves': moves,
-                'nextPlayer': nextMovePlayer,
-            }
-        )
+        # a player coming back after their socket dropped, or after the
+        # process that it was on restarted, carries on from the stored game
+        await self.game_start({'sender': playerCode})
+        await self.sendToEngine({'type': 'engine.open', 'reply': self.channel_name, 'queries': self.queries})
+
+    # the game is played by the engine worker that its code hashes to
+    async def sendToEngine(self, message: dict):
+        await self.channel_layer.send(engineChannel(self.gameGroupName), {
+            'game': self.gameGroupName,
+            'player': self.playerCode,
+            **message,
+        })
 
     async def game_start(self, event):
         sender = event['sender']
@@ -118,82 +104,24 @@ class VsPlayerConsumer(AsyncWebsocketConsumer):
 
 
 
-    def getGroupGameUpdateState(self) -> Tuple[str, List[str], bool]:
-        matchState = self.match.serializeBoardState()
-        playerMoves = self.match.getMoves()
-        moves = self.match.serializeMoves(playerMoves)
-        nextMovePlayerIsSente = self.match.getPlayerWhoMustMakeTheNextMove().isSente()
-        return (matchState, moves, nextMovePlayerIsSente)
-
-
     # group handler
     async def game_update(self, event):
-        nextPlayer = event['nextPlayer']
-
-        messageDict = {}
-        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.GAME_STATE_UPDATE
-        messageDict[MessageKeys.MATCH] = event['matchState']
-        messageDict[MessageKeys.CLIENT_PLAYER_SIDE] = "SENTE" if self.isSente else "GOTE"
-        # if it is our turn, we need to also send the moves to the
-        # game client
-        # print(f'nextPlayer:{nextPlayer} amISente?:{self.isSente}')
-        if nextPlayer == self.isSente:
-            messageDict[MessageKeys.MOVES] = event['moves']
-            # print('sending moves')
-            # pprint(event['moves'])
-
+        messageDict = stateMessage(event, self.isSente, self.version, self.protocol)
+        self.version = event['version']
         await self.send(text_data=json.dumps(messageDict))
 
-    async def make_move(self, event):
-        if self.isPlayerOne:
-            move = event['move']
-            try:
-                # do the sender's move
-                self.match.doTurn(move)
-                (matchState, serializedMoves, nextMovePlayerIsSente) = self.getGroupGameUpdateState()
-                # if the next player is sente and I am sente, then my opponent made the previous move
-                wasMyTurn = nextMovePlayerIsSente != self.isSente
-                #print(f'isSente:{self.isSente} wasMyTurn:{wasMyTurn} #moves:{len(serializedMoves)}')
-                if len(serializedMoves) == 0:
-                    # broadcast a 'player lost' event
-                    # print(f'TODO player {self.playerCode} has no moves, and lost')
-                    # print(f'isSente:{self.isSente} selfCode:{self.playerCode} other code:{self.otherPlayerCode}')
-                    await self.channel_layer.group_send(
-                        self.gameGroupName,
-                        {
-                            'type': 'game.over',
-                            'sender': self.playerCode,
-                            'reason': 'player has no moves',
-                            # if it's my turn and there are no moves, I lose
-                            # if it's my opponent's turn and there are no moves, I win
-                            'winner': self.playerCode if wasMyTurn else self.otherPlayerCode,
-                            'match': matchState
-                        }
-                    )
-                else:
-                    await self.channel_layer.group_send(
-                        self.gameGroupName,
-                        {
-                            'type': 'game.update',
-                            'sender': self.playerCode,
-                            'matchState': matchState,
-                            'moves': serializedMoves,
-                            'nextPlayer': nextMovePlayerIsSente,
-                        }
-                    )
+    # the engine turned the move down, only this player is told
+    async def move_error(self, event):
+        errorDict = {}
+        errorDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.ERROR
+        # the engine says why when it isn't that the move was invalid
+        errorDict[MessageKeys.ERROR_MESSAGE] = event.get('message', f'move:{event["move"]} is not valid')
+        await self.send(text_data=json.dumps(errorDict))
 
-            except MoveNotFound as e:
-                print("error on server receive handler for MAKE_MOVE", e)
-                # inform the client that sent the move that their move
-                # was invalid
-                await self.channel_layer.group_send(
-                    self.gameGroupName,
-                    {
-                        'type': 'invalid.state',
-                        'originalSender': event['sender'],
-                        'sender': self.playerCode
-                    }
-                )
+    # the answer to a GET_MOVES_FOR_SQUARE or a GET_DROPS_FOR_PIECE, only
+    # this player is sent it
+    async def moves_query(self, event):
+        await self.send(text_data=json.dumps(queryMessage(event, self.protocol)))
 
     async def game_over(self, event):
         winnerPlayer = event['winner']
@@ -208,17 +136,6 @@ class VsPlayerConsumer(AsyncWebsocketConsumer):
         eventDict[MessageKeys.MATCH] = event['match']
         await self.send(text_data=json.dumps(eventDict))
 
-    # TODO this code hasn't been tested at all
-    async def invalidState(self, event):
-        originalSenderCode = event['originalSender']
-        # move was invalid
-        if originalSenderCode == self.playerCode:
-            errorDict = {}
-            errorDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.ERROR
-            errorDict[MessageKeys.ERROR_MESSAGE] = \
-                f'move:{moveToPost} is not valid'
-            await self.send(text_data=json.dumps(errorDict))
-
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         print(text_data_json)
@@ -226,31 +143,29 @@ class VsPlayerConsumer(AsyncWebsocketConsumer):
         print(messageType, text_data_json)
 
         if messageType == MessageTypes.MAKE_MOVE:
-            move = text_data_json[MessageKeys.MOVE]
-            await self.channel_layer.group_send(
-                self.gameGroupName,
-                {
-                    'type': 'make.move',
-                    'sender': self.playerCode,
-                    'move': move,
-                }
-            )
+            await self.sendToEngine({
+                'type': 'engine.move',
+                'move': text_data_json[MessageKeys.MOVE],
+                'version': self.version,
+                'reply': self.channel_name,
+            })
+        elif messageType == MessageTypes.RESYNC:
+            # the client's board went wrong, it gets the whole game again
+            self.version = None
+            await self.sendToEngine({'type': 'engine.open', 'reply': self.channel_name, 'queries': self.queries})
+        elif messageType == MessageTypes.GET_MOVES_FOR_SQUARE:
+            await self.sendToEngine({
+                'type': 'engine.query',
+                'square': str(text_data_json[MessageKeys.SQUARE]),
+                'reply': self.channel_name,
+            })
+        elif messageType == MessageTypes.GET_DROPS_FOR_PIECE:
+            await self.sendToEngine({
+                'type': 'engine.query',
+                'piece': str(text_data_json[MessageKeys.PIECE]),
+                'reply': self.channel_name,
+            })
 
     async def disconnect(self, close_code):
-        pass
-
-# # TODO this is hacky, I need to find a better way to pre-populate
-# # the group with a consumer that maintains the game logic and state
-# isPlayerOne = groupName.split('_')[0] == playerCode
-# as a last resort I can just staple the game engine to player one's
-# websocket consumer, and have it communicate with player 2 through
-# the group but, it's probably better to have a
-# worker that listens in on groups for
-# channel join messages, and gives them a game engine consumer
-# print(f'is player one?{isPlayerOne}')
-# if isPlayerOne:
-#     newChannelName = self.channel_layer.new_channel
-#     print(f'for game consumer: {newChannelName}')
-#     self.channel_layer.group_add(groupName, newChannelName)
-#     gameConsumer = GameEngineConsumer(
-# pprint(self.channel_layer)
+        if self.gameGroupName:
+            await self.channel_layer.group_discard(self.gameGroupName, self.channel_name)
@@ -1,2 +1,3 @@
 from .VsComputerConsumer import VsComputerConsumer
 from .VsPlayerConsumer import VsPlayerConsumer
+from .GameEngineConsumer import GameEngineConsumer
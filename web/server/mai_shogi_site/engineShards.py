@@ -0,0 +1,46 @@
+import hashlib
+from bisect import bisect
+from os import environ
+from typing import List, Tuple
+
+# the games are played on engine workers (see GameEngineConsumer), which
+# are started with
+#   python manage.py runworker game-engine-0 game-engine-1 ...
+# every game belongs to one of them, picked by hashing its game code onto a
+# ring, so all of a game's moves are played by the worker that has its match
+# in memory, and changing the number of workers only moves the games that
+# land on the part of the ring that changed hands
+
+# how many engine workers there are, every one of them has to be running
+ENGINE_SHARDS = int(environ.get('SHOGI_ENGINE_SHARDS', 2))
+ENGINE_CHANNEL_PREFIX = "game-engine-"
+# how many points each worker gets on the ring, more of them spread the
+# games more evenly
+VIRTUAL_NODES = 64
+
+
+def hashKey(key: str) -> int:
+    # python's own hash is different in every process, this one isn't
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def shardChannels(shards: int = ENGINE_SHARDS) -> List[str]:
+    return [f'{ENGINE_CHANNEL_PREFIX}{shard}' for shard in range(shards)]
+
+
+def buildRing(shards: int) -> Tuple[List[int], List[str]]:
+    points = sorted(
+        (hashKey(f'{channel}#{node}'), channel)
+        for channel in shardChannels(shards)
+        for node in range(VIRTUAL_NODES)
+    )
+    return [point for (point, _) in points], [channel for (_, channel) in points]
+
+
+(ringPoints, ringChannels) = buildRing(ENGINE_SHARDS)
+
+
+# the channel of the engine worker that plays the game
+def engineChannel(gameCode: str) -> str:
+    index = bisect(ringPoints, hashKey(gameCode)) % len(ringPoints)
+    return ringChannels[index]
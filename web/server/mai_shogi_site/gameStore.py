@@ -0,0 +1,364 @@
+from collections import OrderedDict
+from os import environ
+from typing import List, Optional, Sequence, Tuple
+
+from redis import BlockingConnectionPool, Redis
+from redis.asyncio import BlockingConnectionPool as AsyncBlockingConnectionPool
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import RedisError, WatchError
+
+from .game import BitboardMatch, HumanPlayer, Match
+
+# the state of every game between two players lives in redis, not in the
+# memory of a consumer, so any consumer on any daphne process can pick a
+# game up, and a game outlives the socket or the process that started it
+#
+# under the game code (see createGame)
+#   <gameCode>          a hash with the players' codes, and
+#       sfen            the position after the last move
+#       version         how many moves have been played, it goes up by one
+#                       with every move
+#       winner          the code of the player who won, once the game is over
+#       difficulty      how strong the computer is, in a game against it
+#       queries:<code>  there for a player whose client asks for the legal
+#                       moves one piece at a time (see protocol.py), the
+#                       engine doesn't list every move on their turn
+#   <gameCode>:moves    a list of every move played, in order, never rewritten
+#   <gameCode>:players  the codes of the players who have connected
+# and under each player's code, the game code
+#
+# every key of a game expires GAME_TTL_SECONDS after the game was created,
+# a player connected or the last move was played, so the codes that were
+# handed out for a game that nobody played don't pile up
+#
+# a move is played against the version that it was read at, a move that
+# another consumer got in first is turned down instead of overwriting it
+#
+# the engine workers (see GameEngineConsumer) keep the games that are being
+# played in a MatchCache, and write every move through to here
+
+SFEN_FIELD = "sfen"
+VERSION_FIELD = "version"
+WINNER_FIELD = "winner"
+DIFFICULTY_FIELD = "difficulty"
+MOVE_QUERY_PREFIX = "queries:"
+# the player code of the computer, in a game against it
+COMPUTER_PLAYER = "computer"
+# how many times a move is tried again when another consumer changed the
+# game at the same moment, the second try sees what they did
+MOVE_RETRIES = 3
+GAME_TTL_SECONDS = int(environ.get('SHOGI_GAME_TTL_SECONDS', 24 * 60 * 60))
+# how many connections to redis each process keeps open at most, a command
+# waits for a free one rather than opening more
+REDIS_MAX_CONNECTIONS = int(environ.get('SHOGI_REDIS_MAX_CONNECTIONS', 50))
+
+# the connection pools of this process, the views and the engine workers
+# use the blocking one and the consumers the one for their event loop
+pool: Optional[BlockingConnectionPool] = None
+asyncPool: Optional[AsyncBlockingConnectionPool] = None
+
+
+class GameNotFound(Exception):
+    pass
+
+
+class StaleGameVersion(Exception):
+    pass
+
+
+class NotYourTurn(Exception):
+    pass
+
+
+def connectionOptions() -> dict:
+    return {
+        "host": environ.get('REDIS_HOST'),
+        "port": environ.get('REDIS_PORT'),
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        # decode_responses will turn the bytes from redis into strings
+        # so instead of { b'x': b'y' }, I will get { 'x': 'y' }
+        "decode_responses": True,
+    }
+
+
+# a client is cheap, it borrows a connection from the pool for every command
+def getRedis() -> Redis:
+    global pool
+    if pool is None:
+        pool = BlockingConnectionPool(**connectionOptions())
+    return Redis(connection_pool=pool)
+
+
+# a connection belongs to the event loop that opened it, daphne runs
+# every consumer of the process on the same one
+def getAsyncRedis() -> AsyncRedis:
+    global asyncPool
+    if asyncPool is None:
+        asyncPool = AsyncBlockingConnectionPool(**connectionOptions())
+    return AsyncRedis(connection_pool=asyncPool)
+
+
+def movesKey(gameCode: str) -> str:
+    return f'{gameCode}:moves'
+
+
+def playersKey(gameCode: str) -> str:
+    return f'{gameCode}:players'
+
+
+def moveQueryField(playerCode: str) -> str:
+    return f'{MOVE_QUERY_PREFIX}{playerCode}'
+
+
+# whether the player's client asks for the moves one piece at a time
+def queriesMoves(info: dict, playerCode: str) -> bool:
+    return moveQueryField(playerCode) in info
+
+
+def newMatch(sfen: Optional[str] = None) -> Match:
+    players = (HumanPlayer(True), HumanPlayer(False))
+    if sfen is None:
+        return BitboardMatch(*players)
+    return BitboardMatch.fromSfen(sfen, *players)
+
+
+# the snapshot that a new game starts from, written along with the players' codes
+def newGameFields() -> dict:
+    return {
+        SFEN_FIELD: newMatch().serializeBoardState(),
+        VERSION_FIELD: 0,
+    }
+
+
+# the game code and both player codes in one round trip, the websocket
+# connections can use their player codes to look up the game code, which
+# tells their consumers what group they are in
+def createGame(conn: Redis, gameCode: str, senteCode: str, goteCode: str, playerOneCode: str, playerTwoCode: str):
+    pipe = conn.pipeline(transaction=False)
+    pipe.set(playerOneCode, gameCode, ex=GAME_TTL_SECONDS)
+    pipe.set(playerTwoCode, gameCode, ex=GAME_TTL_SECONDS)
+    pipe.hset(gameCode, mapping={
+        "sente": senteCode,
+        "gote": goteCode,
+        "playerOne": playerOneCode,
+        "playerTwo": playerTwoCode,
+        **newGameFields(),
+    })
+    pipe.expire(gameCode, GAME_TTL_SECONDS)
+    pipe.execute()
+
+
+# a game against the computer, which the consumer makes up a code for
+async def createComputerGame(
+    conn: AsyncRedis,
+    gameCode: str,
+    playerCode: str,
+    playerIsSente: bool,
+    difficulty: Optional[str],
+    queries: bool = False,
+):
+    fields = {
+        "sente": playerCode if playerIsSente else COMPUTER_PLAYER,
+        "gote": COMPUTER_PLAYER if playerIsSente else playerCode,
+        "playerOne": playerCode,
+        "playerTwo": COMPUTER_PLAYER,
+        **newGameFields(),
+    }
+    if difficulty:
+        fields[DIFFICULTY_FIELD] = difficulty
+    if queries:
+        fields[moveQueryField(playerCode)] = 1
+    pipe = conn.pipeline(transaction=False)
+    pipe.hset(gameCode, mapping=fields)
+    pipe.expire(gameCode, GAME_TTL_SECONDS)
+    await pipe.execute()
+
+
+def gameInfo(conn: Redis, gameCode: str) -> dict:
+    info = conn.hgetall(gameCode)
+    if not info:
+        raise GameNotFound(gameCode)
+    return info
+
+
+async def gameInfoAsync(conn: AsyncRedis, gameCode: str) -> dict:
+    info = await conn.hgetall(gameCode)
+    if not info:
+        raise GameNotFound(gameCode)
+    return info
+
+
+# the keys of a game that are kept alive along with it
+def gameKeys(info: dict, gameCode: str) -> List[str]:
+    playerCodes = [info["playerOne"], info["playerTwo"]]
+    return [gameCode, movesKey(gameCode), playersKey(gameCode)] + \
+        [code for code in playerCodes if code != COMPUTER_PLAYER]
+
+
+# the match as of the last move, and how many moves that was
+def loadGame(conn: Redis, gameCode: str) -> Tuple[Match, int]:
+    info = gameInfo(conn, gameCode)
+    return newMatch(info[SFEN_FIELD]), int(info[VERSION_FIELD])
+
+
+def moveLog(conn: Redis, gameCode: str) -> List[str]:
+    return conn.lrange(movesKey(gameCode), 0, -1)
+
+
+# adds the player to the ones who have connected, and returns
+# (whether they were new, how many players have connected)
+# queries is whether their client asks for the moves one piece at a time
+async def addPlayer(conn: AsyncRedis, info: dict, gameCode: str, playerCode: str, queries: bool = False) -> Tuple[bool, int]:
+    pipe = conn.pipeline()
+    pipe.sadd(playersKey(gameCode), playerCode)
+    pipe.scard(playersKey(gameCode))
+    if queries:
+        pipe.hset(gameCode, moveQueryField(playerCode), 1)
+    else:
+        pipe.hdel(gameCode, moveQueryField(playerCode))
+    for key in gameKeys(info, gameCode):
+        pipe.expire(key, GAME_TTL_SECONDS)
+    (added, count, *_) = await pipe.execute()
+    return bool(added), count
+
+
+def setWinner(conn: Redis, gameCode: str, playerCode: str):
+    conn.hset(gameCode, WINNER_FIELD, playerCode)
+
+
+def setDifficulty(conn: Redis, gameCode: str, difficulty: str):
+    conn.hset(gameCode, DIFFICULTY_FIELD, difficulty)
+
+
+def deleteGame(conn: Redis, gameCode: str):
+    conn.delete(gameCode, movesKey(gameCode), playersKey(gameCode))
+
+
+# stores a move that was played on the game as it was at version, returns
+# False and stores nothing when the game isn't at that version anymore
+# keys are the ones that expire along with the game, see gameKeys
+def commitMove(conn: Redis, gameCode: str, move: str, sfen: str, version: int, keys: Sequence[str] = ()) -> bool:
+    with conn.pipeline() as pipe:
+        try:
+            # the transaction below fails if anyone writes to the game
+            # between here and its execute
+            pipe.watch(gameCode)
+            if int(pipe.hget(gameCode, VERSION_FIELD) or -1) != version:
+                return False
+            pipe.multi()
+            pipe.hset(gameCode, mapping={
+                SFEN_FIELD: sfen,
+                VERSION_FIELD: version + 1,
+            })
+            pipe.rpush(movesKey(gameCode), move)
+            for key in keys:
+                pipe.expire(key, GAME_TTL_SECONDS)
+            pipe.execute()
+            return True
+        except WatchError:
+            return False
+
+
+# the side that the player is on, None for someone who isn't in the game
+def playerSide(info: dict, playerCode: str) -> Optional[bool]:
+    if playerCode == info["sente"]:
+        return True
+    if playerCode == info["gote"]:
+        return False
+    return None
+
+
+class HotGame:
+    """
+    a game that an engine worker is playing, its match as of version,
+    and the hash of the game from redis
+    lastMove is the move that the worker played to get to version, None
+    for a game that was just loaded
+    """
+    match: Match
+    version: int
+    info: dict
+    lastMove: Optional[str]
+
+    def __init__(self, match: Match, version: int, info: dict):
+        self.match = match
+        self.version = version
+        self.info = info
+        self.lastMove = None
+
+
+class MatchCache:
+    """
+    the games that an engine worker played a move in most recently, so
+    that it doesn't rebuild the match from its sfen for every move
+    every move is written to redis as it is played, so a game that falls
+    out of the cache (or a worker that restarts) loses nothing, it is
+    loaded from its snapshot the next time it is needed
+    """
+    games: "OrderedDict[str, HotGame]"
+    capacity: int
+
+    def __init__(self, conn: Redis, capacity: int):
+        self.conn = conn
+        self.capacity = capacity
+        self.games = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, gameCode: str) -> HotGame:
+        game = self.games.get(gameCode)
+        if game is not None:
+            self.hits += 1
+            self.games.move_to_end(gameCode)
+            return game
+        self.misses += 1
+        info = gameInfo(self.conn, gameCode)
+        game = HotGame(newMatch(info[SFEN_FIELD]), int(info[VERSION_FIELD]), info)
+        self.games[gameCode] = game
+        while len(self.games) > self.capacity:
+            self.games.popitem(last=False)
+        return game
+
+    def evict(self, gameCode: str):
+        self.games.pop(gameCode, None)
+
+    # plays the move for the player on the given side in the cached match
+    # and writes it to redis, if another worker changed the game in the
+    # meantime the game is loaded again and the move is tried on that
+    # expectedVersion is the version that the player saw, when it is given a
+    # move made on an older position raises StaleGameVersion
+    # raises MoveNotFound for an illegal move, NotYourTurn when the other
+    # side is to move, GameNotFound, and RedisError when the move couldn't
+    # be stored
+    def play(self, gameCode: str, move: str, isSente: bool, expectedVersion: Optional[int] = None) -> HotGame:
+        for _ in range(MOVE_RETRIES):
+            cached = gameCode in self.games
+            game = self.get(gameCode)
+            if expectedVersion is not None and game.version != expectedVersion:
+                if cached:
+                    # the player may have seen a move that another worker
+                    # played, the game is loaded again to find out
+                    self.evict(gameCode)
+                    continue
+                raise StaleGameVersion(f'{gameCode} is at version {game.version}, not {expectedVersion}')
+            match = game.match
+            if match.getPlayerWhoMustMakeTheNextMove().isSente() != isSente:
+                raise NotYourTurn(gameCode)
+            # the move is checked on its own, when the legal moves weren't
+            # listed for this turn
+            match.doTurn(move)
+            sfen = match.serializeBoardState()
+            try:
+                committed = commitMove(self.conn, gameCode, move, sfen, game.version, gameKeys(game.info, gameCode))
+            except RedisError:
+                # the move is on the cached match, but may not be in redis,
+                # the game is loaded again the next time it is needed
+                self.evict(gameCode)
+                raise
+            if committed:
+                game.version += 1
+                game.lastMove = move
+                return game
+            # the cached match is behind, it is thrown away with the move on it
+            self.evict(gameCode)
+        raise StaleGameVersion(f'{gameCode} kept changing while the move was played')
@@ -0,0 +1,149 @@
+import re
+import zlib
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from .consts import MessageKeys, MessageTypes
+
+# how the game's state goes out to the client, picked when it connects,
+#   ws/game/versus/<playerCode>?protocol=delta
+# the full protocol (the default, which the web client uses) sends the whole
+# position and every legal move with every update
+#
+# the delta protocol sends a GAME_STATE_UPDATE when the client connects,
+# when it may have missed a move, and when it asks with RESYNC,
+#   match, c_p_side, ver, hash, and moves on the client's turn
+# and after that a GAME_STATE_DELTA for every move,
+#   last (the move that was just played), ver, hash, and moves on the
+#   client's turn
+# the client plays the last move on its own board, and if the position
+# that it ends up with (as serializeBoardState writes it) doesn't have the
+# same hash, it sends RESYNC
+# hash is the crc32 of that position, as 8 hex digits
+#
+# in the delta protocol the moves are grouped, the board moves by the
+# square and piece that they start from and the drops by the piece, and the
+# squares that each group goes to are written one after the other, with a
+# + after a square that the piece promotes on
+#   {"06P": "05", "71r": "2121+3141", "*P": "4546"}
+# is "06P 05P", "71r 21r", "71r 21+r", "71r 31r", "71r 41r", "45P" and "46P"
+#
+# either protocol can leave the legal moves out of the updates, for a client
+# that connects with
+#   ws/game/versus/<playerCode>?moves=query
+# and asks for the moves of one piece when its player picks it up instead,
+#   GET_MOVES_FOR_SQUARE    sq, the square as the moves write it, "76"
+#   GET_DROPS_FOR_PIECE     piece, the letter of a piece in the hand, "P"
+# which are answered with a MOVES_FOR_SQUARE or a DROPS_FOR_PIECE,
+#   sq or piece as it was asked, ver, and moves, the piece's legal moves in
+#   the position at ver, grouped as above in the delta protocol
+# the moves are only there on the client's turn, a move that it sends is
+# checked on its own by the engine, the same as with the full list
+
+PROTOCOL_FULL = "full"
+PROTOCOL_DELTA = "delta"
+MOVES_LIST = "list"
+MOVES_QUERY = "query"
+DROP_GROUP_PREFIX = "*"
+# a square in a group's targets, and whether the piece promotes there
+TARGET_PATTERN = re.compile(r"\d\d\+?")
+
+
+def requestedProtocol(scope: dict) -> str:
+    query = parse_qs(scope.get("query_string", b"").decode())
+    protocol = query.get("protocol", [PROTOCOL_FULL])[0]
+    return PROTOCOL_DELTA if protocol == PROTOCOL_DELTA else PROTOCOL_FULL
+
+
+# whether the client asks for the moves one piece at a time
+def requestedMoveQueries(scope: dict) -> bool:
+    query = parse_qs(scope.get("query_string", b"").decode())
+    return query.get("moves", [MOVES_LIST])[0] == MOVES_QUERY
+
+
+def positionHash(sfen: str) -> str:
+    return f'{zlib.crc32(sfen.encode()):08x}'
+
+
+def groupMoves(moves: List[str]) -> Dict[str, str]:
+    groups: Dict[str, List[str]] = {}
+    for move in moves:
+        (source, _, target) = move.partition(" ")
+        if target:
+            # the target's piece is the source's, unless it promotes there
+            promotes = target[2] == "+" and source[2] != "+"
+            groups.setdefault(source, []).append(target[:2] + ("+" if promotes else ""))
+        else:
+            # a drop is only its target square and piece
+            groups.setdefault(DROP_GROUP_PREFIX + source[2:], []).append(source[:2])
+    return {key: "".join(squares) for (key, squares) in groups.items()}
+
+
+def expandMoves(groups: Dict[str, str]) -> List[str]:
+    moves = []
+    for (key, squares) in groups.items():
+        targets = TARGET_PATTERN.findall(squares)
+        if key.startswith(DROP_GROUP_PREFIX):
+            piece = key[len(DROP_GROUP_PREFIX):]
+            moves.extend(square + piece for square in targets)
+            continue
+        piece = key[2:]
+        for target in targets:
+            if target.endswith("+"):
+                moves.append(f'{key} {target[:2]}+{piece}')
+            else:
+                moves.append(f'{key} {target}{piece}')
+    return moves
+
+
+# the message for a game.update from the engine, lastVersion is the version
+# that the client was last sent, None when it hasn't been sent one
+def stateMessage(event: dict, isSente: bool, lastVersion: Optional[int], protocol: str) -> dict:
+    yourTurn = event['nextPlayer'] == isSente
+    if protocol != PROTOCOL_DELTA:
+        messageDict = {}
+        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.GAME_STATE_UPDATE
+        messageDict[MessageKeys.MATCH] = event['matchState']
+        messageDict[MessageKeys.CLIENT_PLAYER_SIDE] = "SENTE" if isSente else "GOTE"
+        # the moves only go out when it is the client's turn, and aren't
+        # there at all for a client that queries them
+        if yourTurn and event['moves'] is not None:
+            messageDict[MessageKeys.MOVES] = event['moves']
+        return messageDict
+
+    version = event['version']
+    messageDict = {
+        MessageKeys.VERSION: version,
+        MessageKeys.HASH: positionHash(event['matchState']),
+    }
+    lastMove = event.get('lastMove')
+    if lastMove is not None and lastVersion is not None and version == lastVersion + 1:
+        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.GAME_STATE_DELTA
+        messageDict[MessageKeys.LAST_MOVE] = lastMove
+    else:
+        # the client missed a move, or has nothing to play it on
+        messageDict[MessageKeys.MESSAGE_TYPE] = MessageTypes.GAME_STATE_UPDATE
+        messageDict[MessageKeys.MATCH] = event['matchState']
+        messageDict[MessageKeys.CLIENT_PLAYER_SIDE] = "SENTE" if isSente else "GOTE"
+    if yourTurn and event['moves'] is not None:
+        messageDict[MessageKeys.MOVES] = groupMoves(event['moves'])
+    return messageDict
+
+
+# the message for a moves.query from the engine, the answer to a
+# GET_MOVES_FOR_SQUARE or a GET_DROPS_FOR_PIECE
+def queryMessage(event: dict, protocol: str) -> dict:
+    if event.get('square') is not None:
+        messageDict = {
+            MessageKeys.MESSAGE_TYPE: MessageTypes.MOVES_FOR_SQUARE,
+            MessageKeys.SQUARE: event['square'],
+        }
+    else:
+        messageDict = {
+            MessageKeys.MESSAGE_TYPE: MessageTypes.DROPS_FOR_PIECE,
+            MessageKeys.PIECE: event['piece'],
+        }
+    messageDict[MessageKeys.VERSION] = event['version']
+    moves = event['moves']
+    messageDict[MessageKeys.MOVES] = groupMoves(moves) if protocol == PROTOCOL_DELTA else moves
+    return messageDict
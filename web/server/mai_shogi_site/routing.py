@@ -2,10 +2,13 @@ from django.urls import re_path
 
 from .consumers import VsComputerConsumer
 from .consumers import VsPlayerConsumer
+from .consumers import GameEngineConsumer
+from .engineShards import shardChannels
 
 websocket_urlpatterns = [
+    # the difficulty can be left off, or sent with the first message instead
     re_path(
-        r"^ws/game/computer/(?P<side>\w+)$",
+        r"^ws/game/computer/(?P<side>\w+)(?:/(?P<difficulty>\w+))?$",
         VsComputerConsumer.as_asgi(),
     ),
     re_path(
@@ -13,3 +16,9 @@ websocket_urlpatterns = [
         VsPlayerConsumer.as_asgi(),
     ),
 ]
+
+# the engine workers, python manage.py runworker with one or more of these
+engine_channel_routes = {
+    channel: GameEngineConsumer.as_asgi()
+    for channel in shardChannels()
+}
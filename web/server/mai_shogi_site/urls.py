@@ -4,5 +4,6 @@ from . import views
 
 urlpatterns = [
     path('', views.index, name='index'),
-    path('game/create', views.createGameCode)
+    path('game/create', views.createGameCode),
+    path('ai/stats', views.aiStats),
 ]
@@ -1,11 +1,13 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.template import loader
-from os import environ
-import redis
 
 import random
 import string
 
+from . import aiPool
+from . import gameStore
+from .engineShards import shardChannels
+
 # from enum import Enum
 
 # I want to use enums for the header keys, but python says that
@@ -40,29 +42,31 @@ def createGameCode(request):
     response.headers["PLAYER_ONE_CODE"] = playerOneCode
     response.headers["PLAYER_TWO_CODE"] = playerTwoCode
 
-    redisHost = environ.get('REDIS_HOST')
-    redisPort = environ.get('REDIS_PORT')
-    redisConn = redis.Redis(
-        host=redisHost,
-        port=redisPort,
-    )
     # the websocket connections can use their player codes to look up the
     # game code, which will allow their consumers to find out what group they
-    # are in
+    # are in, see gameStore.createGame
     gameCode = f'{playerOneCode}_{playerTwoCode}'
-    redisConn.set(playerOneCode, gameCode)
-    redisConn.set(playerTwoCode, gameCode)
-    # store the sente/gote info in redis as a dictionary
-    # which can be grabbed with conn.hgetall([key])
-    redisConn.hmset(gameCode, {
-        "sente": senteCode,
-        "gote": goteCode,
-        "playerOne": playerOneCode,
-        "playerTwo": playerTwoCode,
-    })
+    gameStore.createGame(gameStore.getRedis(), gameCode, senteCode, goteCode, playerOneCode, playerTwoCode)
     return response
 
 
+# how busy the computer opponent's worker pools are, the searches run in the
+# engine workers, which publish their pools' stats to redis
+# every shard is listed under "shards", the p99 is the worst of theirs and
+# budgetScale the most shrunk
+def aiStats(request):
+    shards = aiPool.shardStats(gameStore.getRedis(), shardChannels())
+    stats = list(shards.values())
+    return JsonResponse({
+        "queueDepth": int(sum(shard["queueDepth"] for shard in stats)),
+        "workers": int(sum(shard["workers"] for shard in stats)),
+        "latencyP99Ms": max((shard["latencyP99Ms"] for shard in stats), default=0.0),
+        "latencyTargetMs": aiPool.AI_LATENCY_TARGET_MS,
+        "budgetScale": min((shard["budgetScale"] for shard in stats), default=1.0),
+        "shards": shards,
+    })
+
+
 # https://stackoverflow.com/questions/2257441/random-string-generation-with-upper-case-letters-and-digits
 def makeRandomCode(size=16, chars=string.ascii_uppercase + string.digits):
     return ''.join(random.choice(chars) for _ in range(size))